@@ -0,0 +1,38 @@
+#!/bin/bash
+
+set -o pipefail
+
+# Builds the dependencies of a lambda into a zip shared by every lambda with the same
+# dependency set and prints its path. Prints nothing when the lambda has no dependencies.
+
+lambda_name=$1
+
+WORKSPACE=$(pwd)
+dependency_hash=$(python3 ${WORKSPACE}/bin/scripts/lambda_dependencies.py ${lambda_name}) || exit 1
+
+if [[ ! -n $dependency_hash ]]; then
+  exit 0
+fi
+
+# Wheels are picked for the interpreter that installs them
+python_tag=$(python3 -c 'import sys; print("py%d%d" % sys.version_info[:2])')
+cache_dir=${WORKSPACE}/build/dependencies
+dependency_zip=${cache_dir}/${python_tag}-${dependency_hash}.zip
+
+if [[ ! -f $dependency_zip ]]; then
+  mkdir -p $cache_dir
+  build_dir=$(mktemp -d ${cache_dir}/build.XXXXXX) || exit 1
+  trap 'rm -rf "$build_dir"' EXIT
+
+  echo "Building dependency set ${dependency_hash} for ${lambda_name}" >&2
+  python3 -m pip install --requirement ${WORKSPACE}/lambdas/src/${lambda_name}/requirements.txt \
+    --target ${build_dir}/package >&2 || exit 1
+  (cd ${build_dir}/package && zip -qr ../dependencies.zip .) >&2 || exit 1
+
+  # Parallel packaging stages may build the same set; the rename keeps the cached zip whole
+  mv ${build_dir}/dependencies.zip $dependency_zip || exit 1
+else
+  echo "Reusing dependency set ${dependency_hash} for ${lambda_name}" >&2
+fi
+
+echo $dependency_zip
@@ -3,5 +3,6 @@
 set -o pipefail
 
 pip install -r bin/scripts/requirements.txt
+pip install -r bin/scripts/test/requirements.txt
 export PYTHONPATH="${PYTHONPATH}:${WORKSPACE:-$(pwd)}/bin/scripts"
-pytest bin/scripts/test/test_lambda_changes.py -v
+pytest bin/scripts/test -v
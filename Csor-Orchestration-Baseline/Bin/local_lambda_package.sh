@@ -18,11 +18,13 @@ fi
 echo "Using lambda tag $lambda_tag"
 
 WORKSPACE=$(pwd)
+dependency_zip=$(bash ${WORKSPACE}/bin/ci/lambda_dependencies.sh ${lambda_name}) || exit 1
+
 cd ${WORKSPACE}/lambdas/src/${lambda_name}
-pip install --requirement requirements.txt --target package
-cd package
-zip -r ../${lambda_name}.zip .
-cd ..
+rm -f ${lambda_name}.zip
+if [[ -n $dependency_zip ]]; then
+  cp $dependency_zip ${lambda_name}.zip
+fi
 zip ${lambda_name}.zip *.py
 
 aws s3 cp ./${lambda_name}.zip s3://$bucket/$lambda_name/${lambda_name}-${lambda_tag}.zip
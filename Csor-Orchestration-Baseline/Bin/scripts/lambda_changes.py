@@ -1,69 +1,133 @@
 import os
 import json
 import hashlib
-import subprocess
-import shutil
+import time
 import tempfile
-import atexit
-import glob
 import argparse
 import traceback
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
 import boto3
 from botocore.exceptions import ClientError
 
+# The dependency hash is shared with bin/ci/lambda_dependencies.sh
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from lambda_dependencies import REQUIREMENTS_FILE, get_requirements_hash  # noqa: E402
+
 LAMBDAS_DIR = "lambdas/src"
 S3_HASH_FILE = "check_lambda_changes/lambda-hashes.json"
-FIXED_TIMESTAMP = "202001010000"
-BUILD_DIR = "build"
+EXCLUDED_DIRS = {"__pycache__"}
+EXCLUDED_SUFFIXES = (".pyc",)
+# Left in the Lambda directory by lambda_package.sh before the hashes are updated
+PACKAGING_OUTPUT = {"package", "version.json"}
+# requirements.txt is hashed on its own so dependency sets can be packaged once and shared between lambdas
+DEPENDENCY_HASHES_KEY = "dependencies"
 ORCHESTRATION_REGION="us-east-2"
+BUILD_DIR = "build"
+# Per-lambda hashes keyed by the path, size, mtime and mode of every file in the tree
+HASH_CACHE_FILE = os.path.join(BUILD_DIR, "lambda-hash-cache.json")
+HASH_WORKERS = int(os.environ.get("LAMBDA_HASH_WORKERS", os.cpu_count() or 1))
+# Files written this recently may change again within the same mtime tick, so they are not memoized
+RACY_WRITE_SECONDS = 2
 
-def normalize_timestamps(directory):
-    """Set all files to a fixed timestamp for deterministic ZIP creation"""
-    cmd = f"find {directory} -type f -exec touch -t {FIXED_TIMESTAMP} {{}} \\;"
-    subprocess.run(cmd, shell=True, check=True)
+def iter_lambda_files(source_dir):
+    """Yield the (relative path, path) of every source file of a Lambda, skipping caches and packaging output"""
+    for root, dirs, files in os.walk(source_dir):
+        dirs[:] = [d for d in dirs if d not in EXCLUDED_DIRS and not (root == source_dir and d in PACKAGING_OUTPUT)]
+        for name in files:
+            if name.endswith(EXCLUDED_SUFFIXES) or (root == source_dir and (
+                    name in PACKAGING_OUTPUT or name == REQUIREMENTS_FILE or name.endswith(".zip"))):
+                continue
+            path = os.path.join(root, name)
+            yield os.path.relpath(path, source_dir).replace(os.sep, "/"), path
 
 def get_lambda_hash(project):
-    """Calculate hash for a Lambda project"""
+    """Calculate hash for a Lambda project from its sorted relative paths, normalized modes and contents"""
     source_dir = os.path.join(LAMBDAS_DIR, project)
-    with tempfile.NamedTemporaryFile(suffix='.zip') as temp_zip:
-        output_zip_abs = os.path.abspath(temp_zip.name)
-        with tempfile.TemporaryDirectory() as temp_dir:
-            temp_source = os.path.join(temp_dir, os.path.basename(source_dir))
-            shutil.copytree(source_dir, temp_source)
-            normalize_timestamps(temp_source)
-            
-            current_dir = os.getcwd()
-            os.chdir(temp_dir)
-            cmd = f"find {os.path.basename(source_dir)} -type f | sort | zip -X -@ temp_lambda.zip > /dev/null 2>&1"
-            subprocess.run(cmd, shell=True, check=True)
-            os.chdir(current_dir)
-            
-            os.makedirs(os.path.dirname(output_zip_abs), exist_ok=True)
-            shutil.move(os.path.join(temp_dir, "temp_lambda.zip"), output_zip_abs)
-        
-        sha1_hash = hashlib.sha1()
-        with open(temp_zip.name, 'rb') as f:
-            for chunk in iter(lambda: f.read(4096), b''):
+    sha1_hash = hashlib.sha1()
+    for relative_path, path in sorted(iter_lambda_files(source_dir)):
+        # Only the executable bit survives a checkout, so other mode bits must not change the hash
+        mode = "755" if os.stat(path).st_mode & 0o111 else "644"
+        sha1_hash.update(f"{relative_path}\0{mode}\0{os.path.getsize(path)}\0".encode("utf-8"))
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b''):
                 sha1_hash.update(chunk)
-        return sha1_hash.hexdigest()
+    return sha1_hash.hexdigest()
+
+def get_dependency_hash(project):
+    """Hash the requirements of a Lambda, or return None when it has no dependencies"""
+    return get_requirements_hash(os.path.join(LAMBDAS_DIR, project, REQUIREMENTS_FILE))
+
+def get_tree_stat_key(project):
+    """Fingerprint a Lambda tree from file metadata only, returning it with the newest mtime in the tree"""
+    source_dir = os.path.join(LAMBDAS_DIR, project)
+    sha1_hash = hashlib.sha1()
+    newest_mtime = 0
+    for relative_path, path in sorted(iter_lambda_files(source_dir)):
+        stat = os.stat(path)
+        newest_mtime = max(newest_mtime, stat.st_mtime_ns)
+        sha1_hash.update(f"{relative_path}\0{stat.st_size}\0{stat.st_mtime_ns}\0{stat.st_mode & 0o111}\0".encode("utf-8"))
+    return sha1_hash.hexdigest(), newest_mtime
+
+def read_json_file(path):
+    """Read a local JSON file, treating a missing or corrupt file as empty"""
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def write_json_file(path, data):
+    """Atomically replace a local JSON file so concurrent runs never read a partial write"""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(temp_path, path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+def hash_lambdas(projects):
+    """Hash Lambda projects in a process pool, reusing cached hashes for trees whose files are unchanged"""
+    cache = read_json_file(HASH_CACHE_FILE)
+    hashes = {}
+    stale = {}
+    for project in projects:
+        stat_key, newest_mtime = get_tree_stat_key(project)
+        entry = cache.get(project, {})
+        if entry.get("statKey") == stat_key:
+            hashes[project] = entry["hash"]
+        else:
+            stale[project] = (stat_key, newest_mtime)
+
+    if not stale:
+        return hashes
 
-def cleanup_zip_files():
-    """Remove temporary ZIP files created during processing"""
-    zip_files = glob.glob(f"{BUILD_DIR}/*.zip")
-    for zip_file in zip_files:
-        try:
-            os.remove(zip_file)
-        except Exception:
-            pass
+    racy_after = time.time_ns() - RACY_WRITE_SECONDS * 1_000_000_000
+    with ProcessPoolExecutor(max_workers=max(1, min(HASH_WORKERS, len(stale)))) as executor:
+        for project, sha1sum in zip(stale, executor.map(get_lambda_hash, stale)):
+            hashes[project] = sha1sum
+            stat_key, newest_mtime = stale[project]
+            if newest_mtime < racy_after:
+                cache[project] = {"statKey": stat_key, "hash": sha1sum}
+            else:
+                cache.pop(project, None)
+
+    write_json_file(HASH_CACHE_FILE, cache)
+    return hashes
 
 def get_available_lambdas():
     """Get a list of all Lambda function names"""
     return [d for d in os.listdir(LAMBDAS_DIR) 
             if os.path.isdir(os.path.join(LAMBDAS_DIR, d)) and d != "__pycache__"]
 
-def assume_role(env=None):
-    """Assume AWS role for the specified account and environment"""
+def get_role_credentials(env=None):
+    """Assume AWS role for the specified environment and return its temporary credentials"""
     if env.startswith("tenant-"):
         env_name = env
     else:
@@ -95,8 +159,10 @@ def assume_role(env=None):
         RoleSessionName='LambdaChangeDetection'
     )
     
-    credentials = response['Credentials']
-    
+    return response['Credentials']
+
+def create_s3_client(credentials):
+    """Create an S3 client from assumed role credentials"""
     return boto3.client(
         's3',
         region_name=ORCHESTRATION_REGION,
@@ -132,19 +198,21 @@ def detect_lambda_changes(account_id=None, env=None):
     if account_id is None or env is None:
         return None
         
-    s3_client = assume_role(env)
+    credentials = get_role_credentials(env)
+    s3_client = create_s3_client(credentials)
     bucket = f"csor-baseline-{account_id}-lambda-artifacts"
     
     existing_hashes = get_hashes_from_s3(s3_client, bucket)
+    existing_dependency_hashes = existing_hashes.get(DEPENDENCY_HASHES_KEY, {})
     lambda_projects = get_available_lambdas()
+    lambda_hashes = hash_lambdas(lambda_projects)
     
     changed_lambdas = []
-    
     for project in lambda_projects:
-        sha1sum = get_lambda_hash(project)
-        existing_hash = existing_hashes.get(project)
-        
-        if existing_hash is None or existing_hash != sha1sum:
+        dependencies_changed = existing_dependency_hashes.get(project) != get_dependency_hash(project)
+        if dependencies_changed:
+            print(f"Dependency set changed for {project}")
+        if dependencies_changed or existing_hashes.get(project) != lambda_hashes[project]:
             changed_lambdas.append(project)
     
     return changed_lambdas
@@ -153,31 +221,34 @@ def update_lambda_hashes(account_id=None, env=None):
     """Update hashes in S3 after successful Lambda upload"""
     if account_id is None or env is None:
         return False
-        
-    s3_client = assume_role(env)
-    bucket = f"csor-baseline-{account_id}-lambda-artifacts"
     
-    existing_hashes = get_hashes_from_s3(s3_client, bucket)
-    updated_hashes = existing_hashes.copy()
+    # The role is assumed again rather than handed over by the detect step, so credentials never touch the workspace
+    credentials = get_role_credentials(env)
+    s3_client = create_s3_client(credentials)
+    bucket = f"csor-baseline-{account_id}-lambda-artifacts"
     
     lambda_projects = get_available_lambdas()
+    lambda_hashes = hash_lambdas(lambda_projects)
+    dependency_hashes = {project: get_dependency_hash(project) for project in lambda_projects}
     
-    for project in lambda_projects:
-        sha1sum = get_lambda_hash(project)
-        updated_hashes[project] = sha1sum
+    # Read the stored hashes right before writing them, so hashes stored by concurrent pipelines are kept
+    updated_hashes = get_hashes_from_s3(s3_client, bucket)
+    updated_hashes.update(lambda_hashes)
+    updated_hashes[DEPENDENCY_HASHES_KEY] = {**updated_hashes.get(DEPENDENCY_HASHES_KEY, {}), **dependency_hashes}
     
     update_hashes_in_s3(s3_client, bucket, updated_hashes)
     return True
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Check Lambda functions for changes using deterministic ZIP hashing.")
-    parser.add_argument("--env", type=str, required=True, help="Environment name for output formatting")
-    parser.add_argument("--account", type=str, required=True, help="AWS account ID for S3 bucket")
+    parser = argparse.ArgumentParser(description="Check Lambda functions for changes using deterministic content hashing.")
+    parser.add_argument("--env", type=str, help="Environment name for output formatting")
+    parser.add_argument("--account", type=str, help="AWS account ID for S3 bucket")
     parser.add_argument("--update-hashes", action="store_true", help="Update hashes in S3 for all Lambda functions")
     
     args = parser.parse_args()
     
-    atexit.register(cleanup_zip_files)
+    if not args.env or not args.account:
+        parser.error("--env and --account are required")
     
     try:
         if args.update_hashes:
@@ -0,0 +1,55 @@
+import os
+import re
+import sys
+import hashlib
+import argparse
+
+# Only the standard library is imported, bin/ci/lambda_dependencies.sh runs this outside the tooling image
+LAMBDAS_DIR = "lambdas/src"
+REQUIREMENTS_FILE = "requirements.txt"
+# pip reads these options from a requirements file, relative to the file that contains them
+INCLUDE_OPTION = re.compile(r'^(-r|--requirement|-c|--constraint)(?:\s*=\s*|\s+|(?<=^-[rc]))(\S+)$')
+CONSTRAINT_OPTIONS = {"-c", "--constraint"}
+
+def read_requirements(path, requirements, prefix="", seen=None):
+    """Add the normalized lines of a requirements file and of the files it includes to requirements"""
+    seen = set() if seen is None else seen
+    path = os.path.abspath(path)
+    if path in seen:
+        return
+    seen.add(path)
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            include = INCLUDE_OPTION.match(line)
+            if include:
+                # Constraints only pin versions, so they are hashed apart from the requirements
+                include_prefix = "constraint:" if include.group(1) in CONSTRAINT_OPTIONS else prefix
+                read_requirements(os.path.join(os.path.dirname(path), include.group(2)), requirements, include_prefix, seen)
+                continue
+            # Comments, blank lines, spacing, ordering and name casing do not change what gets installed
+            requirement = "".join(line.split()).lower()
+            if requirement:
+                requirements.add(prefix + requirement)
+
+def get_requirements_hash(path):
+    """Hash a requirements file with the files it includes, or return None when it has no dependencies"""
+    requirements = set()
+    try:
+        read_requirements(path, requirements)
+    except FileNotFoundError:
+        # A missing requirements.txt means no dependencies, a missing include is an error
+        if os.path.exists(path):
+            raise
+    if not requirements:
+        return None
+    return hashlib.sha256("\n".join(sorted(requirements)).encode("utf-8")).hexdigest()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print the dependency set hash of a Lambda, or nothing if it has no dependencies.")
+    parser.add_argument("lambda_name", type=str, help="Name of the Lambda directory in lambdas/src")
+
+    args = parser.parse_args()
+
+    print(get_requirements_hash(os.path.join(LAMBDAS_DIR, args.lambda_name, REQUIREMENTS_FILE)) or "")
+    sys.exit(0)
@@ -0,0 +1,241 @@
+import os
+import re
+import sys
+import json
+import logging
+import argparse
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import boto3
+import requests
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+
+# The extraction logic is shared with the network_hydrate lambda
+sys.path.insert(0, str(Path(__file__).resolve().parents[3]))
+from lambdas.src.network_hydrate import lambda_function as network_hydrate  # noqa: E402
+
+# Logging configuration
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+VARIABLE_DEFINITION = re.compile(r'\$(\w+):\s*([\w\[\]!]+)')
+VARIABLE_TYPES = dict(VARIABLE_DEFINITION.findall(network_hydrate.NETWORK_FOUNDATION_MUTATION.split('{', 1)[0]))
+
+
+def read_env_config():
+    """Read environment configuration file defined by ENVIRONMENT_JSON."""
+    env_json_path = os.getenv('ENVIRONMENT_JSON')
+    if not env_json_path:
+        logging.error('ENVIRONMENT_JSON environment variable not found.')
+        raise Exception('ENVIRONMENT_JSON environment variable not found.')
+    if not os.path.exists(env_json_path):
+        logging.error(f'ENVIRONMENT_JSON file not found at {env_json_path}')
+        raise Exception(f'ENVIRONMENT_JSON file not found at {env_json_path}')
+    with open(env_json_path) as json_file:
+        environment_json = json.load(json_file)
+    for field in ('sor_url', 'orchestration_aws_assume_role', 'sor_aws_region'):
+        if field not in environment_json:
+            logging.error(f'Required field {field} missing in ENVIRONMENT_JSON.')
+            raise Exception(f'Required field {field} missing in ENVIRONMENT_JSON.')
+    return environment_json
+
+
+def assume_role_session(role, region):
+    """Assume the orchestration role once and return a session used to sign the SOR requests."""
+    sts_client = boto3.client('sts')
+    response = sts_client.assume_role(RoleArn=role, RoleSessionName="sor_network_rehydrate")
+    return boto3.Session(
+        aws_access_key_id=response['Credentials']['AccessKeyId'],
+        aws_secret_access_key=response['Credentials']['SecretAccessKey'],
+        aws_session_token=response['Credentials']['SessionToken'],
+        region_name=region
+    )
+
+
+def list_tfstate_keys(s3_client, bucket, prefix, suffix):
+    """List the dimension tfstate keys of the bucket, keeping only dimensions known to network_hydrate."""
+    keys = []
+    for page in s3_client.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+        for s3_object in page.get('Contents', []):
+            key = s3_object['Key']
+            if not key.endswith(suffix):
+                continue
+            try:
+                network_hydrate.network_location(key)
+            except (IndexError, KeyError):
+                logging.info("Skipping %s, it is not a known dimension tfstate", key)
+                continue
+            keys.append(key)
+    return keys
+
+
+def read_payload(s3_client, bucket, key):
+    """Read the outputs of a tfstate and build its network foundation payload."""
+    response = s3_client.get_object(Bucket=bucket, Key=key)
+    try:
+        outputs = network_hydrate.read_top_level_member(
+            response['Body'].iter_chunks(network_hydrate.STREAM_CHUNK_SIZE), 'outputs'
+        )
+    finally:
+        response['Body'].close()
+    return network_hydrate.build_network_payload(key, outputs)
+
+
+def build_batch_mutation(payloads):
+    """Build one multi-operation setNetworkFoundation mutation for every payload."""
+    definitions = []
+    operations = []
+    variables = {}
+    for index, payload in enumerate(payloads):
+        arguments = []
+        for name, variable_type in VARIABLE_TYPES.items():
+            definitions.append(f"${name}{index}: {variable_type}")
+            arguments.append(f"{name}: ${name}{index}")
+            variables[f"{name}{index}"] = payload[name]
+        operations.append(f"set{index}: setNetworkFoundation({', '.join(arguments)}) {{ network {{ accountId region }} }}")
+    query = f"mutation BatchSetNetworkFoundation({', '.join(definitions)}) {{ {' '.join(operations)} }}"
+    return {"query": query, "variables": variables}
+
+
+def post_query(session, url, data):
+    """Send a signed GraphQL request to the SOR and return the decoded response."""
+    awsrequest = AWSRequest(method="POST", url=url, data=json.dumps(data))
+    SigV4Auth(session.get_credentials(), 'execute-api', session.region_name).add_auth(awsrequest)
+    resp = requests.request(
+        method="POST",
+        url=url,
+        data=json.dumps(data),
+        headers=dict(awsrequest.headers),
+        verify=False,
+        timeout=30
+    )
+    if resp.status_code != 200:
+        raise Exception(f"Request failed with status code {resp.status_code}. Response: {resp.text}")
+    return resp.json()
+
+
+def send_payload(session, url, payload):
+    """Send a single network foundation and return whether the SOR accepted it."""
+    try:
+        response = post_query(session, url, build_batch_mutation([payload]))
+    except Exception as err:
+        logging.error("Failed to hydrate %s in %s: %s", payload['accountId'], payload['region'], err)
+        return False
+    if response.get('errors'):
+        logging.error("GraphQL returned errors for %s in %s: %s", payload['accountId'], payload['region'], response['errors'])
+    return bool((response.get('data') or {}).get('set0'))
+
+
+def send_batch(session, url, payloads):
+    """Send a batch of network foundations to the SOR and return the indexes that failed."""
+    response = post_query(session, url, build_batch_mutation(payloads))
+    for error in response.get('errors', []):
+        if not error.get('path'):
+            raise Exception(f"GraphQL returned errors: {response}")
+        logging.error("GraphQL returned error for %s: %s", error['path'][0], error.get('message'))
+    result = response.get('data')
+    if result is None:
+        # A failed non-null field nulls every alias, so find the failing payloads one request at a time
+        logging.warning("SOR batch returned no data, hydrating %s tfstates one at a time", len(payloads))
+        return {index for index, payload in enumerate(payloads) if not send_payload(session, url, payload)}
+    return {index for index in range(len(payloads)) if not result.get(f"set{index}")}
+
+
+class Rehydrator:
+    """Read every dimension tfstate in parallel and send the network foundations to the SOR in batches."""
+
+    def __init__(self, s3_client, bucket, session=None, sor_url=None, batch_size=10, dry_run=False):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.session = session
+        self.sor_url = sor_url
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.counts = {'read': 0, 'unreadable': 0, 'hydrated': 0, 'failed': 0}
+        self.lock = threading.Lock()
+
+    def record(self, total, **increments):
+        """Update the progress counters and report progress."""
+        with self.lock:
+            for key, value in increments.items():
+                self.counts[key] += value
+            logging.info("Progress: %s of %s tfstates read %s", self.counts['read'] + self.counts['unreadable'], total, self.counts)
+
+    def send(self, keys, payloads, total):
+        """Send one batch of payloads, or log them in dry-run mode."""
+        if self.dry_run:
+            for key, payload in zip(keys, payloads):
+                logging.info("[dry-run] Would hydrate %s from %s: %s", payload['accountId'], key, payload)
+            self.record(total, hydrated=len(payloads))
+            return
+        try:
+            failed = send_batch(self.session, self.sor_url, payloads)
+        except Exception as err:
+            logging.error("Failed to hydrate batch of %s tfstates: %s", len(payloads), err)
+            failed = set(range(len(payloads)))
+        for index in sorted(failed):
+            logging.error("Failed to hydrate %s", keys[index])
+        self.record(total, hydrated=len(payloads) - len(failed), failed=len(failed))
+
+    def run(self, keys, workers):
+        """Read the tfstates with the given number of workers, sending a batch whenever enough payloads are read."""
+        total = len(keys)
+        pending = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(read_payload, self.s3_client, self.bucket, key): key for key in keys}
+            batches = []
+            for future in as_completed(futures):
+                key = futures[future]
+                try:
+                    pending.append((key, future.result()))
+                    self.record(total, read=1)
+                except Exception as err:
+                    logging.error("Failed to read %s: %s", key, err)
+                    self.record(total, unreadable=1)
+                if len(pending) >= self.batch_size:
+                    batches.append(executor.submit(self.send, *zip(*pending), total))
+                    pending = []
+            if pending:
+                batches.append(executor.submit(self.send, *zip(*pending), total))
+            for batch in batches:
+                batch.result()
+        return self.counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rehydrate the network foundation of every dimension from its tfstate.")
+    parser.add_argument("--bucket", required=True, help="Bucket holding the dimension-terraform tfstates")
+    parser.add_argument("--bucket-region", default="us-east-2", help="Region of the tfstate bucket")
+    parser.add_argument("--prefix", default="env:/", help="Prefix of the dimension tfstate keys")
+    parser.add_argument("--key-suffix", default=".tfstate", help="Suffix of the dimension tfstate keys")
+    parser.add_argument("--kube-api-additional-whitelist-cidrs", default="",
+                        help="Value of KUBE_API_ADDITIONAL_WHITELIST_CIDRS configured on the network_hydrate lambda")
+    parser.add_argument("--workers", type=int, default=16, help="Number of tfstates read in parallel")
+    parser.add_argument("--batch-size", type=int, default=10, help="Number of network foundations per SOR request")
+    parser.add_argument("--dry-run", action="store_true", help="Log the payloads without sending them")
+    args = parser.parse_args()
+
+    try:
+        os.environ['KUBE_API_ADDITIONAL_WHITELIST_CIDRS'] = args.kube_api_additional_whitelist_cidrs
+        # The tfstate bucket is read with the caller credentials, the SOR is called with the orchestration role
+        s3_client = boto3.client('s3', region_name=args.bucket_region)
+        session = sor_url = None
+        if not args.dry_run:
+            environment_json = read_env_config()
+            session = assume_role_session(environment_json['orchestration_aws_assume_role'], environment_json['sor_aws_region'])
+            sor_url = environment_json['sor_url']
+        keys = list_tfstate_keys(s3_client, args.bucket, args.prefix, args.key_suffix)
+        logging.info("Found %s dimension tfstates", len(keys))
+        rehydrator = Rehydrator(s3_client, args.bucket, session, sor_url, batch_size=args.batch_size, dry_run=args.dry_run)
+        counts = rehydrator.run(keys, args.workers)
+        logging.info("Rehydration completed: %s", counts)
+        if counts['unreadable'] or counts['failed']:
+            sys.exit(1)
+    except Exception as err:
+        logging.error("Unexpected error: %s", err)
+        raise
+
+
+if __name__ == "__main__":
+    main()
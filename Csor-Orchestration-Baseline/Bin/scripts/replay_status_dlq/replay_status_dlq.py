@@ -0,0 +1,275 @@
+import os
+import sys
+import json
+import logging
+import argparse
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+import requests
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+
+# The mutation is shared with the execution_reporter lambda, which needs an endpoint to load; requests go to sor_url
+os.environ.setdefault('SOR_ENDPOINT', 'https://sor.invalid')
+sys.path.insert(0, str(Path(__file__).resolve().parents[3]))
+from lambdas.src.execution_reporter import lambda_function as execution_reporter  # noqa: E402
+
+# Logging configuration
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# SQS returns at most 10 messages per receive and deletes at most 10 per batch
+MAX_MESSAGES_PER_BATCH = 10
+
+
+def read_env_config():
+    """Read environment configuration file defined by ENVIRONMENT_JSON."""
+    env_json_path = os.getenv('ENVIRONMENT_JSON')
+    if not env_json_path:
+        logging.error('ENVIRONMENT_JSON environment variable not found.')
+        raise Exception('ENVIRONMENT_JSON environment variable not found.')
+    if not os.path.exists(env_json_path):
+        logging.error(f'ENVIRONMENT_JSON file not found at {env_json_path}')
+        raise Exception(f'ENVIRONMENT_JSON file not found at {env_json_path}')
+    with open(env_json_path) as json_file:
+        environment_json = json.load(json_file)
+    for field in ('sor_url', 'orchestration_aws_assume_role', 'sor_aws_region'):
+        if field not in environment_json:
+            logging.error(f'Required field {field} missing in ENVIRONMENT_JSON.')
+            raise Exception(f'Required field {field} missing in ENVIRONMENT_JSON.')
+    return environment_json
+
+
+def assume_role_session(role, region):
+    """Assume the orchestration role once and return a session shared by all workers."""
+    sts_client = boto3.client('sts')
+    response = sts_client.assume_role(RoleArn=role, RoleSessionName="sor_status_dlq_replay")
+    return boto3.Session(
+        aws_access_key_id=response['Credentials']['AccessKeyId'],
+        aws_secret_access_key=response['Credentials']['SecretAccessKey'],
+        aws_session_token=response['Credentials']['SessionToken'],
+        region_name=region
+    )
+
+
+def post_query(session, url, query, variables):
+    """Send a signed GraphQL request to the SOR and return the decoded response."""
+    data = json.dumps({"query": query, "variables": variables})
+    awsrequest = AWSRequest(method="POST", url=url, data=data)
+    SigV4Auth(session.get_credentials(), 'execute-api', session.region_name).add_auth(awsrequest)
+    resp = requests.request(
+        method="POST",
+        url=url,
+        data=data,
+        headers=dict(awsrequest.headers),
+        verify=False,
+        timeout=10
+    )
+    if resp.status_code != 200:
+        raise Exception(f"Request failed with status code {resp.status_code}. Response: {resp.text}")
+    return resp.json()
+
+
+def send_update(session, url, update):
+    """Send a single status update and return whether the SOR accepted it."""
+    try:
+        response = post_query(session, url, *execution_reporter.build_batch_mutation([update]))
+    except Exception as err:
+        logging.error("Failed to replay %s: %s", update[0], err)
+        return False
+    if response.get('errors'):
+        logging.error("GraphQL returned errors for %s: %s", update[0], response['errors'])
+    return bool((response.get('data') or {}).get('update0'))
+
+
+def send_batch(session, url, updates):
+    """Send a batch of status updates to the SOR and return the indexes that failed."""
+    response = post_query(session, url, *execution_reporter.build_batch_mutation(updates))
+    for error in response.get('errors', []):
+        if not error.get('path'):
+            raise Exception(f"GraphQL returned errors: {response}")
+        logging.error("GraphQL returned error for %s: %s", error['path'][0], error.get('message'))
+    result = response.get('data')
+    if result is None:
+        # A failed non-null field nulls every alias, so find the failing updates one request at a time
+        logging.warning("SOR batch returned no data, replaying %s updates one at a time", len(updates))
+        return {index for index, update in enumerate(updates) if not send_update(session, url, update)}
+    return {index for index in range(len(updates)) if not result.get(f"update{index}")}
+
+
+class Replayer:
+    """
+    Drain the status DLQ with several workers, each replaying one SQS batch per SOR request.
+
+    Every event is claimed in the execution state table first, as the execution reporter does, so events
+    superseded by a later status are skipped instead of moving the SOR and the status view back.
+    """
+
+    def __init__(self, session, sor_url, queue_url, state_table, dry_run=False, status_view_table=None,
+                 execution_type=None):
+        self.session = session
+        self.sor_url = sor_url
+        self.queue_url = queue_url
+        self.dry_run = dry_run
+        self.sqs_client = session.client('sqs')
+        self.state_table = session.resource('dynamodb').Table(state_table)
+        self.status_view = session.resource('dynamodb').Table(status_view_table) if status_view_table else None
+        self.execution_type = execution_type
+        self.counts = {'replayed': 0, 'skipped': 0, 'failed': 0, 'malformed': 0, 'undeleted': 0}
+        self.seen = set()
+        self.lock = threading.Lock()
+
+    def record(self, **increments):
+        """Update the progress counters and report progress."""
+        with self.lock:
+            for key, value in increments.items():
+                self.counts[key] += value
+            logging.info("Progress: %s", self.counts)
+
+    def replay_batch(self, messages):
+        """Replay a batch of DLQ messages and delete the ones the SOR accepted or a later status superseded."""
+        claims = []
+        superseded = []
+        failed_claims = 0
+        malformed = 0
+        for message in messages:
+            try:
+                event = json.loads(message['Body'])
+                event['detail']['executionArn'], event['detail']['status']
+            except (KeyError, TypeError, ValueError):
+                logging.error("Skipping malformed message %s", message.get('MessageId'))
+                malformed += 1
+                continue
+            if self.dry_run:
+                claims.append((event, message['ReceiptHandle'], None))
+                continue
+            try:
+                accepted, previous = execution_reporter.claim_execution_status(event, table=self.state_table)
+            except Exception as err:
+                logging.error("Failed to claim %s: %s", event['detail']['executionArn'], err)
+                failed_claims += 1
+                continue
+            if accepted:
+                claims.append((event, message['ReceiptHandle'], previous))
+            else:
+                logging.info("Skipping superseded status %s of %s",
+                             event['detail']['status'], event['detail']['executionArn'])
+                superseded.append(message['ReceiptHandle'])
+        updates = [(event['detail']['executionArn'], event['detail']['status']) for event, _, _ in claims]
+
+        if self.dry_run:
+            for execution_arn, execution_status in updates:
+                logging.info("[dry-run] Would set %s to %s", execution_arn, execution_status)
+            self.record(replayed=len(updates), malformed=malformed)
+            return
+
+        try:
+            failed = send_batch(self.session, self.sor_url, updates) if updates else set()
+        except Exception as err:
+            logging.error("Failed to replay batch of %s updates: %s", len(updates), err)
+            failed = set(range(len(updates)))
+
+        succeeded = []
+        for index, (event, receipt, previous) in enumerate(claims):
+            if index in failed:
+                execution_reporter.release_execution_status(event, previous, table=self.state_table)
+                continue
+            self.mark_reported(event)
+            self.update_status_view(event)
+            succeeded.append(receipt)
+        self.record(replayed=len(succeeded), skipped=len(superseded), failed=len(failed) + failed_claims,
+                    malformed=malformed, undeleted=self.delete_messages(succeeded + superseded))
+
+    def mark_reported(self, event):
+        """Mark a replayed status as reported so redeliveries of it are dropped by the execution reporter."""
+        try:
+            execution_reporter.mark_execution_status_reported(event, table=self.state_table)
+        except Exception as err:
+            logging.error("Failed to mark %s as reported: %s", event['detail']['executionArn'], err)
+
+    def update_status_view(self, event):
+        """Bring the latest status view in line with a replayed status, as the execution reporter would."""
+        if self.status_view is None:
+            return
+        try:
+            execution_reporter.update_status_view(event, table=self.status_view, execution_type=self.execution_type)
+        except Exception as err:
+            logging.error("Failed to update the status view for %s: %s", event['detail']['executionArn'], err)
+
+    def delete_messages(self, receipts):
+        """Delete replayed messages and return how many are left in the queue and will be replayed again."""
+        undeleted = 0
+        for start in range(0, len(receipts), MAX_MESSAGES_PER_BATCH):
+            chunk = receipts[start:start + MAX_MESSAGES_PER_BATCH]
+            try:
+                response = self.sqs_client.delete_message_batch(
+                    QueueUrl=self.queue_url,
+                    Entries=[{'Id': str(index), 'ReceiptHandle': receipt} for index, receipt in enumerate(chunk)]
+                )
+            except Exception as err:
+                logging.error("Failed to delete %s replayed messages: %s", len(chunk), err)
+                undeleted += len(chunk)
+                continue
+            for failure in response.get('Failed', []):
+                logging.error("Failed to delete replayed message %s: %s %s",
+                              failure['Id'], failure.get('Code'), failure.get('Message'))
+            undeleted += len(response.get('Failed', []))
+        return undeleted
+
+    def claim_unseen(self, messages):
+        """Return the messages not yet handled in this run so failed or dry-run messages are not replayed twice."""
+        with self.lock:
+            unseen = [message for message in messages if message['MessageId'] not in self.seen]
+            self.seen.update(message['MessageId'] for message in unseen)
+        return unseen
+
+    def drain(self):
+        """Receive batches until the queue is empty or only returns messages already handled."""
+        while True:
+            response = self.sqs_client.receive_message(
+                QueueUrl=self.queue_url,
+                MaxNumberOfMessages=MAX_MESSAGES_PER_BATCH,
+                WaitTimeSeconds=1,
+                VisibilityTimeout=60
+            )
+            messages = self.claim_unseen(response.get('Messages', []))
+            if not messages:
+                return
+            self.replay_batch(messages)
+
+    def run(self, workers):
+        """Drain the queue with the given number of workers and return the final counts."""
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for future in [executor.submit(self.drain) for _ in range(workers)]:
+                future.result()
+        return self.counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay execution status updates from the execution reporter DLQ to the SOR.")
+    parser.add_argument("--queue-url", required=True, help="URL of the execution status DLQ")
+    parser.add_argument("--workers", type=int, default=4, help="Number of batches replayed in parallel")
+    parser.add_argument("--dry-run", action="store_true", help="Log the updates without sending them or deleting messages")
+    parser.add_argument("--state-table", required=True,
+                        help="Execution state table of the execution reporter, used to skip superseded statuses")
+    parser.add_argument("--status-view-table", help="Latest status view table of the execution reporter to update")
+    parser.add_argument("--execution-type", default="BASELINE", help="EXECUTION_TYPE of the execution reporter that owns the DLQ")
+    args = parser.parse_args()
+
+    try:
+        environment_json = read_env_config()
+        session = assume_role_session(environment_json['orchestration_aws_assume_role'], environment_json['sor_aws_region'])
+        replayer = Replayer(session, environment_json['sor_url'], args.queue_url, args.state_table, dry_run=args.dry_run,
+                            status_view_table=args.status_view_table, execution_type=args.execution_type)
+        counts = replayer.run(args.workers)
+        logging.info("Replay completed: %s", counts)
+        if counts['undeleted']:
+            logging.warning("%s replayed messages could not be deleted and will be replayed again", counts['undeleted'])
+    except Exception as err:
+        logging.error("Unexpected error: %s", err)
+        raise
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""Unit tests for the lambda change detection script."""
+import importlib.util
+import json
+import os
+import sys
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+from pytest import fixture
+
+# Load the script itself rather than the copy that sits next to this test
+SPEC = importlib.util.spec_from_file_location(
+    "lambda_changes_script", Path(__file__).resolve().parents[1] / "lambda_changes.py")
+lambda_changes = importlib.util.module_from_spec(SPEC)
+# Registered so the process pool can pickle references to the module's functions
+sys.modules[SPEC.name] = lambda_changes
+SPEC.loader.exec_module(lambda_changes)
+
+
+@fixture(name="lambdas_dir")
+def create_lambdas_dir(tmp_path, monkeypatch):
+    """Create a small Lambda source tree and point the script at it."""
+    source = tmp_path / "src" / "sample"
+    (source / "helpers").mkdir(parents=True)
+    (source / "lambda_function.py").write_text("def lambda_handler(event, context):\n    return event\n")
+    (source / "helpers" / "util.py").write_text("VALUE = 1\n")
+    (source / "requirements.txt").write_text("boto3==1.33.13\n")
+    # Old enough that the hashes are memoized
+    for path in source.rglob("*"):
+        os.utime(path, (1_600_000_000, 1_600_000_000))
+    monkeypatch.setattr(lambda_changes, "LAMBDAS_DIR", str(tmp_path / "src"))
+    monkeypatch.setattr(lambda_changes, "HASH_CACHE_FILE", str(tmp_path / "build" / "hash-cache.json"))
+    return tmp_path / "src"
+
+
+def test_hash_is_stable(lambdas_dir):
+    """The same tree hashes the same way every time."""
+    assert lambda_changes.get_lambda_hash("sample") == lambda_changes.get_lambda_hash("sample")
+
+
+def test_hash_changes_with_contents(lambdas_dir):
+    """Editing a source file changes the hash."""
+    before = lambda_changes.get_lambda_hash("sample")
+    (lambdas_dir / "sample" / "helpers" / "util.py").write_text("VALUE = 2\n")
+    assert lambda_changes.get_lambda_hash("sample") != before
+
+
+def test_hash_changes_with_path(lambdas_dir):
+    """Renaming a file changes the hash even though the contents do not."""
+    before = lambda_changes.get_lambda_hash("sample")
+    os.rename(lambdas_dir / "sample" / "helpers" / "util.py", lambdas_dir / "sample" / "helpers" / "utils.py")
+    assert lambda_changes.get_lambda_hash("sample") != before
+
+
+def test_hash_uses_executable_bit_only(lambdas_dir):
+    """Only the executable bit of the mode is part of the hash."""
+    handler = lambdas_dir / "sample" / "lambda_function.py"
+    before = lambda_changes.get_lambda_hash("sample")
+    handler.chmod(0o600)
+    assert lambda_changes.get_lambda_hash("sample") == before
+    handler.chmod(0o755)
+    assert lambda_changes.get_lambda_hash("sample") != before
+
+
+def test_hash_ignores_caches_and_packaging(lambdas_dir):
+    """Bytecode and the output of lambda_package.sh do not change the hash."""
+    source = lambdas_dir / "sample"
+    before = lambda_changes.get_lambda_hash("sample")
+    (source / "__pycache__").mkdir()
+    (source / "__pycache__" / "lambda_function.cpython-311.pyc").write_bytes(b"\x00")
+    (source / "helpers" / "util.pyc").write_bytes(b"\x00")
+    (source / "package" / "boto3").mkdir(parents=True)
+    (source / "package" / "boto3" / "__init__.py").write_text("")
+    (source / "sample.zip").write_bytes(b"PK")
+    (source / "version.json").write_text('{"tag": "1"}')
+    assert lambda_changes.get_lambda_hash("sample") == before
+
+
+def test_hash_lambdas_memoizes_unchanged_trees(lambdas_dir):
+    """Unchanged trees are served from the cache and edited ones are hashed again."""
+    expected = lambda_changes.get_lambda_hash("sample")
+    assert lambda_changes.hash_lambdas(["sample"]) == {"sample": expected}
+
+    with patch.object(lambda_changes, "ProcessPoolExecutor", side_effect=AssertionError("cache miss")):
+        assert lambda_changes.hash_lambdas(["sample"]) == {"sample": expected}
+
+    (lambdas_dir / "sample" / "lambda_function.py").write_text("def lambda_handler(event, context):\n    return None\n")
+    assert lambda_changes.hash_lambdas(["sample"]) == {"sample": lambda_changes.get_lambda_hash("sample")}
+    assert lambda_changes.hash_lambdas(["sample"])["sample"] != expected
+
+
+def test_detect_leaves_no_credentials_behind(lambdas_dir):
+    """The assumed role credentials are never written to the workspace."""
+    credentials = {"AccessKeyId": "AKIA", "SecretAccessKey": "secret", "SessionToken": "token"}
+    with patch.object(lambda_changes, "get_role_credentials", return_value=credentials), \
+            patch.object(lambda_changes, "create_s3_client", return_value=MagicMock()), \
+            patch.object(lambda_changes, "get_hashes_from_s3", return_value={}):
+        assert lambda_changes.detect_lambda_changes("123", "dev") == ["sample"]
+
+    for path in lambdas_dir.parent.rglob("*"):
+        if path.is_file():
+            assert "secret" not in path.read_text(errors="ignore")
+
+
+def test_update_keeps_hashes_stored_concurrently(lambdas_dir):
+    """The update step assumes the role again and merges into the hashes stored when it writes."""
+    s3_client = MagicMock()
+    stored_at_detect = {"sample": "old"}
+    stored_at_update = {"sample": "old", "other": "abc", "dependencies": {"other": "def"}}
+    with patch.object(lambda_changes, "get_role_credentials", return_value={}) as get_credentials, \
+            patch.object(lambda_changes, "create_s3_client", return_value=s3_client), \
+            patch.object(lambda_changes, "get_hashes_from_s3", side_effect=[stored_at_detect, stored_at_update]):
+        assert lambda_changes.detect_lambda_changes("123", "dev") == ["sample"]
+        assert lambda_changes.update_lambda_hashes("123", "dev")
+
+    assert get_credentials.call_count == 2
+    stored = json.loads(s3_client.put_object.call_args.kwargs["Body"])
+    assert stored == {
+        "sample": lambda_changes.get_lambda_hash("sample"),
+        "other": "abc",
+        "dependencies": {"other": "def", "sample": lambda_changes.get_dependency_hash("sample")},
+    }
+
+
+def test_dependency_hash_normalizes_requirements(lambdas_dir):
+    """Formatting of requirements.txt does not change the dependency hash, versions do."""
+    requirements = lambdas_dir / "sample" / "requirements.txt"
+    requirements.write_text("requests==2.32.0\nboto3==1.33.13\n")
+    before = lambda_changes.get_dependency_hash("sample")
+    requirements.write_text("# pinned for the runtime\nBoto3 == 1.33.13\n\nrequests==2.32.0  # http\n")
+    assert lambda_changes.get_dependency_hash("sample") == before
+    requirements.write_text("requests==2.32.0\nboto3==1.36.18\n")
+    assert lambda_changes.get_dependency_hash("sample") != before
+    requirements.write_text("\n")
+    assert lambda_changes.get_dependency_hash("sample") is None
+
+
+def test_dependency_change_is_detected_separately(lambdas_dir):
+    """A requirements bump leaves the source hash alone but still marks the lambda changed."""
+    source_hash = lambda_changes.get_lambda_hash("sample")
+    stored = {"sample": source_hash, "dependencies": {"sample": lambda_changes.get_dependency_hash("sample")}}
+    with patch.object(lambda_changes, "get_role_credentials", return_value={}), \
+            patch.object(lambda_changes, "create_s3_client", return_value=MagicMock()), \
+            patch.object(lambda_changes, "get_hashes_from_s3", return_value=stored):
+        assert lambda_changes.detect_lambda_changes("123", "dev") == []
+
+        (lambdas_dir / "sample" / "requirements.txt").write_text("boto3==1.36.18\n")
+        assert lambda_changes.get_lambda_hash("sample") == source_hash
+        assert lambda_changes.detect_lambda_changes("123", "dev") == ["sample"]
@@ -0,0 +1,52 @@
+"""Unit tests for the lambda dependency set hashing script."""
+import importlib.util
+import sys
+from pathlib import Path
+import pytest
+
+SPEC = importlib.util.spec_from_file_location(
+    "lambda_dependencies", Path(__file__).resolve().parents[1] / "lambda_dependencies.py")
+lambda_dependencies = importlib.util.module_from_spec(SPEC)
+sys.modules[SPEC.name] = lambda_dependencies
+SPEC.loader.exec_module(lambda_dependencies)
+
+
+def test_included_files_change_the_hash(tmp_path):
+    """Requirements and constraints pulled in with -r and -c are part of the hash."""
+    (tmp_path / "shared").mkdir()
+    (tmp_path / "shared" / "common.txt").write_text("requests==2.32.0\n")
+    (tmp_path / "shared" / "pins.txt").write_text("urllib3==2.2.1\n")
+    requirements = tmp_path / "requirements.txt"
+    requirements.write_text("boto3==1.33.13\n-r shared/common.txt\n--constraint=shared/pins.txt\n")
+    before = lambda_dependencies.get_requirements_hash(str(requirements))
+
+    (tmp_path / "shared" / "common.txt").write_text("requests==2.32.3\n")
+    assert lambda_dependencies.get_requirements_hash(str(requirements)) != before
+    (tmp_path / "shared" / "common.txt").write_text("requests==2.32.0\n")
+    assert lambda_dependencies.get_requirements_hash(str(requirements)) == before
+    (tmp_path / "shared" / "pins.txt").write_text("urllib3==2.2.2\n")
+    assert lambda_dependencies.get_requirements_hash(str(requirements)) != before
+
+
+def test_include_matches_inlined_requirements(tmp_path):
+    """Moving requirements to an included file installs the same set, so the hash is the same."""
+    (tmp_path / "inline.txt").write_text("boto3==1.33.13\nrequests==2.32.0\n")
+    (tmp_path / "common.txt").write_text("requests==2.32.0\n")
+    (tmp_path / "included.txt").write_text("boto3==1.33.13\n-rcommon.txt\n")
+    assert lambda_dependencies.get_requirements_hash(str(tmp_path / "included.txt")) == \
+        lambda_dependencies.get_requirements_hash(str(tmp_path / "inline.txt"))
+
+
+def test_missing_include_is_an_error(tmp_path):
+    """A missing included file fails the hash instead of being ignored."""
+    (tmp_path / "requirements.txt").write_text("-r missing.txt\n")
+    with pytest.raises(FileNotFoundError):
+        lambda_dependencies.get_requirements_hash(str(tmp_path / "requirements.txt"))
+    assert lambda_dependencies.get_requirements_hash(str(tmp_path / "absent.txt")) is None
+
+
+def test_include_cycles_are_read_once(tmp_path):
+    """Files including each other do not recurse forever."""
+    (tmp_path / "a.txt").write_text("boto3==1.33.13\n-r b.txt\n")
+    (tmp_path / "b.txt").write_text("requests==2.32.0\n-r a.txt\n")
+    assert lambda_dependencies.get_requirements_hash(str(tmp_path / "a.txt"))
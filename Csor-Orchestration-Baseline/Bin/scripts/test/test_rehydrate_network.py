@@ -0,0 +1,107 @@
+"""Unit tests for the network foundation rehydration script."""
+import importlib.util
+import json
+import sys
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+from pytest import fixture
+import boto3
+from moto import mock_s3
+
+SPEC = importlib.util.spec_from_file_location(
+    "rehydrate_network", Path(__file__).resolve().parents[1] / "rehydrate_network" / "rehydrate_network.py")
+rehydrate_network = importlib.util.module_from_spec(SPEC)
+sys.modules[SPEC.name] = rehydrate_network
+SPEC.loader.exec_module(rehydrate_network)
+
+REGION = "us-east-2"
+BUCKET = "tfstates"
+SOR_URL = "https://sor.example.com/graphql"
+KEYS = ["env:/dev-us-east-2/network.tfstate", "env:/qa-us-west-2/network.tfstate"]
+OUTPUT_NAMES = (
+    "vpc_id", "public_subnet_ids", "private_subnet_ids", "private_eks_subnet_ids", "vpc_cidr", "vpc_cidr_allocation",
+    "private_zone_id", "dimension_private_zone_id", "braintree_api_com_zone_id", "fdfg_sftp_whitelist_cidrs",
+    "vpc_dns_addr", "availability_zones_dsv", "asm_endpoint_ips", "autoscaling_endpoint_ips",
+    "cloudformation_endpoint_ips", "dynamodb_endpoint_cidr_blocks", "ec2_endpoint_ips",
+    "elasticloadbalancing_endpoint_ips", "s3_endpoint_cidr_blocks", "sts_endpoint_ips", "logs_endpoint_ips",
+    "efs_endpoint_ips", "sqs_endpoint_ips",
+)
+
+
+def tfstate(vpc_id):
+    """Build a minimal dimension-terraform tfstate document."""
+    outputs = {name: {"value": f"{name}-value"} for name in OUTPUT_NAMES}
+    outputs["vpc_id"]["value"] = vpc_id
+    outputs["bastion_whitelist_cidrs_dsv"] = {"value": "10.0.0.0/24"}
+    return {"version": 4, "outputs": outputs}
+
+
+def sor_response(payload, status_code=200):
+    """Build a response of the SOR API."""
+    response = MagicMock(status_code=status_code, text=json.dumps(payload))
+    response.json.return_value = payload
+    return response
+
+
+@fixture(name="bucket")
+def create_bucket(monkeypatch):
+    """Create a tfstate bucket holding two dimension tfstates and an unrelated object."""
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("KUBE_API_ADDITIONAL_WHITELIST_CIDRS", "")
+    with mock_s3():
+        session = boto3.Session(region_name=REGION)
+        s3_client = session.client("s3")
+        s3_client.create_bucket(Bucket=BUCKET, CreateBucketConfiguration={"LocationConstraint": REGION})
+        for key in KEYS:
+            s3_client.put_object(Bucket=BUCKET, Key=key, Body=json.dumps(tfstate(f"vpc-{key.split('/')[1]}")))
+        s3_client.put_object(Bucket=BUCKET, Key="env:/unknown-us-east-2/network.tfstate", Body="{}")
+        yield session, s3_client
+
+
+def test_list_tfstate_keys_skips_unknown_dimensions(bucket):
+    """Only tfstates of dimensions known to network_hydrate are listed."""
+    _, s3_client = bucket
+    assert sorted(rehydrate_network.list_tfstate_keys(s3_client, BUCKET, "env:/", ".tfstate")) == KEYS
+
+
+def test_run_sends_batches(bucket):
+    """Every tfstate is read and its network foundation sent to the SOR."""
+    session, s3_client = bucket
+    response = sor_response({"data": {"set0": {"network": {}}, "set1": {"network": {}}}})
+    with patch.object(rehydrate_network.requests, "request", return_value=response) as request:
+        counts = rehydrate_network.Rehydrator(s3_client, BUCKET, session, SOR_URL, batch_size=2).run(KEYS, 2)
+
+    assert counts == {"read": 2, "unreadable": 0, "hydrated": 2, "failed": 0}
+    variables = json.loads(request.call_args.kwargs["data"])["variables"]
+    assert {variables["vpcId0"], variables["vpcId1"]} == {"vpc-dev-us-east-2", "vpc-qa-us-west-2"}
+
+
+def test_run_falls_back_when_batch_is_nulled(bucket):
+    """A batch nulled by one bad tfstate is sent one tfstate at a time, so only that one fails."""
+    session, s3_client = bucket
+
+    def respond(**kwargs):
+        variables = json.loads(kwargs["data"])["variables"]
+        if "vpcId1" in variables:
+            return sor_response({"data": None, "errors": [{"message": "Invalid vpcCidr", "path": ["set1"]}]})
+        if variables["vpcId0"] == "vpc-qa-us-west-2":
+            return sor_response({"data": None, "errors": [{"message": "Invalid vpcCidr", "path": ["set0"]}]})
+        return sor_response({"data": {"set0": {"network": {}}}})
+
+    with patch.object(rehydrate_network.requests, "request", side_effect=respond) as request:
+        counts = rehydrate_network.Rehydrator(s3_client, BUCKET, session, SOR_URL, batch_size=2).run(KEYS, 2)
+
+    assert request.call_count == 3
+    assert counts == {"read": 2, "unreadable": 0, "hydrated": 1, "failed": 1}
+
+
+def test_run_counts_unreadable_tfstates(bucket):
+    """A tfstate without outputs is counted as unreadable and never sent."""
+    session, s3_client = bucket
+    s3_client.put_object(Bucket=BUCKET, Key=KEYS[1], Body=json.dumps({"version": 4}))
+    with patch.object(rehydrate_network.requests, "request") as request:
+        counts = rehydrate_network.Rehydrator(s3_client, BUCKET, dry_run=True, batch_size=10).run(KEYS, 2)
+
+    request.assert_not_called()
+    assert counts == {"read": 1, "unreadable": 1, "hydrated": 1, "failed": 0}
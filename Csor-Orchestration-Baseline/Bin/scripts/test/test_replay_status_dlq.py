@@ -0,0 +1,173 @@
+"""Unit tests for the execution status DLQ replay script."""
+import importlib.util
+import json
+import sys
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+from pytest import fixture
+import boto3
+from moto import mock_dynamodb, mock_sqs
+
+SPEC = importlib.util.spec_from_file_location(
+    "replay_status_dlq", Path(__file__).resolve().parents[1] / "replay_status_dlq" / "replay_status_dlq.py")
+replay_status_dlq = importlib.util.module_from_spec(SPEC)
+sys.modules[SPEC.name] = replay_status_dlq
+SPEC.loader.exec_module(replay_status_dlq)
+
+REGION = "us-east-2"
+SOR_URL = "https://sor.example.com/graphql"
+
+
+def sor_response(payload, status_code=200):
+    """Build a response of the SOR API."""
+    response = MagicMock(status_code=status_code, text=json.dumps(payload))
+    response.json.return_value = payload
+    return response
+
+
+STATE_TABLE = "execution-state"
+
+
+def status_message(execution_arn, status="SUCCEEDED", time="2019-02-26T19:42:21Z"):
+    """Build the body of an execution status change the reporter sent to the DLQ."""
+    return json.dumps({"time": time, "detail": {"executionArn": execution_arn, "status": status}})
+
+
+def create_table(session, name, key):
+    """Create a DynamoDB table with a single string hash key."""
+    session.client("dynamodb").create_table(
+        TableName=name,
+        AttributeDefinitions=[{"AttributeName": key, "AttributeType": "S"}],
+        KeySchema=[{"AttributeName": key, "KeyType": "HASH"}],
+        BillingMode="PAY_PER_REQUEST")
+
+
+@fixture(name="queue")
+def create_queue(monkeypatch):
+    """Create a DLQ holding two status updates, the execution state table and a session able to read both."""
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with mock_sqs(), mock_dynamodb():
+        session = boto3.Session(region_name=REGION)
+        create_table(session, STATE_TABLE, "ExecutionArn")
+        sqs = session.client("sqs")
+        queue_url = sqs.create_queue(QueueName="status-dlq")["QueueUrl"]
+        for execution_arn in ("arn-1", "arn-2"):
+            sqs.send_message(QueueUrl=queue_url, MessageBody=status_message(execution_arn))
+        yield session, queue_url
+
+
+def queue_size(session, queue_url):
+    """Count the messages left in the queue, including the ones that are in flight."""
+    attributes = session.client("sqs").get_queue_attributes(
+        QueueUrl=queue_url,
+        AttributeNames=["ApproximateNumberOfMessages", "ApproximateNumberOfMessagesNotVisible"])["Attributes"]
+    return int(attributes["ApproximateNumberOfMessages"]) + int(attributes["ApproximateNumberOfMessagesNotVisible"])
+
+
+def test_replay_deletes_accepted_messages(queue):
+    """Accepted updates are deleted and the failed one stays in the queue."""
+    session, queue_url = queue
+    response = sor_response({
+        "data": {"update0": {"arn": "arn-1", "status": "SUCCEEDED"}, "update1": None},
+        "errors": [{"message": "Execution not found", "path": ["update1"]}],
+    })
+    with patch.object(replay_status_dlq.requests, "request", return_value=response) as request:
+        counts = replay_status_dlq.Replayer(session, SOR_URL, queue_url, STATE_TABLE).run(1)
+
+    assert counts == {"replayed": 1, "skipped": 0, "failed": 1, "malformed": 0, "undeleted": 0}
+    assert json.loads(request.call_args.kwargs["data"])["variables"]["executionArn1"] == "arn-2"
+    assert queue_size(session, queue_url) == 1
+
+
+def test_replay_falls_back_when_batch_is_nulled(queue):
+    """A batch nulled by one failing update is replayed one update at a time."""
+    session, queue_url = queue
+    responses = [
+        sor_response({"data": None, "errors": [{"message": "Execution not found", "path": ["update1"]}]}),
+        sor_response({"data": {"update0": {"arn": "arn-1", "status": "SUCCEEDED"}}}),
+        sor_response({"data": None, "errors": [{"message": "Execution not found", "path": ["update0"]}]}),
+    ]
+    with patch.object(replay_status_dlq.requests, "request", side_effect=responses):
+        counts = replay_status_dlq.Replayer(session, SOR_URL, queue_url, STATE_TABLE).run(1)
+
+    assert counts == {"replayed": 1, "skipped": 0, "failed": 1, "malformed": 0, "undeleted": 0}
+    assert queue_size(session, queue_url) == 1
+
+
+def test_replay_reports_failed_deletes(queue):
+    """Messages that were replayed but not deleted are counted."""
+    session, queue_url = queue
+    replayer = replay_status_dlq.Replayer(session, SOR_URL, queue_url, STATE_TABLE)
+    replayer.sqs_client = MagicMock(wraps=replayer.sqs_client)
+    replayer.sqs_client.delete_message_batch.return_value = {
+        "Successful": [{"Id": "0"}],
+        "Failed": [{"Id": "1", "Code": "ReceiptHandleIsInvalid", "Message": "Expired", "SenderFault": True}],
+    }
+    response = sor_response({"data": {"update0": {"arn": "arn-1"}, "update1": {"arn": "arn-2"}}})
+    with patch.object(replay_status_dlq.requests, "request", return_value=response):
+        counts = replayer.run(1)
+
+    assert counts == {"replayed": 2, "skipped": 0, "failed": 0, "malformed": 0, "undeleted": 1}
+
+
+def test_dry_run_keeps_messages(queue):
+    """A dry run never calls the SOR nor deletes messages."""
+    session, queue_url = queue
+    with patch.object(replay_status_dlq.requests, "request") as request:
+        counts = replay_status_dlq.Replayer(session, SOR_URL, queue_url, STATE_TABLE, dry_run=True).run(1)
+
+    request.assert_not_called()
+    assert counts["replayed"] == 2
+    assert queue_size(session, queue_url) == 2
+
+
+def test_replay_updates_status_view(queue):
+    """Replayed statuses are written to the status view and failed ones are not."""
+    session, queue_url = queue
+    create_table(session, "status-view", "Id")
+    response = sor_response({
+        "data": {"update0": {"arn": "arn-1", "status": "SUCCEEDED"}, "update1": None},
+        "errors": [{"message": "Execution not found", "path": ["update1"]}],
+    })
+    replayer = replay_status_dlq.Replayer(session, SOR_URL, queue_url, STATE_TABLE, status_view_table="status-view")
+    with patch.object(replay_status_dlq.requests, "request", return_value=response):
+        replayer.run(1)
+
+    table = session.resource("dynamodb").Table("status-view")
+    assert table.get_item(Key={"Id": "EXECUTION#arn-1"})["Item"]["ExecutionStatus"] == "SUCCEEDED"
+    assert "Item" not in table.get_item(Key={"Id": "EXECUTION#arn-2"})
+
+
+def test_replay_skips_superseded_statuses(queue):
+    """A stale RUNNING replayed after a later SUCCEEDED is deleted without reaching the SOR or the status view."""
+    session, queue_url = queue
+    create_table(session, "status-view", "Id")
+    sqs = session.client("sqs")
+    sqs.send_message(QueueUrl=queue_url, MessageBody=status_message("arn-1", "RUNNING", "2019-02-26T19:40:00Z"))
+    response = sor_response({"data": {"update0": {"arn": "arn-1"}, "update1": {"arn": "arn-2"}}})
+    replayer = replay_status_dlq.Replayer(session, SOR_URL, queue_url, STATE_TABLE, status_view_table="status-view")
+    with patch.object(replay_status_dlq.requests, "request", return_value=response) as request:
+        counts = replayer.run(1)
+
+    assert counts == {"replayed": 2, "skipped": 1, "failed": 0, "malformed": 0, "undeleted": 0}
+    assert request.call_count == 1
+    assert queue_size(session, queue_url) == 0
+    table = session.resource("dynamodb").Table("status-view")
+    assert table.get_item(Key={"Id": "EXECUTION#arn-1"})["Item"]["ExecutionStatus"] == "SUCCEEDED"
+    state = session.resource("dynamodb").Table(STATE_TABLE).get_item(Key={"ExecutionArn": "arn-1"})["Item"]
+    assert state["ExecutionStatus"] == "SUCCEEDED" and state["Reported"]
+
+
+def test_replay_releases_failed_claims(queue):
+    """A status the SOR rejected is released so a later replay of it is not dropped as redundant."""
+    session, queue_url = queue
+    response = sor_response({
+        "data": {"update0": {"arn": "arn-1", "status": "SUCCEEDED"}, "update1": None},
+        "errors": [{"message": "Execution not found", "path": ["update1"]}],
+    })
+    with patch.object(replay_status_dlq.requests, "request", return_value=response):
+        replay_status_dlq.Replayer(session, SOR_URL, queue_url, STATE_TABLE).run(1)
+
+    state_table = session.resource("dynamodb").Table(STATE_TABLE)
+    assert "Item" not in state_table.get_item(Key={"ExecutionArn": "arn-2"})
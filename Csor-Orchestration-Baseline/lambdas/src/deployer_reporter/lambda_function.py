@@ -0,0 +1,342 @@
+"""Lambda function to report deployer task progress from ECS task state change events"""
+
+import json
+import os
+import sys
+import logging
+import boto3
+import requests
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+from botocore.exceptions import ClientError
+from botocore.session import get_session
+
+LOG_LEVEL: str = os.getenv('LOG_LEVEL', 'INFO')
+STACKTRACE_LIMIT: int = int(os.getenv('STACKTRACE_LIMIT', '10'))
+REGION: str = str(os.getenv('REGION', 'us-east-2')).lower()
+SOR_BATCH_SIZE: int = int(os.getenv('SOR_BATCH_SIZE', '25'))
+TIMING_TABLE = os.getenv('TIMING_TABLE')
+TASK_FAMILY_SUFFIX: str = '_baseline'
+IN_PROGRESS_TASK_STATUSES: tuple = ('PENDING', 'RUNNING')
+# Deployers the reporter may still move to In_Progress, later statuses are written by the deployer itself
+UNFINISHED_DEPLOYER_STATUSES: tuple = ('Not_Started', 'In_Progress')
+
+
+def configure_logging(log_level: str = 'info', traceback_limit: int = 10):
+    """Configure the root logger and stacktrace setting for the lambda."""
+    logging.getLogger().setLevel(str(log_level).upper())
+    logging.info('Log level is set to %s.', log_level)
+    if log_level.upper() == "DEBUG":
+        sys.tracebacklimit = traceback_limit
+        logging.debug('Stack traceback limit is %s.', traceback_limit)
+    else:
+        sys.tracebacklimit = 0
+        logging.info('Stack traceback is disabled.')
+
+
+def sign_request(url, method, headers, body):
+    """Sign the request using SigV4"""
+    session = get_session()
+    credentials = session.get_credentials().get_frozen_credentials()
+    request = AWSRequest(method=method, url=url, data=body, headers=headers)
+    SigV4Auth(credentials, 'execute-api', os.getenv('REGION')).add_auth(request)
+    return request
+
+
+def invoke_api_gateway(api_url, raw_query=None):
+    """Invoke API Gateway with SigV4 signing"""
+    headers = {
+        'Content-Type': 'application/json'
+    }
+    body = json.dumps(raw_query)
+    signed_request = sign_request(api_url, 'POST', headers, body)
+    response = requests.post(api_url, data=signed_request.body, headers=dict(signed_request.headers.items()), timeout=30)
+
+    if response.status_code != requests.codes.ok:
+        msg = f"Failed to communicate with API: {api_url}. Code: {response.status_code}, Reason: {response.reason}, Text: {response.text}"
+        raise requests.exceptions.RequestException(msg)
+
+    return response.json()
+
+
+def container_environment(detail: dict) -> dict:
+    """Collect the environment overrides the state machine passed to the deployer container."""
+    environment = {}
+    for container_override in detail.get('overrides', {}).get('containerOverrides', []):
+        for variable in container_override.get('environment', []):
+            environment[variable['name']] = variable['value']
+    return environment
+
+
+def deployer_container(detail: dict) -> dict:
+    """Return the deployer container of the task, ignoring sidecars such as the falcon sensor."""
+    containers = [container for container in detail.get('containers', []) if 'falcon' not in container.get('image', '')]
+    return containers[0] if containers else {}
+
+
+def parse_task_event(event: dict):
+    """
+    Map an ECS task state change event to a deployer update.
+
+    Returns None for tasks that are not deployer tasks or for state changes that are not reported.
+    """
+    detail = event['detail']
+    family = detail['taskDefinitionArn'].split('/')[-1].split(':')[0]
+    if not family.endswith(TASK_FAMILY_SUFFIX):
+        return None
+
+    environment = container_environment(detail)
+    execution_arn = environment.get('EXECUTION_ID')
+    if not execution_arn:
+        logging.info('Task %s was not started by a state machine execution', detail.get('taskArn'))
+        return None
+
+    container = deployer_container(detail)
+    image = container.get('image', '')
+    version = image.rsplit(':', 1)[1] if ':' in image.split('/')[-1] else environment.get('DEPLOYER_VERSION', 'Unknown')
+    update = {
+        'taskArn': detail.get('taskArn'),
+        'taskVersion': detail.get('version', 0),
+        'executionArn': execution_arn,
+        'name': environment.get('DEPLOYER_NAME', family[:-len(TASK_FAMILY_SUFFIX)]),
+        'version': version,
+        'lastStatus': detail['lastStatus'],
+        'startedAt': detail.get('startedAt'),
+        'stoppedAt': detail.get('stoppedAt'),
+        'updatedAt': detail.get('updatedAt') or event.get('time'),
+    }
+
+    if detail['lastStatus'] in IN_PROGRESS_TASK_STATUSES:
+        update['status'] = 'In_Progress'
+    elif detail['lastStatus'] == 'STOPPED' and container.get('exitCode') != 0:
+        update['status'] = 'Failed'
+        update['failureReason'] = detail.get('stoppedReason') or container.get('reason') or f"Exit code {container.get('exitCode')}"
+    else:
+        # Successful deployers report their own final status (Success or Skipped) together with their outputs
+        update['status'] = None
+    return update
+
+
+def build_batch_mutation(updates: list) -> tuple:
+    """Build one multi-operation mutation updating every deployer in the list."""
+    definitions = []
+    operations = []
+    variables = {}
+    for index, update in enumerate(updates):
+        definitions.append(
+            f"$executionArn{index}: String!, $name{index}: String!, $status{index}: DeployerStatus!, "
+            f"$version{index}: String!, $failureReason{index}: String"
+        )
+        operations.append(
+            f"update{index}: updateStateMachineDeployer(executionArn: $executionArn{index}, name: $name{index}, "
+            f"status: $status{index}, version: $version{index}, failureReason: $failureReason{index}) {{ arn }}"
+        )
+        variables[f"executionArn{index}"] = update['executionArn']
+        variables[f"name{index}"] = update['name']
+        variables[f"status{index}"] = update['status']
+        variables[f"version{index}"] = update['version']
+        variables[f"failureReason{index}"] = update.get('failureReason')
+    query = f"mutation BatchUpdateDeployerStatus({', '.join(definitions)}) {{ {' '.join(operations)} }}"
+    return query, variables
+
+
+def send_deployer_updates(updates: list) -> dict:
+    """Send the updates as one aliased mutation and return the SOR response."""
+    query, variables = build_batch_mutation(updates)
+    return invoke_api_gateway(api_url=os.getenv('SOR_ENDPOINT'), raw_query={"query": query, "variables": variables})
+
+
+def build_status_query(execution_arns: list) -> tuple:
+    """Build one multi-operation query reading the deployer statuses of every execution in the list."""
+    definitions = []
+    operations = []
+    variables = {}
+    for index, execution_arn in enumerate(execution_arns):
+        definitions.append(f"$executionArn{index}: String!")
+        operations.append(
+            f"execution{index}: statusByExecution(executionArn: $executionArn{index}) {{ deployers {{ name status }} }}"
+        )
+        variables[f"executionArn{index}"] = execution_arn
+    query = f"query DeployerStatuses({', '.join(definitions)}) {{ {' '.join(operations)} }}"
+    return query, variables
+
+
+def get_deployer_statuses(execution_arns: list) -> dict:
+    """Read the SoR status of the deployers of the executions, keyed by (execution ARN, deployer name)."""
+    query, variables = build_status_query(execution_arns)
+    response = invoke_api_gateway(api_url=os.getenv('SOR_ENDPOINT'), raw_query={"query": query, "variables": variables})
+    if response.get('errors'):
+        logging.warning("GraphQL returned errors reading deployer statuses: %s", response['errors'])
+    data = response.get('data') or {}
+    statuses = {}
+    for index, execution_arn in enumerate(execution_arns):
+        for deployer in (data.get(f"execution{index}") or {}).get('deployers') or []:
+            statuses[(execution_arn, deployer['name'])] = deployer['status']
+    return statuses
+
+
+def drop_finished_deployers(entries: list) -> list:
+    """
+    Drop the In_Progress updates of deployers whose SoR status is already final.
+
+    The task claim only orders ECS events against each other. A late PENDING or RUNNING event handled after
+    the deployer wrote its own Success or Skipped status would otherwise move it back to In_Progress, and the
+    STOPPED event of a successful task sends nothing that would correct it.
+    """
+    execution_arns = sorted({update['executionArn'] for _, update in entries if update['status'] == 'In_Progress'})
+    if not execution_arns:
+        return entries
+    statuses = get_deployer_statuses(execution_arns)
+    kept = []
+    for identifier, update in entries:
+        status = statuses.get((update['executionArn'], update['name']))
+        if update['status'] == 'In_Progress' and status and status not in UNFINISHED_DEPLOYER_STATUSES:
+            logging.info('Dropping %s event of task %s, deployer %s is already %s',
+                         update['lastStatus'], update['taskArn'], update['name'], status)
+            continue
+        kept.append((identifier, update))
+    return kept
+
+
+def update_deployer_sor(update: dict) -> bool:
+    """Update a single deployer and return whether the SOR accepted it."""
+    try:
+        response = send_deployer_updates([update])
+    except Exception as exception:
+        logging.error("Failed to update deployer %s due to: %s", update['name'], exception)
+        return False
+    if response.get('errors'):
+        logging.error("GraphQL returned errors for deployer %s: %s", update['name'], response['errors'])
+    return bool((response.get('data') or {}).get('update0'))
+
+
+def update_deployers_sor_batch(updates: list) -> set:
+    """Update several deployers with a single SOR request, returning the indexes that failed."""
+    if not updates:
+        return set()
+    try:
+        response = send_deployer_updates(updates)
+    except Exception as exception:
+        logging.error("Failed to update %s deployers due to: %s", len(updates), exception)
+        return set(range(len(updates)))
+
+    for error in response.get('errors', []):
+        path = error.get('path') or []
+        if not path:
+            logging.error("GraphQL returned errors for the whole batch: %s", response)
+            return set(range(len(updates)))
+        logging.error("GraphQL returned error for %s: %s", path[0], error.get('message'))
+
+    data = response.get('data')
+    if data is None:
+        # A failed non-null field nulls every alias, so the updates that did succeed cannot be told apart
+        logging.warning("SOR batch returned no data, updating %s deployers one at a time", len(updates))
+        failed = {index for index, update in enumerate(updates) if not update_deployer_sor(update)}
+    else:
+        failed = {index for index in range(len(updates)) if not data.get(f"update{index}")}
+    logging.info('Deployers updated: %s of %s', len(updates) - len(failed), len(updates))
+    return failed
+
+
+def claim_task_update(update: dict) -> bool:
+    """
+    Record the task state change in the timing table unless a later state change of the deployer is recorded.
+
+    ECS events can arrive out of order, so a late PENDING or RUNNING event must not move a deployer that
+    already stopped back to In_Progress. Returns False for such events. Redelivered events are accepted again.
+    """
+    expressions = ['TaskArn = :task_arn', 'DeployerVersion = :version', 'TaskStatus = :task_status']
+    values = {':task_arn': update['taskArn'], ':version': update['version'], ':task_status': update['lastStatus']}
+    for key, attribute in (('startedAt', 'StartedAt'), ('stoppedAt', 'StoppedAt'), ('updatedAt', 'UpdatedAt')):
+        if update[key]:
+            expressions.append(f"{attribute} = :{key}")
+            values[f":{key}"] = update[key]
+    condition = {}
+    if update['updatedAt']:
+        condition['ConditionExpression'] = 'attribute_not_exists(UpdatedAt) OR UpdatedAt <= :updatedAt'
+
+    table = boto3.resource('dynamodb', region_name=REGION).Table(TIMING_TABLE)
+    try:
+        table.update_item(
+            Key={'ExecutionArn': update['executionArn'], 'StateKey': f"TASK#{update['name']}"},
+            UpdateExpression='SET ' + ', '.join(expressions),
+            ExpressionAttributeValues=values,
+            **condition,
+        )
+    except ClientError as error:
+        if error.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        logging.info('Dropping out of order %s event of task %s', update['lastStatus'], update['taskArn'])
+        return False
+    return True
+
+
+def report_task_events(events: list) -> set:
+    """Report a list of (identifier, ECS event) pairs, returning the identifiers that must be retried."""
+    failures = set()
+    latest = {}
+    for identifier, event in events:
+        try:
+            update = parse_task_event(event)
+        except (KeyError, TypeError, ValueError) as exception:
+            logging.error("Malformed ECS task state change %s: %s", identifier, exception)
+            failures.add(identifier)
+            continue
+        if update is None:
+            continue
+        # Keep only the most recent state change of each task in the batch
+        known = latest.get(update['taskArn'])
+        if known is None or known[1]['taskVersion'] <= update['taskVersion']:
+            latest[update['taskArn']] = (identifier, update)
+
+    accepted = []
+    for identifier, update in latest.values():
+        if TIMING_TABLE:
+            try:
+                if not claim_task_update(update):
+                    continue
+            except Exception as exception:
+                logging.error("Failed to record task %s in the timing table: %s", update['taskArn'], exception)
+                failures.add(identifier)
+                continue
+        accepted.append((identifier, update))
+
+    reported = [entry for entry in accepted if entry[1]['status']]
+    try:
+        reported = drop_finished_deployers(reported)
+    except Exception as exception:
+        logging.error("Failed to read the deployer statuses from the SoR: %s", exception)
+        failures.update(identifier for identifier, update in reported if update['status'] == 'In_Progress')
+        reported = [entry for entry in reported if entry[1]['status'] != 'In_Progress']
+    for start in range(0, len(reported), SOR_BATCH_SIZE):
+        chunk = reported[start:start + SOR_BATCH_SIZE]
+        failed = update_deployers_sor_batch([update for _, update in chunk])
+        failures.update(chunk[index][0] for index in failed)
+    return failures
+
+
+def lambda_handler(event, context):
+    """Entry point for the Lambda function."""
+    configure_logging(LOG_LEVEL, STACKTRACE_LIMIT)
+    logging.info('Lambda event: %s', event)
+    logging.debug('Lambda context: %s', context)
+    if not os.getenv("SOR_ENDPOINT"):
+        raise KeyError("No SoR endpoint set")
+
+    if 'Records' in event:
+        events = []
+        failures = set()
+        for record in event['Records']:
+            try:
+                events.append((record['messageId'], json.loads(record['body'])))
+            except ValueError as exception:
+                logging.error("Malformed ECS task state change message %s: %s", record['messageId'], exception)
+                failures.add(record['messageId'])
+        failures.update(report_task_events(events))
+        response = {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in sorted(failures)]}
+        logging.info("SOR batch failures: %s", response)
+        return response
+
+    if report_task_events([(event.get('id'), event)]):
+        raise RuntimeError(f"Failed to report deployer status for task {event['detail'].get('taskArn')}")
+    return None
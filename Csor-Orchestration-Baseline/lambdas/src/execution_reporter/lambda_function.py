@@ -4,14 +4,47 @@ import json
 import os
 import sys
 import logging
+from collections import defaultdict, deque
+from decimal import Decimal
+from time import sleep
+import boto3
 import requests
 from botocore.auth import SigV4Auth
 from botocore.awsrequest import AWSRequest
+from botocore.exceptions import ClientError
 from botocore.session import get_session
 
 LOG_LEVEL: str = os.getenv('LOG_LEVEL', 'INFO')
 STACKTRACE_LIMIT: int = int(os.getenv('STACKTRACE_LIMIT', '10'))
 REGION: str = str(os.getenv('REGION', 'us-east-2')).lower()
+SOR_BATCH_SIZE: int = int(os.getenv('SOR_BATCH_SIZE', '25'))
+EXECUTION_STATE_TABLE = os.getenv('EXECUTION_STATE_TABLE')
+STATUS_DLQ_URL = os.getenv('STATUS_DLQ_URL')
+TIMING_TABLE = os.getenv('TIMING_TABLE')
+STATUS_VIEW_TABLE = os.getenv('STATUS_VIEW_TABLE')
+EXECUTION_TYPE: str = os.getenv('EXECUTION_TYPE', 'BASELINE')
+SOR_MAX_ATTEMPTS: int = int(os.getenv('SOR_MAX_ATTEMPTS', '4'))
+SOR_RETRY_BASE_DELAY: float = float(os.getenv('SOR_RETRY_BASE_DELAY', '0.5'))
+SOR_RETRY_MAX_DELAY: float = float(os.getenv('SOR_RETRY_MAX_DELAY', '4'))
+SOR_TIMEOUT_SECONDS: float = float(os.getenv('SOR_TIMEOUT_SECONDS', '10'))
+
+# Statuses only move forward within a (re)drive of an execution; terminal statuses never move back to RUNNING.
+STATUS_RANKS: dict = {
+    'RUNNING': 1,
+    'PENDING_REDRIVE': 1,
+    'SUCCEEDED': 2,
+    'FAILED': 2,
+    'TIMED_OUT': 2,
+    'ABORTED': 2,
+}
+TERMINAL_STATUS_RANK: int = 2
+REDRIVE_RANK_STEP: int = 10
+# The same event may claim again until it is Reported, so a redelivery after a crash is not dropped as redundant
+CLAIM_CONDITION = (
+    'attribute_not_exists(ExecutionArn) OR StatusRank < :rank OR '
+    '(StatusRank = :rank AND IsTerminal = :false AND EventTime < :event_time AND ExecutionStatus <> :status) OR '
+    '(StatusRank = :rank AND EventTime = :event_time AND ExecutionStatus = :status AND Reported = :false)'
+)
 SOR_ENDPOINT = os.getenv("SOR_ENDPOINT")
 if not SOR_ENDPOINT:
     raise KeyError("Failed to get the SOR_ENDPOINT")
@@ -34,6 +67,217 @@ def __get_env_variable(var_name, default=None):
     return os.getenv(var_name, default)
 
 
+def __get_state_table():
+    """Create a boto3 DynamoDB resource for the execution state table."""
+    return boto3.resource('dynamodb', region_name=REGION).Table(EXECUTION_STATE_TABLE)
+
+
+def status_rank(event: dict) -> int:
+    """Rank an execution status change so that later redrives and terminal statuses always rank higher."""
+    detail = event['detail']
+    redrive_count = int(detail.get('redriveCount') or 0)
+    return redrive_count * REDRIVE_RANK_STEP + STATUS_RANKS.get(detail['status'], 0)
+
+
+def claim_execution_status(event: dict, table=None):
+    """
+    Record the event in the execution state table unless a newer or equal status was already reported.
+
+    Returns a tuple (accepted, previous item); stale and redundant events are not accepted.
+    """
+    if table is None and not EXECUTION_STATE_TABLE:
+        return True, None
+
+    detail = event['detail']
+    rank = status_rank(event)
+    try:
+        response = (table or __get_state_table()).put_item(
+            Item={
+                'ExecutionArn': detail['executionArn'],
+                'ExecutionStatus': detail['status'],
+                'StatusRank': rank,
+                'IsTerminal': rank % REDRIVE_RANK_STEP >= TERMINAL_STATUS_RANK,
+                'EventTime': event.get('time', ''),
+                'Reported': False,
+            },
+            ConditionExpression=CLAIM_CONDITION,
+            ExpressionAttributeValues={
+                ':rank': rank,
+                ':false': False,
+                ':event_time': event.get('time', ''),
+                ':status': detail['status'],
+            },
+            ReturnValues='ALL_OLD',
+        )
+    except ClientError as error:
+        if error.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            logging.info('Dropping stale or redundant status %s for execution %s', detail['status'], detail['executionArn'])
+            return False, None
+        raise
+    return True, response.get('Attributes')
+
+
+def mark_execution_status_reported(event: dict, table=None):
+    """Mark a claimed status as written to the SOR, after which redeliveries of the event are redundant."""
+    if table is None and not EXECUTION_STATE_TABLE:
+        return
+
+    detail = event['detail']
+    try:
+        (table or __get_state_table()).update_item(
+            Key={'ExecutionArn': detail['executionArn']},
+            UpdateExpression='SET Reported = :true',
+            ConditionExpression='ExecutionStatus = :status AND EventTime = :event_time',
+            ExpressionAttributeValues={':true': True, ':status': detail['status'], ':event_time': event.get('time', '')},
+        )
+    except ClientError as error:
+        # A newer status already replaced the claim
+        if error.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+
+
+def release_execution_status(event: dict, previous: dict = None, table=None):
+    """Roll back a claimed status that could not be written to the SOR so that a retry is not dropped."""
+    if table is None and not EXECUTION_STATE_TABLE:
+        return
+
+    detail = event['detail']
+    condition = {
+        'ConditionExpression': 'ExecutionStatus = :status AND EventTime = :event_time',
+        'ExpressionAttributeValues': {':status': detail['status'], ':event_time': event.get('time', '')},
+    }
+    table = table or __get_state_table()
+    try:
+        if previous:
+            table.put_item(Item=previous, **condition)
+        else:
+            table.delete_item(Key={'ExecutionArn': detail['executionArn']}, **condition)
+    except ClientError as error:
+        if error.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+
+
+def get_execution_history(execution_arn: str) -> list:
+    """Fetch every event of the execution history, following pagination."""
+    client = boto3.client('stepfunctions', region_name=REGION)
+    paginator = client.get_paginator('get_execution_history')
+    events = []
+    for page in paginator.paginate(executionArn=execution_arn, includeExecutionData=False):
+        events.extend(page['events'])
+    return events
+
+
+def compute_state_timings(history: list) -> list:
+    """Pair each TaskStateEntered with its TaskStateExited and compute the task duration."""
+    entered = defaultdict(deque)
+    timings = []
+    for history_event in history:
+        if history_event['type'] == 'TaskStateEntered':
+            entered[history_event['stateEnteredEventDetails']['name']].append(history_event['timestamp'])
+        elif history_event['type'] == 'TaskStateExited':
+            name = history_event['stateExitedEventDetails']['name']
+            if entered[name]:
+                entered_time = entered[name].popleft()
+                timings.append({
+                    'StateName': name,
+                    'EnteredTime': entered_time.isoformat(),
+                    'ExitedTime': history_event['timestamp'].isoformat(),
+                    'DurationSeconds': Decimal(str((history_event['timestamp'] - entered_time).total_seconds())),
+                })
+    return timings
+
+
+def record_state_timings(event: dict):
+    """Store the duration of every task state of a finished execution in the timing table."""
+    detail = event['detail']
+    timings = compute_state_timings(get_execution_history(detail['executionArn']))
+    occurrences = defaultdict(int)
+    table = boto3.resource('dynamodb', region_name=REGION).Table(TIMING_TABLE)
+    with table.batch_writer() as batch:
+        for timing in timings:
+            occurrences[timing['StateName']] += 1
+            suffix = f"#{occurrences[timing['StateName']]}" if occurrences[timing['StateName']] > 1 else ''
+            batch.put_item(Item={
+                'ExecutionArn': detail['executionArn'],
+                'StateKey': timing['StateName'] + suffix,
+                'StateMachineArn': detail.get('stateMachineArn', ''),
+                'ExecutionStatus': detail['status'],
+                **timing,
+            })
+    logging.info('Recorded %s state timings for execution %s', len(timings), detail['executionArn'])
+
+
+def update_status_view(event: dict, table=None, execution_type: str = None):
+    """
+    Maintain the latest status per execution ARN and per account, region and type.
+
+    Statuses are stored in the SOR vocabulary so readers can use them in place of statusByExecution.
+    """
+    detail = event['detail']
+    status = 'IN_PROGRESS' if detail['status'] == 'RUNNING' else detail['status']
+    event_time = event.get('time', '')
+    execution_type = execution_type or EXECUTION_TYPE
+    if table is None:
+        table = boto3.resource('dynamodb', region_name=REGION).Table(STATUS_VIEW_TABLE)
+    item = {
+        'ExecutionArn': detail['executionArn'],
+        'ExecutionStatus': status,
+        'Type': execution_type,
+        'EventTime': event_time,
+    }
+    try:
+        configuration_document = json.loads(detail.get('input') or '{}')
+        item['AccountId'] = configuration_document['account']
+        item['Region'] = configuration_document['region']
+    except (KeyError, TypeError, ValueError):
+        logging.warning('No account and region in the input of %s, only updating the execution view', detail['executionArn'])
+
+    table.put_item(Item={'Id': f"EXECUTION#{detail['executionArn']}", **item})
+    if 'AccountId' not in item:
+        return
+    try:
+        # A late event of an older execution must not replace the latest execution of the account
+        table.put_item(
+            Item={'Id': f"ACCOUNT#{item['AccountId']}#{item['Region']}#{execution_type}", **item},
+            ConditionExpression='attribute_not_exists(Id) OR ExecutionArn = :arn OR EventTime <= :event_time',
+            ExpressionAttributeValues={':arn': detail['executionArn'], ':event_time': event_time},
+        )
+    except ClientError as error:
+        if error.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        logging.info('Account view already holds a newer execution than %s', detail['executionArn'])
+
+
+def record_status_view(event: dict):
+    """
+    Update the status view for an accepted status change.
+
+    This runs whether or not the SOR write succeeds: the view follows Step Functions, and a view left
+    IN_PROGRESS after a failed terminal write would block new executions of the account.
+    """
+    if not STATUS_VIEW_TABLE:
+        return
+    try:
+        update_status_view(event)
+    except Exception as exception:
+        logging.error('Failed to update the status view for %s: %s', event['detail']['executionArn'], exception)
+
+
+def on_status_reported(event: dict):
+    """Run the follow-up work for a status change that was written to the SOR."""
+    try:
+        mark_execution_status_reported(event)
+    except Exception as exception:
+        # The claim stays unreported, so at worst a redelivery writes the same status again
+        logging.error('Failed to mark status %s of %s as reported: %s', event['detail']['status'],
+                      event['detail']['executionArn'], exception)
+    if TIMING_TABLE and STATUS_RANKS.get(event['detail']['status']) == TERMINAL_STATUS_RANK:
+        try:
+            record_state_timings(event)
+        except Exception as exception:
+            logging.error('Failed to record state timings for %s: %s', event['detail']['executionArn'], exception)
+
+
 def sign_request(url, method, headers, body):
     """Sign the request using SigV4"""
     session = get_session()
@@ -50,7 +294,8 @@ def invoke_api_gateway(api_url, raw_query=None):
     }
     body = json.dumps(raw_query)
     signed_request = sign_request(api_url, 'POST', headers, body)
-    response = requests.post(api_url, data=signed_request.body, headers=dict(signed_request.headers.items()))
+    response = requests.post(api_url, data=signed_request.body, headers=dict(signed_request.headers.items()),
+                             timeout=SOR_TIMEOUT_SECONDS)
 
     if response.status_code != requests.codes.ok:
         msg = f"Failed to communicate with API: {api_url}. Code: {response.status_code}, Reason: {response.reason}, Text: {response.text}"
@@ -59,6 +304,19 @@ def invoke_api_gateway(api_url, raw_query=None):
     return response.json()
 
 
+def invoke_api_gateway_with_retries(api_url, raw_query=None):
+    """Invoke API Gateway, retrying failed requests with a bounded exponential backoff."""
+    for attempt in range(1, SOR_MAX_ATTEMPTS + 1):
+        try:
+            return invoke_api_gateway(api_url=api_url, raw_query=raw_query)
+        except requests.exceptions.RequestException as exception:
+            if attempt == SOR_MAX_ATTEMPTS:
+                raise
+            delay = min(SOR_RETRY_MAX_DELAY, SOR_RETRY_BASE_DELAY * 2 ** (attempt - 1))
+            logging.warning('SOR request attempt %s of %s failed, retrying in %ss: %s', attempt, SOR_MAX_ATTEMPTS, delay, exception)
+            sleep(delay)
+
+
 def execute_sor_query(query: str, variables: dict = None) -> dict:
     """Invoke the GraphQL query via API Gateway"""
     raw_query = {
@@ -66,7 +324,7 @@ def execute_sor_query(query: str, variables: dict = None) -> dict:
         "variables": variables or {}
     }
     api_url = os.getenv('SOR_ENDPOINT')
-    response = invoke_api_gateway(
+    response = invoke_api_gateway_with_retries(
         api_url=api_url,
         raw_query=raw_query
     )
@@ -93,21 +351,144 @@ def update_execution_status_sor(execution_arn: str, execution_status: str):
         logging.info('Execution status updated: %s', response)
         return response
     except Exception as exception:
-        error_msg = "Failed to update execution status due to: %s", exception
+        error_msg = f"Failed to update execution status due to: {exception}"
         logging.error(error_msg)
         return {'error': error_msg}
 
 
+def send_to_dlq(event: dict, error_msg: str):
+    """Persist a status change event that could not be written to the SOR so it can be replayed later."""
+    if not STATUS_DLQ_URL:
+        logging.error('No STATUS_DLQ_URL set, status update for %s is lost: %s', event['detail']['executionArn'], error_msg)
+        return
+    sqs_client = boto3.client('sqs', region_name=REGION)
+    sqs_client.send_message(
+        QueueUrl=STATUS_DLQ_URL,
+        MessageBody=json.dumps(event),
+        MessageAttributes={'error': {'DataType': 'String', 'StringValue': error_msg[:1024]}},
+    )
+    logging.info('Status update for %s sent to DLQ %s', event['detail']['executionArn'], STATUS_DLQ_URL)
+
+
+def build_batch_mutation(updates: list) -> tuple:
+    """Build one multi-operation mutation updating the status of every (execution_arn, status) pair."""
+    definitions = []
+    operations = []
+    variables = {}
+    for index, (execution_arn, execution_status) in enumerate(updates):
+        definitions.append(f"$executionArn{index}: String!, $executionStatus{index}: OrchestrationStatus!")
+        operations.append(
+            f"update{index}: updateStateMachineExecution(executionArn: $executionArn{index}, "
+            f"status: $executionStatus{index}) {{ arn status }}"
+        )
+        variables[f"executionArn{index}"] = execution_arn
+        variables[f"executionStatus{index}"] = execution_status
+    query = f"mutation BatchUpdateExecutionStatus({', '.join(definitions)}) {{ {' '.join(operations)} }}"
+    return query, variables
+
+
+def update_execution_status_sor_batch(updates: list) -> set:
+    """Update several execution statuses with a single SOR request, returning the indexes that failed."""
+    if not updates:
+        return set()
+    query, variables = build_batch_mutation(updates)
+    try:
+        response = invoke_api_gateway_with_retries(api_url=os.getenv('SOR_ENDPOINT'), raw_query={"query": query, "variables": variables})
+    except Exception as exception:
+        logging.error("Failed to update %s execution statuses due to: %s", len(updates), exception)
+        return set(range(len(updates)))
+
+    errors = response.get('errors', [])
+    for error in errors:
+        path = error.get('path') or []
+        if not path:
+            logging.error("GraphQL returned errors for the whole batch: %s", response)
+            return set(range(len(updates)))
+        logging.error("GraphQL returned error for %s: %s", path[0], error.get('message'))
+
+    data = response.get('data')
+    if data is None:
+        # A failed non-null field nulls every alias, so the updates that did succeed cannot be told apart
+        logging.warning("SOR batch returned no data, updating %s execution statuses one at a time", len(updates))
+        failed = {index for index, (execution_arn, execution_status) in enumerate(updates)
+                  if 'error' in update_execution_status_sor(execution_arn, execution_status)}
+    else:
+        failed = {index for index in range(len(updates)) if not data.get(f"update{index}")}
+    logging.info('Execution statuses updated: %s of %s', len(updates) - len(failed), len(updates))
+    return failed
+
+
+def release_claim_after_failure(message_id: str, event: dict, previous: dict = None):
+    """Release a claim whose status was not reported, logging instead of raising so the rest of the batch is kept."""
+    try:
+        release_execution_status(event, previous)
+    except Exception as exception:
+        logging.error("Failed to release the claim of message %s: %s", message_id, exception)
+
+
+def process_sqs_records(records: list) -> dict:
+    """Report the EventBridge events buffered in an SQS batch, returning the partial batch failures."""
+    failures = []
+    pending = []
+    for record in records:
+        event = None
+        try:
+            event = json.loads(record['body'])
+            accepted, previous = claim_execution_status(event)
+        except (KeyError, TypeError, ValueError) as exception:
+            logging.error("Malformed execution status message %s: %s", record.get('messageId'), exception)
+            failures.append(record.get('messageId'))
+            continue
+        except Exception as exception:
+            # A timed out claim may still have been written, and a retry must not find it claimed
+            logging.error("Failed to claim execution status message %s: %s", record.get('messageId'), exception)
+            release_claim_after_failure(record.get('messageId'), event)
+            failures.append(record.get('messageId'))
+            continue
+        if accepted:
+            pending.append((record['messageId'], event, previous))
+
+    for start in range(0, len(pending), SOR_BATCH_SIZE):
+        chunk = pending[start:start + SOR_BATCH_SIZE]
+        failed = update_execution_status_sor_batch(
+            [(event['detail']['executionArn'], event['detail']['status']) for _, event, _ in chunk]
+        )
+        for index, (message_id, event, previous) in enumerate(chunk):
+            record_status_view(event)
+            if index in failed:
+                release_claim_after_failure(message_id, event, previous)
+                failures.append(message_id)
+            else:
+                on_status_reported(event)
+
+    return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failures]}
+
+
 def lambda_handler(event, context):
     """Entry point for the Lambda function."""
     configure_logging(LOG_LEVEL, STACKTRACE_LIMIT)
     logging.info('Lambda event: %s', event)
     logging.debug('Lambda context: %s', context)
+    if 'Records' in event:
+        response = process_sqs_records(event['Records'])
+        logging.info("SOR batch failures: %s", response)
+        return response
+
     execution_arn = event['detail']['executionArn']
     execution_status = event['detail']['status']
     
     if not __get_env_variable("SOR_ENDPOINT"):
         raise KeyError("No SoR endpoint set") 
 
+    accepted, previous = claim_execution_status(event)
+    if not accepted:
+        return
+
     response = update_execution_status_sor(execution_arn, execution_status)
+    record_status_view(event)
+    if 'error' in response:
+        release_execution_status(event, previous)
+        send_to_dlq(event, response['error'])
+    else:
+        on_status_reported(event)
     logging.info("SOR status: %s", response)
@@ -1,15 +1,21 @@
 """Custom ETL process to hydrate CSOR DB from S3 object updates."""
 
+import codecs
+import hashlib
+import ipaddress
 import logging
 import json
 import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from os import getenv
-from typing import Any
+from typing import Any, Iterable
 import urllib.parse
 import boto3
 import requests
 from botocore.auth import SigV4Auth
 from botocore.awsrequest import AWSRequest
+from botocore.exceptions import ClientError
 from botocore.session import get_session
 
 # Set up logging
@@ -28,70 +34,39 @@ else:
 LOGGER.debug("Logging Level: %s", LOGGER.getEffectiveLevel())
 
 
-def __get_env_variable(var_name, default=None):
-    """Retrieve an environment variable with an optional default."""
-    return os.getenv(var_name, default)
-
-
-def get_object_contents(bucket, key, bucket_region):
-    """
-    Read in s3 object json document
-    """
-
-    client = boto3.client("s3", region_name=bucket_region)
-
-    try:
-        response = client.get_object(Bucket=bucket, Key=key)
-        json_blob = json.loads(response["Body"].read())
-    except Exception as e:
-        LOGGER.exception(e)
-        LOGGER.exception(
-            "Error getting object %s from bucket %s.",
-            key,
-            bucket,
-        )
-        raise e
-
-    return json_blob
-
-
-def sign_request(url, method, headers, body):
-    """Sign the request using SigV4"""
-    session = get_session()
-    credentials = session.get_credentials().get_frozen_credentials()
-    request = AWSRequest(method=method, url=url, data=body, headers=headers)
-    SigV4Auth(credentials, "execute-api", os.getenv("REGION")).add_auth(request)
-    return request
-
-
-def invoke_api_gateway(api_url, raw_query=None):
-    """Invoke API Gateway with SigV4 signing"""
-    headers = {"Content-Type": "application/json"}
-    body = json.dumps(raw_query)
-    signed_request = sign_request(api_url, "POST", headers, body)
-    response = requests.post(
-        api_url,
-        data=signed_request.body,
-        headers=dict(signed_request.headers.items()),
-        timeout=3,
-    )
-
-    return response.json()
-
-
-def execute_sor_query(query: str, variables: dict = None) -> dict:
-    """Invoke the GraphQL query via API Gateway"""
-    raw_query = {"query": query, "variables": variables or {}}
-    api_url = os.getenv("SOR_ENDPOINT")
-    LOGGER.info("Invoking mutation call on SoR url %s", api_url)
-    response = invoke_api_gateway(api_url=api_url, raw_query=raw_query)
-    return response
-
-
-def mutate_networkfoundation_data(payload: dict[str, Any]) -> dict:
-    """Mutate foundation data in System of Record"""
-    foundation_query: str = (
-        """
+COSMOS_ACCOUNT_NUMBERS = {
+    "data-production": "140583960461",
+    "data-staging": "421799854738",
+    "dev": "782759316251",
+    "qa": "782759316251",
+    "jenkins-prod": "018711540077",
+    "jenkins-sand": "648372896714",
+    "prod": "123910207971",
+    "sand": "303892774901",
+    "splunk": "195526673873",
+}
+HYDRATE_MAX_WORKERS = int(getenv("HYDRATE_MAX_WORKERS", "8"))
+HYDRATION_STATE_TABLE = getenv("HYDRATION_STATE_TABLE")
+STREAM_CHUNK_SIZE = int(getenv("STREAM_CHUNK_SIZE", "65536"))
+DEBOUNCE_QUEUE_URL = getenv("DEBOUNCE_QUEUE_URL")
+PENDING_HYDRATION_TABLE = getenv("PENDING_HYDRATION_TABLE")
+DEBOUNCE_SECONDS = int(getenv("DEBOUNCE_SECONDS", "30"))
+# Lists that become security group or EKS public access rules; VPC CIDR allocations are kept as allocated
+CIDR_FIELDS = ("publicAccessCidrs", "fdfgSftpWhitelistCidrs", "dynamodbEndpointCidrBlocks", "s3EndpointCidrBlocks")
+ENDPOINT_IP_FIELDS = (
+    "asmEndpointIps",
+    "autoscalingEndpointIps",
+    "cloudformationEndpointIps",
+    "ec2EndpointIps",
+    "elasticloadbalancingEndpointIps",
+    "stsEndpointIps",
+    "logsEndpointIps",
+    "efsEndpointIps",
+    "sqsEndpointIps",
+)
+
+
+NETWORK_FOUNDATION_MUTATION: str = """
     mutation (
         $accountId: String!, 
         $region: Region!, 
@@ -152,8 +127,202 @@ def mutate_networkfoundation_data(payload: dict[str, Any]) -> dict:
         }
     }
     """
+
+
+def __get_env_variable(var_name, default=None):
+    """Retrieve an environment variable with an optional default."""
+    return os.getenv(var_name, default)
+
+
+def __get_hydration_state_table():
+    """Create a boto3 DynamoDB resource for the hydration state table."""
+    return boto3.session.Session().resource("dynamodb", region_name=getenv("REGION")).Table(HYDRATION_STATE_TABLE)
+
+
+def __get_pending_hydration_table():
+    """Create a boto3 DynamoDB resource for the pending hydration table."""
+    return boto3.session.Session().resource("dynamodb", region_name=getenv("REGION")).Table(PENDING_HYDRATION_TABLE)
+
+
+def network_location(key: str) -> tuple[str, str]:
+    """Return the account id and region a dimension-terraform tfstate key describes."""
+    dimension_region = key.split("/", 3)[1]
+    dimension = dimension_region.split("-")[0]
+    region = dimension_region.split(dimension + "-")[1]
+    return COSMOS_ACCOUNT_NUMBERS[dimension], region
+
+
+def dedupe_values(values: list[str]) -> list[str]:
+    """Drop empty and repeated entries, keeping the original order."""
+    return list(dict.fromkeys(value.strip() for value in values if value and value.strip()))
+
+
+def aggregate_cidrs(cidrs: list[str]) -> list[str]:
+    """Merge duplicate, overlapping and adjacent networks; entries that are not networks are kept as they are."""
+    networks = {4: [], 6: []}
+    unparsed = []
+    for cidr in dedupe_values(cidrs):
+        try:
+            network = ipaddress.ip_network(cidr, strict=False)
+        except ValueError:
+            unparsed.append(cidr)
+            continue
+        networks[network.version].append(network)
+    collapsed = [
+        str(network) for version in (4, 6) for network in ipaddress.collapse_addresses(networks[version])
+    ]
+    return collapsed + unparsed
+
+
+def compact_network_lists(payload: dict[str, Any]) -> dict[str, Any]:
+    """Aggregate the CIDR lists and dedupe the endpoint IP lists of a payload, logging how much each one shrank."""
+    for field in CIDR_FIELDS + ENDPOINT_IP_FIELDS:
+        values = payload.get(field)
+        if not isinstance(values, list):
+            continue
+        payload[field] = aggregate_cidrs(values) if field in CIDR_FIELDS else dedupe_values(values)
+        if len(payload[field]) != len(values):
+            LOGGER.info("%s reduced from %s to %s entries", field, len(values), len(payload[field]))
+    return payload
+
+
+def payload_fingerprint(payload: dict[str, Any]) -> str:
+    """Hash a network foundation payload independently of the order of its keys."""
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def get_hydration_state(account_id: str, region: str) -> dict:
+    """Read what was last hydrated for an account and region, if the state table is configured."""
+    if not HYDRATION_STATE_TABLE:
+        return {}
+    response = __get_hydration_state_table().get_item(Key={"Id": f"{account_id}#{region}"}, ConsistentRead=True)
+    return response.get("Item", {})
+
+
+def put_hydration_state(account_id: str, region: str, key: str, version_id: str, fingerprint: str):
+    """Record the tfstate version and payload fingerprint last hydrated for an account and region."""
+    if not HYDRATION_STATE_TABLE:
+        return
+    item = {"Id": f"{account_id}#{region}", "ObjectKey": key, "Fingerprint": fingerprint}
+    if version_id:
+        item["VersionId"] = version_id
+    __get_hydration_state_table().put_item(Item=item)
+
+
+def read_top_level_member(chunks: Iterable[bytes], name: str) -> Any:
+    """
+    Decode one member of a top level JSON object from a stream of bytes.
+
+    Reading stops as soon as the member has been read, so the size of the other members does not matter.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    depth = 0
+    in_string = escaped = capturing = False
+    string_start = 0
+    last_string = partial_string = ""
+    captured: list[str] = []
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        capture_start = 0
+        for index, char in enumerate(text):
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif char == "\\":
+                    escaped = True
+                elif char == '"':
+                    in_string = False
+                    if depth == 1 and not capturing:
+                        last_string = partial_string + text[string_start:index]
+                continue
+            if char == '"':
+                in_string = True
+                string_start = index + 1
+                partial_string = ""
+            elif capturing and depth == 1 and char in ",}":
+                captured.append(text[capture_start:index])
+                return json.loads("".join(captured))
+            elif char in "{[":
+                depth += 1
+            elif char in "}]":
+                depth -= 1
+            elif char == ":" and depth == 1 and last_string == name and not capturing:
+                capturing = True
+                capture_start = index + 1
+        if capturing:
+            captured.append(text[capture_start:])
+        elif in_string and depth == 1:
+            # Keep the part of a key that continues in the next chunk
+            partial_string += text[string_start:]
+            string_start = 0
+    raise KeyError(name)
+
+
+def get_object_outputs(bucket, key, bucket_region):
+    """
+    Read the terraform outputs of an s3 tfstate object without reading its resources
+    """
+
+    # Objects are read from several threads and the default boto3 session is not thread safe
+    client = boto3.session.Session().client("s3", region_name=bucket_region)
+
+    try:
+        response = client.get_object(Bucket=bucket, Key=key)
+        try:
+            outputs = read_top_level_member(response["Body"].iter_chunks(STREAM_CHUNK_SIZE), "outputs")
+        finally:
+            response["Body"].close()
+    except Exception as e:
+        LOGGER.exception(e)
+        LOGGER.exception(
+            "Error getting object %s from bucket %s.",
+            key,
+            bucket,
+        )
+        raise e
+
+    return outputs
+
+
+def sign_request(url, method, headers, body):
+    """Sign the request using SigV4"""
+    session = get_session()
+    credentials = session.get_credentials().get_frozen_credentials()
+    request = AWSRequest(method=method, url=url, data=body, headers=headers)
+    SigV4Auth(credentials, "execute-api", os.getenv("REGION")).add_auth(request)
+    return request
+
+
+def invoke_api_gateway(api_url, raw_query=None):
+    """Invoke API Gateway with SigV4 signing"""
+    headers = {"Content-Type": "application/json"}
+    body = json.dumps(raw_query)
+    signed_request = sign_request(api_url, "POST", headers, body)
+    response = requests.post(
+        api_url,
+        data=signed_request.body,
+        headers=dict(signed_request.headers.items()),
+        timeout=3,
     )
 
+    if response.status_code != requests.codes.ok:
+        msg = f"Failed to communicate with API: {api_url}. Code: {response.status_code}, Reason: {response.reason}, Text: {response.text}"
+        raise requests.exceptions.RequestException(msg)
+
+    return response.json()
+
+
+def execute_sor_query(query: str, variables: dict = None) -> dict:
+    """Invoke the GraphQL query via API Gateway"""
+    raw_query = {"query": query, "variables": variables or {}}
+    api_url = os.getenv("SOR_ENDPOINT")
+    LOGGER.info("Invoking mutation call on SoR url %s", api_url)
+    response = invoke_api_gateway(api_url=api_url, raw_query=raw_query)
+    return response
+
+
+def mutate_networkfoundation_data(payload: dict[str, Any]) -> dict:
+    """Mutate foundation data in System of Record"""
     variables: dict[str, Any] = {
         "region": payload["region"],
         "accountId": payload["accountId"],
@@ -183,48 +352,14 @@ def mutate_networkfoundation_data(payload: dict[str, Any]) -> dict:
         "publicAccessCidrs": payload["publicAccessCidrs"],
     }
 
-    response = execute_sor_query(foundation_query, variables)
+    response = execute_sor_query(NETWORK_FOUNDATION_MUTATION, variables)
     LOGGER.info("Network Foundation mutation query response: %s", response)
     return response
 
 
-def lambda_handler(event: dict, context: dict) -> dict:
-    """Entrypoint for AWS Lambda. Main Function."""
-    LOGGER.info("Event received: %s", event)
-
-    cosmos_account_numbers = {
-        "data-production": "140583960461",
-        "data-staging": "421799854738",
-        "dev": "782759316251",
-        "qa": "782759316251",
-        "jenkins-prod": "018711540077",
-        "jenkins-sand": "648372896714",
-        "prod": "123910207971",
-        "sand": "303892774901",
-        "splunk": "195526673873",
-    }
-
-    # Get payload from s3 object
-    s3_message = json.loads(event["Records"][0]["Sns"]["Message"])
-    LOGGER.info("s3_message: %s", s3_message)
-    bucket_name = s3_message["Records"][0]["s3"]["bucket"]["name"]
-    LOGGER.info("bucket_name: %s", bucket_name)
-    key = urllib.parse.unquote_plus(
-        s3_message["Records"][0]["s3"]["object"]["key"], encoding="utf-8"
-    )
-    LOGGER.info("key: %s", key)
-    bucket_region = s3_message["Records"][0]["awsRegion"]
-
-    if not __get_env_variable("SOR_ENDPOINT"):
-        raise KeyError("No SoR endpoint set")
-
-    object_contents = get_object_contents(bucket_name, key, bucket_region)
-    dimension_terraform_outputs = object_contents["outputs"]
-    LOGGER.info("S3 object contents: %s", dimension_terraform_outputs)
-
-    dimension_region = key.split("/", 3)[1]
-    dimension = dimension_region.split("-")[0]
-    region = dimension_region.split(dimension + "-")[1]
+def build_network_payload(key: str, dimension_terraform_outputs: dict) -> dict[str, Any]:
+    """Build the network foundation payload from the dimension-terraform outputs of a tfstate key."""
+    account_id, region = network_location(key)
 
     bastion_whitelist_cidrs_dsv_string = dimension_terraform_outputs["bastion_whitelist_cidrs_dsv"]["value"]
     bastion_whitelist_cidrs_dsv = bastion_whitelist_cidrs_dsv_string.split(",")
@@ -235,7 +370,7 @@ def lambda_handler(event: dict, context: dict) -> dict:
     # All parameters below are read from the dimension-terraform tfstate s3 object that triggered lambda invocation
     payload = {
         "region": region,
-        "accountId": cosmos_account_numbers[dimension],
+        "accountId": account_id,
         "vpcId": dimension_terraform_outputs["vpc_id"]["value"],
         "publicSubnetIds": dimension_terraform_outputs["public_subnet_ids"]["value"],
         "privateSubnetIds": dimension_terraform_outputs["private_subnet_ids"]["value"],
@@ -284,8 +419,183 @@ def lambda_handler(event: dict, context: dict) -> dict:
         "publicAccessCidrs": public_access_cidrs,
     }
 
+    return compact_network_lists(payload)
+
+
+def hydration_key(key: str) -> str:
+    """Return the dimension-region a tfstate key belongs to; updates for the same key are applied in order."""
+    return key.split("/", 3)[1]
+
+
+def get_s3_records(event: dict) -> list[dict]:
+    """List every S3 record of every SNS record of the event."""
+    s3_records = []
+    for sns_record in event["Records"]:
+        s3_message = json.loads(sns_record["Sns"]["Message"])
+        LOGGER.info("s3_message: %s", s3_message)
+        s3_records.extend(s3_message.get("Records", []))
+    return s3_records
+
+
+def get_s3_objects(event: dict) -> list[tuple[str, str, str, str]]:
+    """List the (bucket, key, region, version id) of every S3 object referenced by every SNS record of the event."""
+    s3_objects = []
+    for s3_record in get_s3_records(event):
+        bucket_name = s3_record["s3"]["bucket"]["name"]
+        key = urllib.parse.unquote_plus(s3_record["s3"]["object"]["key"], encoding="utf-8")
+        version_id = s3_record["s3"]["object"].get("versionId")
+        s3_objects.append((bucket_name, key, s3_record["awsRegion"], version_id))
+    return s3_objects
+
+
+def defer_hydration(event: dict) -> int:
+    """
+    Mark every written object as pending and queue a delayed hydration for it.
+
+    Only the delayed message of the last write of a key hydrates it, so a burst of writes is hydrated once.
+    """
+    sqs_client = boto3.session.Session().client("sqs", region_name=getenv("REGION"))
+    table = __get_pending_hydration_table()
+    deferred = 0
+    for s3_record in get_s3_records(event):
+        message = {
+            "bucket": s3_record["s3"]["bucket"]["name"],
+            "key": urllib.parse.unquote_plus(s3_record["s3"]["object"]["key"], encoding="utf-8"),
+            "region": s3_record["awsRegion"],
+            "sequencer": s3_record["s3"]["object"].get("sequencer", ""),
+        }
+        table.put_item(Item={"Id": f"{message['bucket']}/{message['key']}", "Sequencer": message["sequencer"]})
+        sqs_client.send_message(QueueUrl=DEBOUNCE_QUEUE_URL, MessageBody=json.dumps(message), DelaySeconds=DEBOUNCE_SECONDS)
+        deferred += 1
+    LOGGER.info("Deferred hydration of %s objects by %s seconds", deferred, DEBOUNCE_SECONDS)
+    return deferred
+
+
+def is_latest_write(message: dict) -> bool:
+    """Check that no other write of the object was recorded after the one that queued the message."""
+    response = __get_pending_hydration_table().get_item(
+        Key={"Id": f"{message['bucket']}/{message['key']}"}, ConsistentRead=True
+    )
+    return response.get("Item", {}).get("Sequencer") == message["sequencer"]
+
+
+def clear_pending_hydration(message: dict):
+    """Remove the pending record of a hydrated object unless a newer write is already pending."""
+    try:
+        __get_pending_hydration_table().delete_item(
+            Key={"Id": f"{message['bucket']}/{message['key']}"},
+            ConditionExpression="Sequencer = :sequencer",
+            ExpressionAttributeValues={":sequencer": message["sequencer"]},
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+
+
+def hydrate_object(bucket_name: str, key: str, bucket_region: str, version_id: str = None) -> bool:
+    """
+    Read a dimension-terraform tfstate object and hydrate its network foundation in the SoR.
+
+    Returns False when the object or its network foundation was already hydrated and no mutation was sent.
+    """
+    account_id, region = network_location(key)
+    state = get_hydration_state(account_id, region)
+    if version_id and state.get("ObjectKey") == key and state.get("VersionId") == version_id:
+        LOGGER.info("s3://%s/%s version %s is already hydrated", bucket_name, key, version_id)
+        return False
+
+    LOGGER.info("Hydrating s3://%s/%s", bucket_name, key)
+    dimension_terraform_outputs = get_object_outputs(bucket_name, key, bucket_region)
+    LOGGER.info("S3 object contents: %s", dimension_terraform_outputs)
+
+    payload = build_network_payload(key, dimension_terraform_outputs)
+    fingerprint = payload_fingerprint(payload)
+    if state.get("Fingerprint") == fingerprint:
+        LOGGER.info("Network foundation of %s in %s is unchanged, skipping mutation", account_id, region)
+        put_hydration_state(account_id, region, key, version_id, fingerprint)
+        return False
+
     mutation_response = mutate_networkfoundation_data(payload=payload)
     LOGGER.info("Mutation response: %s", mutation_response)
+    if "errors" in mutation_response or (mutation_response.get("data") or {}).get("setNetworkFoundation") is None:
+        # Leave the state untouched so the next update of this tfstate is sent again
+        LOGGER.error("Network foundation mutation of %s in %s was not applied", account_id, region)
+    else:
+        put_hydration_state(account_id, region, key, version_id, fingerprint)
+    return True
+
+
+def hydrate_objects_in_order(s3_objects: list[tuple[str, str, str, str]]) -> dict[tuple[str, str], str]:
+    """Hydrate the objects of one dimension-region one after the other, returning the failures by bucket and key."""
+    failures = {}
+    for bucket_name, key, bucket_region, version_id in s3_objects:
+        try:
+            hydrate_object(bucket_name, key, bucket_region, version_id)
+        except Exception as e:
+            LOGGER.exception("Failed to hydrate s3://%s/%s", bucket_name, key)
+            failures[(bucket_name, key)] = str(e)
+    return failures
+
+
+def hydrate_s3_objects(s3_objects: list[tuple[str, str, str, str]]) -> dict[tuple[str, str], str]:
+    """Hydrate the objects concurrently per dimension-region, returning the failures by bucket and key."""
+    # Updates of different dimension-regions run concurrently, updates of the same one keep their order
+    groups = defaultdict(list)
+    for s3_object in s3_objects:
+        groups[hydration_key(s3_object[1])].append(s3_object)
+
+    failures = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(HYDRATE_MAX_WORKERS, len(groups)))) as executor:
+        for group_failures in executor.map(hydrate_objects_in_order, groups.values()):
+            failures.update(group_failures)
+
+    LOGGER.info("Hydrated %s objects, %s failed", len(s3_objects) - len(failures), len(failures))
+    return failures
+
+
+def hydrate_debounced(records: list[dict]) -> dict:
+    """Hydrate the latest version of the objects whose delayed message belongs to their last write."""
+    messages = {}
+    failures = set()
+    for record in records:
+        try:
+            message = json.loads(record["body"])
+            if is_latest_write(message):
+                # Keyed like the pending hydration table, the same key may be written to several buckets
+                messages[(message["bucket"], message["key"])] = (record["messageId"], message)
+            else:
+                LOGGER.info("s3://%s/%s was written again, waiting for the last write", message["bucket"], message["key"])
+        except Exception:
+            LOGGER.exception("Failed to read debounced hydration %s", record["messageId"])
+            failures.add(record["messageId"])
+
+    s3_objects = [(bucket, key, message["region"], None) for (bucket, key), (_, message) in messages.items()]
+    failed_objects = hydrate_s3_objects(s3_objects)
+    for bucket_key, (message_id, message) in messages.items():
+        if bucket_key in failed_objects:
+            failures.add(message_id)
+        else:
+            clear_pending_hydration(message)
+    return {"batchItemFailures": [{"itemIdentifier": message_id} for message_id in sorted(failures)]}
+
+
+def lambda_handler(event: dict, context: dict) -> dict:
+    """Entrypoint for AWS Lambda. Main Function."""
+    LOGGER.info("Event received: %s", event)
+
+    if not __get_env_variable("SOR_ENDPOINT"):
+        raise KeyError("No SoR endpoint set")
+
+    if event["Records"] and event["Records"][0].get("eventSource") == "aws:sqs":
+        return hydrate_debounced(event["Records"])
+    if DEBOUNCE_QUEUE_URL and PENDING_HYDRATION_TABLE:
+        return {"deferred": defer_hydration(event)}
+
+    s3_objects = get_s3_objects(event)
+    failures = hydrate_s3_objects(s3_objects)
+    if failures:
+        raise RuntimeError(f"Failed to hydrate {len(failures)} objects: {failures}")
+    return {"hydrated": len(s3_objects)}
 
 
 if __name__ == "__main__":
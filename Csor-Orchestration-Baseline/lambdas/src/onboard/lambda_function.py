@@ -6,6 +6,7 @@ import logging
 import requests
 import sys
 import re
+from concurrent.futures import ThreadPoolExecutor
 from botocore.auth import SigV4Auth
 from botocore.awsrequest import AWSRequest
 from botocore.session import get_session
@@ -16,7 +17,9 @@ REGION: str = str(os.getenv('REGION', 'us-east-2')).lower()
 STATUS_OK = 200
 JSON_DECODE_ERROR = 400
 INTERNAL_SERVER_ERROR = 500
+MULTI_STATUS = 207
 STACKTRACE_LIMIT: int = int(os.getenv('STACKTRACE_LIMIT', '10'))
+BULK_MAX_CONCURRENCY: int = int(os.getenv('BULK_MAX_CONCURRENCY', '4'))
 
 CREATE_ACCOUNT_QUERY = '''
                       mutation ($accountId:String!, 
@@ -56,6 +59,19 @@ CREATE_ACCOUNT_QUERY = '''
               }
             }
   '''
+# Variable definitions of the mutation, e.g. ('type', 'AccountType!'), used to validate the accounts
+ACCOUNT_VARIABLES = re.findall(r'\$(\w+)\s*:\s*([\w\[\]!]+)', CREATE_ACCOUNT_QUERY.split('{', 1)[0])
+# Values the SOR schema accepts for the enums and the Region scalar used by the mutation
+SOR_ENUMS = {
+    'AccountType': ('FOUNDATION', 'TENANT'),
+    'Environment': ('DEV', 'QA', 'SAND', 'PROD'),
+    'DataClassification': ('CLASS_1', 'CLASS_2', 'CLASS_3', 'CLASS_4', 'CLASS_5'),
+    'BusinessCriticality': ('LOW', 'STANDARD', 'CRITICAL', 'BUSINESS_CRITICAL', 'MISSION_CRITICAL'),
+    'AccountConnectivity': ('INTERNAL', 'EXTERNAL'),
+    'Region': ('us-east-1', 'us-east-2', 'us-west-2', 'eu-central-1', 'ap-southeast-2', 'ap-south-1', 'ap-south-2',
+               'ap-southeast-1', 'me-central-1'),
+}
+SCALAR_TYPES = {'String': str, 'Boolean': bool}
 
 def configure_logging(log_level: str = 'debug', traceback_limit: int = 10):
     """Configure the root logger and stacktrace setting for the lambda."""
@@ -125,6 +141,88 @@ def get_request_id(event):
     """Retrieve requestID from the event"""
     return  event['requestContext']['requestId']
 
+def compile_type_check(graphql_type):
+    """Compile a GraphQL input type such as [Region!]! into a function returning the problems of a value."""
+    required = graphql_type.endswith('!')
+    inner_type = graphql_type[:-1] if required else graphql_type
+
+    if inner_type.startswith('['):
+        check_item = compile_type_check(inner_type[1:-1])
+        def check_value(name, value):
+            if not isinstance(value, list):
+                return [f"Field '{name}' must be a list"]
+            return [problem for index, item in enumerate(value) for problem in check_item(f"{name}[{index}]", item)]
+    elif inner_type in SOR_ENUMS:
+        allowed = frozenset(SOR_ENUMS[inner_type])
+        def check_value(name, value):
+            if value not in allowed:
+                return [f"Field '{name}' must be one of {', '.join(SOR_ENUMS[inner_type])}, got {value!r}"]
+            return []
+    else:
+        python_type = SCALAR_TYPES[inner_type]
+        def check_value(name, value):
+            if type(value) is not python_type:
+                return [f"Field '{name}' must be a {inner_type}, got {value!r}"]
+            return []
+
+    def check(name, value):
+        if value is None:
+            return [f"Missing required field: {name}"] if required else []
+        return check_value(name, value)
+    return check
+
+# Compiled once per container so validation stays cheap on every request
+ACCOUNT_VALIDATORS = [(name, compile_type_check(graphql_type)) for name, graphql_type in ACCOUNT_VARIABLES]
+
+def validate_account(account):
+    """Return the problems that would make the SOR reject an account record."""
+    if not isinstance(account, dict):
+        return ["Account info must be a JSON object"]
+    return [problem for name, check in ACCOUNT_VALIDATORS for problem in check(name, account.get(name))]
+
+def create_account(endpoint, account, region):
+    """Create one account of a bulk request and return its result for the client."""
+    # Every account gets its own request: createAccount is non-null, so one rejected alias of a
+    # multi-operation mutation would null the data of the accounts that were created with it
+    try:
+        response = invoke_api_gateway(endpoint, {"query": CREATE_ACCOUNT_QUERY, "variables": account}, region)
+    except Exception as err:
+        logging.error("Error creating account %s: %s", account.get("accountId"), err)
+        return {"accountId": account.get("accountId"), "status": "FAILED", "errors": [str(err)]}
+
+    created = (response.get("data") or {}).get("createAccount")
+    if created:
+        return {"accountId": account.get("accountId"), "status": "CREATED", "account": created}
+    errors = [error.get("message") for error in response.get("errors", [])]
+    return {"accountId": account.get("accountId"), "status": "FAILED", "errors": errors or ["Account was not created"]}
+
+def onboard_accounts(endpoint, accounts):
+    """Validate every account, create the valid ones concurrently and return the response for the client."""
+    if not accounts:
+        return client_response(JSON_DECODE_ERROR, str(ValueError("Invalid account info: No accounts to onboard")))
+    results = [None] * len(accounts)
+    valid = []
+    for index, account in enumerate(accounts):
+        problems = validate_account(account)
+        if problems:
+            account_id = account.get("accountId") if isinstance(account, dict) else None
+            results[index] = {"accountId": account_id, "status": "INVALID", "errors": problems}
+        else:
+            valid.append(index)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(BULK_MAX_CONCURRENCY, len(valid)))) as executor:
+        created = executor.map(lambda index: create_account(endpoint, accounts[index], REGION), valid)
+        for index, result in zip(valid, created):
+            results[index] = result
+
+    if all(result["status"] == "CREATED" for result in results):
+        http_code = STATUS_OK
+    elif all(result["status"] == "INVALID" for result in results):
+        http_code = JSON_DECODE_ERROR
+    else:
+        http_code = MULTI_STATUS
+    return client_response(http_code, json.dumps({"results": results}))
+
 def lambda_handler(event, context):
     """Entry point for the Lambda function."""
     configure_logging(LOG_LEVEL, STACKTRACE_LIMIT)
@@ -139,6 +237,13 @@ def lambda_handler(event, context):
     try:
         account_info = json.loads(event['body'])
         logging.info("Parsed the following account onboard info: %s", account_info)
+        if isinstance(account_info, list):
+            return onboard_accounts(SOR_ENDPOINT, account_info)
+        if isinstance(account_info, dict) and isinstance(account_info.get('accounts'), list):
+            return onboard_accounts(SOR_ENDPOINT, account_info['accounts'])
+        problems = validate_account(account_info)
+        if problems:
+            return client_response(JSON_DECODE_ERROR, str(ValueError(f"Invalid account info: {'; '.join(problems)}")))
         gql_response = send_request_to_graphql(SOR_ENDPOINT, account_info, CREATE_ACCOUNT_QUERY, REGION)
         response = client_response(STATUS_OK, str(gql_response))
     except json.JSONDecodeError:
@@ -4,6 +4,7 @@ import json
 import logging
 import os
 import re
+from datetime import datetime, timezone
 from typing import Dict,Tuple, Optional
 
 import boto3
@@ -17,6 +18,10 @@ STATE_FILE_PREFIX: str = 'csor-orchestration-baseline-statefiles-'
 STATE_MACHINE_ARNS: dict = json.loads(os.getenv('STATE_MACHINE_ARNS', "{}"))
 ORCHESTRATION_REGION: str = str(os.getenv('ORCHESTRATION_REGION', 'us-east-2')).lower()
 LOG_LEVEL: str = os.getenv('LOG_LEVEL', 'INFO')
+STATUS_VIEW_TABLE = os.getenv('STATUS_VIEW_TABLE')
+# An IN_PROGRESS view older than this is confirmed in the SOR, in case its terminal status was never recorded
+STATUS_VIEW_MAX_AGE_SECONDS: int = int(os.getenv('STATUS_VIEW_MAX_AGE_SECONDS', '900'))
+EXECUTION_TYPE: str = 'BASELINE'
 
 DEPLOYERS_PER_BU: dict = {
     "Apollo": [
@@ -398,7 +403,63 @@ def parse_request_info(request_context):
 def get_headers(event):
     return event['headers'] if 'headers' in event else None
 
+def __get_status_view_table():
+    """Create a boto3 DynamoDB resource for the latest status view maintained by the execution reporter."""
+    return boto3.resource('dynamodb', region_name=ORCHESTRATION_REGION).Table(STATUS_VIEW_TABLE)
+
+
+def get_latest_status_from_view(account_id: str, tenant_region: str) -> Optional[dict]:
+    """Read the latest execution of the account and region from the status view, if it is known."""
+    if not STATUS_VIEW_TABLE:
+        return None
+    try:
+        response = __get_status_view_table().get_item(Key={'Id': f"ACCOUNT#{account_id}#{tenant_region}#{EXECUTION_TYPE}"})
+    except botocore.exceptions.ClientError as e:
+        logging.warning('Failed to read the status view, falling back to SOR: %s', e)
+        return None
+    return response.get('Item')
+
+
+def is_view_stale(latest_view: dict) -> bool:
+    """Check whether a status view item is older than STATUS_VIEW_MAX_AGE_SECONDS, treating unknown times as stale."""
+    try:
+        event_time = datetime.strptime(latest_view['EventTime'], '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc)
+    except (KeyError, TypeError, ValueError):
+        return True
+    return (datetime.now(timezone.utc) - event_time).total_seconds() > STATUS_VIEW_MAX_AGE_SECONDS
+
+
+def record_started_execution(fcd: dict, execution_arn: str, start_date):
+    """Mark the new execution as the latest, in progress, execution of the account in the status view."""
+    if not STATUS_VIEW_TABLE:
+        return
+    item = {
+        'ExecutionArn': execution_arn,
+        'ExecutionStatus': 'IN_PROGRESS',
+        'Type': EXECUTION_TYPE,
+        'AccountId': fcd['account'],
+        'Region': fcd['region'],
+        'EventTime': start_date.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+    }
+    try:
+        table = __get_status_view_table()
+        table.put_item(Item={'Id': f"ACCOUNT#{fcd['account']}#{fcd['region']}#{EXECUTION_TYPE}", **item})
+        table.put_item(Item={'Id': f"EXECUTION#{execution_arn}", **item})
+    except botocore.exceptions.ClientError as e:
+        logging.warning('Failed to record execution %s in the status view: %s', execution_arn, e)
+
+
 def check_execution_status(account_id: str, tenant_region: str) -> Tuple[bool, Optional[str]]:
+    latest_view = get_latest_status_from_view(account_id, tenant_region)
+    if latest_view:
+        logging.info('Status view: %s', latest_view)
+        if latest_view['ExecutionStatus'] != "IN_PROGRESS":
+            return False, None
+        if not is_view_stale(latest_view):
+            logging.info('Account ID %s: Execution in progress with ARN %s.', account_id, latest_view['ExecutionArn'])
+            return True, latest_view['ExecutionArn']
+        logging.info('Status view of %s is IN_PROGRESS since %s, confirming in SOR', account_id, latest_view.get('EventTime'))
+
     variables = {"id": account_id, "region": tenant_region}
     response = execute_sor_query(ACCOUNT_EXECUTIONS, variables)
     logging.info('SOR Response: %s', response)
@@ -487,6 +548,7 @@ def lambda_handler(event: dict, context: dict) -> dict:
 
     state_file_bucket(ORCHESTRATION_REGION, state_machine_arn)
     state_machine_data = start_state_machine(state_machine_arn, json.dumps(fcd), ORCHESTRATION_REGION)
+    record_started_execution(fcd, state_machine_data['execution_arn'], state_machine_data['start_date'])
 
     # Generate BUs deployer list to hydrate in SOR
     deployers = []
@@ -0,0 +1,200 @@
+"""Garbage collection of deployer task definitions and their task definitions creator table items"""
+
+import json
+import os
+import re
+import sys
+import logging
+from collections import defaultdict
+import boto3
+from botocore.exceptions import ClientError
+
+LOG_LEVEL: str = os.getenv('LOG_LEVEL', 'INFO')
+STACKTRACE_LIMIT: int = int(os.getenv('STACKTRACE_LIMIT', '10'))
+REGION: str = str(os.getenv('REGION', 'us-east-2')).lower()
+DYNAMODB_TABLE_NAME = os.getenv('DYNAMODB_TABLE_NAME')
+STATE_MACHINE_ARNS: list = [arn for arn in os.getenv('STATE_MACHINE_ARNS', '').split(',') if arn]
+KEEP_VERSIONS: int = int(os.getenv('KEEP_VERSIONS', '5'))
+RECENT_EXECUTIONS: int = int(os.getenv('RECENT_EXECUTIONS', '50'))
+GC_BATCH_SIZE: int = int(os.getenv('GC_BATCH_SIZE', '25'))
+DRY_RUN: bool = os.getenv('DRY_RUN', 'true').lower() == 'true'
+TASK_FAMILY_SUFFIX: str = '_baseline'
+FINGERPRINT_PREFIX: str = 'FINGERPRINT#'
+TASK_DEFINITION_ARN = re.compile(r'^arn:aws:ecs:[^:]+:\d+:task-definition/.+:\d+$')
+
+
+def configure_logging(log_level: str = 'info', traceback_limit: int = 10):
+    """Configure the root logger and stacktrace setting for the lambda."""
+    logging.getLogger().setLevel(str(log_level).upper())
+    logging.info('Log level is set to %s.', log_level)
+    if log_level.upper() == "DEBUG":
+        sys.tracebacklimit = traceback_limit
+        logging.debug('Stack traceback limit is %s.', traceback_limit)
+    else:
+        sys.tracebacklimit = 0
+        logging.info('Stack traceback is disabled.')
+
+
+def __get_dynamodb_table():
+    """Create a boto3 DynamoDB resource for the task definitions creator table."""
+    return boto3.resource('dynamodb', region_name=REGION).Table(DYNAMODB_TABLE_NAME)
+
+
+def version_sort_key(version: str) -> tuple:
+    """Sort versions numerically where possible, e.g. 1.10.0 after 1.9.0."""
+    return tuple((0, int(part), '') if part.isdigit() else (1, 0, part) for part in re.split(r'[.\-+]', version))
+
+
+def collect_references(document, name_versions: set, arns: set):
+    """Collect the deployer versions and task definition ARNs referenced anywhere in an execution document."""
+    if isinstance(document, dict):
+        for key, value in document.items():
+            if isinstance(value, str) and "deployer" in key:
+                if TASK_DEFINITION_ARN.match(value):
+                    arns.add(value)
+                else:
+                    name_versions.add(f"{key}:{value}")
+            else:
+                collect_references(value, name_versions, arns)
+    elif isinstance(document, list):
+        for value in document:
+            collect_references(value, name_versions, arns)
+
+
+def list_referencing_executions(sfn_client, state_machine_arn: str) -> list:
+    """List the executions whose task definitions may still be used to start tasks."""
+    # Running executions start their deployers later and failed ones may be retried with the same input
+    executions = []
+    for page in sfn_client.get_paginator('list_executions').paginate(stateMachineArn=state_machine_arn, statusFilter='RUNNING'):
+        executions.extend(page['executions'])
+    for status in ('SUCCEEDED', 'FAILED'):
+        executions.extend(sfn_client.list_executions(
+            stateMachineArn=state_machine_arn, statusFilter=status, maxResults=RECENT_EXECUTIONS
+        )['executions'])
+    return executions
+
+
+def get_recent_references() -> tuple:
+    """Return the deployer versions and task definition ARNs used by the running and recent executions."""
+    sfn_client = boto3.client('stepfunctions', region_name=REGION)
+    name_versions, arns = set(), set()
+    for state_machine_arn in STATE_MACHINE_ARNS:
+        for execution in list_referencing_executions(sfn_client, state_machine_arn):
+            description = sfn_client.describe_execution(executionArn=execution['executionArn'])
+            for field in ('input', 'output'):
+                try:
+                    collect_references(json.loads(description.get(field) or 'null'), name_versions, arns)
+                except ValueError:
+                    logging.warning('Execution %s has a non JSON %s', execution['executionArn'], field)
+    return name_versions, arns
+
+
+def scan_items(table) -> list:
+    """Read every item of the task definitions creator table."""
+    items = []
+    kwargs = {}
+    while True:
+        response = table.scan(**kwargs)
+        items.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            return items
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def latest_revisions(ecs_client, families: set) -> set:
+    """Return the latest active revision of each family, which task definitions creator copies for new versions."""
+    latest = set()
+    for family in families:
+        arns = ecs_client.list_task_definitions(familyPrefix=family, status='ACTIVE', sort='DESC', maxResults=1)
+        latest.update(arns['taskDefinitionArns'][:1])
+    return latest
+
+
+def plan_collection(items: list, referenced_versions: set, referenced_arns: set, latest_arns: set) -> dict:
+    """Decide which Name_Version items to delete and which task definitions to deregister."""
+    versions = defaultdict(list)
+    for item in items:
+        if item.get('Lock_Status') == 'REGISTERED':
+            name, version = item['Name_Version'].split(':', 1)
+            versions[name].append((version, item))
+
+    kept, expired = [], []
+    for name, entries in versions.items():
+        entries.sort(key=lambda entry: version_sort_key(entry[0]), reverse=True)
+        for index, (version, item) in enumerate(entries):
+            if index < KEEP_VERSIONS or item['Name_Version'] in referenced_versions \
+                    or item['TaskDefinitionArn'] in referenced_arns or item['TaskDefinitionArn'] in latest_arns:
+                kept.append(item)
+            else:
+                expired.append(item)
+
+    # Revisions may be shared between versions with identical registrations, keep them while one version needs them
+    kept_arns = {item['TaskDefinitionArn'] for item in kept} | referenced_arns | latest_arns
+    deregister = sorted({item['TaskDefinitionArn'] for item in expired} - kept_arns)
+    fingerprints = [
+        item for item in items
+        if item['Name_Version'].startswith(FINGERPRINT_PREFIX) and item.get('TaskDefinitionArn') in deregister
+    ]
+    return {
+        'kept': sorted(item['Name_Version'] for item in kept),
+        'deleteItems': sorted(item['Name_Version'] for item in expired + fingerprints),
+        'deregister': deregister,
+    }
+
+
+def apply_collection(plan: dict, items: list, table, ecs_client) -> list:
+    """
+    Delete the table items of a plan, then deregister its task definitions in batches, returning the failures.
+
+    Items go first so task definitions creator never resolves a deployer version to a revision being deregistered.
+    """
+    with table.batch_writer() as batch:
+        for name_version in plan['deleteItems']:
+            batch.delete_item(Key={'Name_Version': name_version})
+
+    failures = []
+    for start in range(0, len(plan['deregister']), GC_BATCH_SIZE):
+        for task_definition_arn in plan['deregister'][start:start + GC_BATCH_SIZE]:
+            try:
+                ecs_client.deregister_task_definition(taskDefinition=task_definition_arn)
+            except ClientError as error:
+                logging.error('Failed to deregister %s: %s', task_definition_arn, error)
+                failures.append(task_definition_arn)
+        logging.info('Deregistered %s of %s task definitions', min(start + GC_BATCH_SIZE, len(plan['deregister'])),
+                     len(plan['deregister']))
+
+    # Items whose task definition could not be deregistered are restored so the next run retries them
+    items_by_key = {item['Name_Version']: item for item in items}
+    with table.batch_writer() as batch:
+        for name_version in plan['deleteItems']:
+            if items_by_key[name_version].get('TaskDefinitionArn') in failures:
+                batch.put_item(Item=items_by_key[name_version])
+    return failures
+
+
+def lambda_handler(event, context):
+    """Entry point for the Lambda function."""
+    configure_logging(LOG_LEVEL, STACKTRACE_LIMIT)
+    logging.info('Lambda event: %s', event)
+    logging.debug('Lambda context: %s', context)
+    if not DYNAMODB_TABLE_NAME:
+        raise KeyError("No DYNAMODB_TABLE_NAME set")
+    # Parsed like the DRY_RUN variable, so a string such as "false" from a scheduled event is not truthy
+    dry_run = str((event or {}).get('dryRun', DRY_RUN)).lower() == 'true'
+
+    table = __get_dynamodb_table()
+    ecs_client = boto3.client('ecs', region_name=REGION)
+    items = scan_items(table)
+    referenced_versions, referenced_arns = get_recent_references()
+    families = {
+        item['Name_Version'].split(':', 1)[0] + TASK_FAMILY_SUFFIX for item in items
+        if item.get('Lock_Status') == 'REGISTERED'
+    }
+    plan = plan_collection(items, referenced_versions, referenced_arns, latest_revisions(ecs_client, families))
+    logging.info('Task definitions GC plan (dry run: %s): %s', dry_run, plan)
+
+    report = {'dryRun': dry_run, **plan}
+    if not dry_run:
+        failures = apply_collection(plan, items, table, ecs_client)
+        report['failed'] = failures
+    return report
@@ -1,9 +1,16 @@
 """Task definition creator lambda to create/set ECS task definition for deployer version"""
 
+import hashlib
 import json
 import boto3
 from botocore.exceptions import ClientError
-from time import sleep
+from collections import OrderedDict
+from copy import deepcopy
+from concurrent.futures import ThreadPoolExecutor, wait
+from threading import Lock
+from random import uniform
+from time import monotonic, sleep, time
+from uuid import uuid4
 import logging
 import os
 
@@ -14,6 +21,36 @@ if len(LOGGER.handlers) > 0:
 else:
     logging.basicConfig(level=logging.INFO)
 
+# BatchGetItem reads at most 100 keys per request and may return some of them as unprocessed
+BATCH_GET_MAX_KEYS = 100
+BATCH_GET_MAX_ATTEMPTS = 4
+BATCH_GET_RETRY_DELAY = 0.05
+
+# A REGISTERED Name_Version never changes its TaskDefinitionArn, so warm containers keep them in memory until
+# task_definitions_gc may have deregistered the revision, after which it is checked again
+REGISTERED_CACHE_SIZE = int(os.getenv('REGISTERED_CACHE_SIZE', '512'))
+REGISTERED_CACHE_TTL_SECONDS = int(os.getenv('REGISTERED_CACHE_TTL_SECONDS', '900'))
+REGISTERED_TASK_DEFINITIONS = OrderedDict()
+REGISTERED_TASK_DEFINITIONS_LOCK = Lock()
+
+# Registration lease: a crashed holder only blocks a deployer version until its lease expires
+LOCK_LEASE_SECONDS = int(os.getenv('LOCK_LEASE_SECONDS', '60'))
+LOCK_POLL_BASE_DELAY = 0.1
+LOCK_POLL_MAX_DELAY = 2
+LOCK_WAIT_SECONDS = int(os.getenv('LOCK_WAIT_SECONDS', '10'))
+LOCK_WAIT_MARGIN_SECONDS = int(os.getenv('LOCK_WAIT_MARGIN_SECONDS', '15'))
+
+# Latest revision of each family used as the base of new revisions, refreshed after a short TTL
+TEMPLATE_CACHE_TTL_SECONDS = int(os.getenv('TEMPLATE_CACHE_TTL_SECONDS', '300'))
+TASK_DEFINITION_TEMPLATES = {}
+TASK_DEFINITION_TEMPLATES_LOCK = Lock()
+
+# Items keyed by the fingerprint of a registration payload point at the revision registered for it
+FINGERPRINT_PREFIX = 'FINGERPRINT#'
+
+# Message of the ClientException returned by DescribeTaskDefinition for a revision ECS does not know
+UNKNOWN_TASK_DEFINITION = 'Unable to describe task definition'
+
 
 def __create_ecs_client(region):
     """Create a boto3 ECS Client."""
@@ -22,117 +59,373 @@ def __create_ecs_client(region):
 
 def __get_dynamodb_table(table_name, region):
     """Create a boto3 DynamoDB resource for the table."""
-    return boto3.resource('dynamodb', region_name=region).Table(table_name)
+    return boto3.session.Session().resource('dynamodb', region_name=region).Table(table_name)
 
 
-def lambda_handler(event, context):
-    """Entrypoint for AWS Lambda. Main Function."""
-    LOGGER.info(f"Input BOM received: {event}")
-    bom = event["input"]
+def get_cached_task_definition(dynamodb_table_name, name_version):
+    """Return the cached TaskDefinitionArn of a registered Name_Version, if any."""
+    with REGISTERED_TASK_DEFINITIONS_LOCK:
+        cached = REGISTERED_TASK_DEFINITIONS.get((dynamodb_table_name, name_version))
+        if not cached:
+            return None
+        if cached[0] <= monotonic():
+            del REGISTERED_TASK_DEFINITIONS[(dynamodb_table_name, name_version)]
+            return None
+        REGISTERED_TASK_DEFINITIONS.move_to_end((dynamodb_table_name, name_version))
+        return cached[1]
+
+
+def cache_task_definition(dynamodb_table_name, name_version, task_definition_arn):
+    """Remember a registered Name_Version, evicting the least recently used entries."""
+    with REGISTERED_TASK_DEFINITIONS_LOCK:
+        REGISTERED_TASK_DEFINITIONS[(dynamodb_table_name, name_version)] = (
+            monotonic() + REGISTERED_CACHE_TTL_SECONDS, task_definition_arn
+        )
+        REGISTERED_TASK_DEFINITIONS.move_to_end((dynamodb_table_name, name_version))
+        while len(REGISTERED_TASK_DEFINITIONS) > REGISTERED_CACHE_SIZE:
+            REGISTERED_TASK_DEFINITIONS.popitem(last=False)
+
+
+def get_registered_task_definitions(name_versions, dynamodb_table_name, region):
+    """Look up all Name_Version keys with BatchGetItem and return the TaskDefinitionArn of the REGISTERED ones."""
+    dynamodb = boto3.session.Session().resource('dynamodb', region_name=region)
+    registered = {}
+    keys = [{'Name_Version': name_version} for name_version in dict.fromkeys(name_versions)]
+    for start in range(0, len(keys), BATCH_GET_MAX_KEYS):
+        request_items = {dynamodb_table_name: {'Keys': keys[start:start + BATCH_GET_MAX_KEYS]}}
+        for attempt in range(BATCH_GET_MAX_ATTEMPTS):
+            response = dynamodb.batch_get_item(RequestItems=request_items)
+            for item in response['Responses'].get(dynamodb_table_name, []):
+                if item.get('Lock_Status') == 'REGISTERED':
+                    registered[item['Name_Version']] = item['TaskDefinitionArn']
+            request_items = response.get('UnprocessedKeys')
+            if not request_items:
+                break
+            sleep(BATCH_GET_RETRY_DELAY * 2 ** attempt)
+        # Keys still unprocessed simply go through the registration path, which reads them again
+    return registered
+
+
+def is_active(ecs_client, task_definition_arn):
+    """Check that a task definition can still start tasks, i.e. task_definitions_gc has not deregistered it."""
+    try:
+        response = ecs_client.describe_task_definition(taskDefinition=task_definition_arn)
+    except ClientError as e:
+        # Only a revision ECS does not know is gone, throttling or missing permissions must not register it again
+        error = e.response['Error']
+        if error['Code'] != 'ClientException' or UNKNOWN_TASK_DEFINITION not in error.get('Message', ''):
+            raise e
+        LOGGER.info(f"Task definition {task_definition_arn} cannot be described: {e}")
+        return False
+    return response['taskDefinition'].get('status') == 'ACTIVE'
+
+
+def forget_registration(table, name_version, task_definition_arn):
+    """Delete the REGISTERED item of a deployer version whose task definition was deregistered."""
+    try:
+        table.delete_item(
+            Key={'Name_Version': name_version},
+            ConditionExpression='Lock_Status = :registered AND TaskDefinitionArn = :arn',
+            ExpressionAttributeValues={':registered': 'REGISTERED', ':arn': task_definition_arn}
+        )
+    except ClientError as e:
+        # Another invocation already registered the version again
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise e
+
 
+def get_task_definition_template(ecs_client, task_family):
+    """Return a copy of the latest task definition and tags of a family, from the cache while it is fresh."""
+    with TASK_DEFINITION_TEMPLATES_LOCK:
+        cached = TASK_DEFINITION_TEMPLATES.get(task_family)
+    if cached and cached[0] > monotonic():
+        return deepcopy(cached[1]), deepcopy(cached[2])
+
+    task_definitions = ecs_client.list_task_definitions(
+        familyPrefix=task_family,
+        status='ACTIVE',
+        sort='DESC'
+    )
+    if not task_definitions['taskDefinitionArns']:
+        raise ValueError(f"No ACTIVE task definition found in family {task_family}")
+    latest_task_definition_arn = task_definitions['taskDefinitionArns'][0]
+    LOGGER.info(f"Latest task definition ARN: {latest_task_definition_arn}")
+    response = ecs_client.describe_task_definition(
+        taskDefinition=latest_task_definition_arn,
+        include=[
+            'TAGS',
+        ]
+    )
+    cache_task_definition_template(task_family, response['taskDefinition'], response.get('tags', []))
+    return deepcopy(response['taskDefinition']), deepcopy(response.get('tags', []))
+
+
+def cache_task_definition_template(task_family, task_definition, tags):
+    """Remember the latest revision of a family, e.g. the one this lambda just registered."""
+    with TASK_DEFINITION_TEMPLATES_LOCK:
+        TASK_DEFINITION_TEMPLATES[task_family] = (monotonic() + TEMPLATE_CACHE_TTL_SECONDS, deepcopy(task_definition), deepcopy(tags))
+
+
+def registration_payload(task_family, task_definition, tags):
+    """Build the register_task_definition arguments that copy a task definition."""
+    return {
+        'family': task_family,
+        'containerDefinitions': task_definition['containerDefinitions'],
+        'cpu': task_definition['cpu'],
+        'memory': task_definition['memory'],
+        'networkMode': task_definition['networkMode'],
+        'requiresCompatibilities': task_definition['requiresCompatibilities'],
+        'executionRoleArn': task_definition['executionRoleArn'],
+        'taskRoleArn': task_definition['taskRoleArn'],
+        'volumes': task_definition['volumes'],
+        'tags': tags
+    }
+
+
+def payload_fingerprint(payload):
+    """Hash a registration payload independently of the order of its keys."""
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def acquire_lease(table, name_version, owner):
+    """Take the registration lease of a deployer version if nobody holds it or the holder's lease has expired."""
+    now = int(time())
+    table.put_item(
+        Item={'Name_Version': name_version, 'Lock_Status': 'LOCKED', 'Owner': owner, 'LeaseExpiry': now + LOCK_LEASE_SECONDS},
+        ConditionExpression='attribute_not_exists(Name_Version) OR '
+                            '(Lock_Status = :locked AND (attribute_not_exists(LeaseExpiry) OR LeaseExpiry < :now))',
+        ExpressionAttributeValues={':locked': 'LOCKED', ':now': now}
+    )
+
+
+def mark_registered(table, name_version, owner, task_definition_arn):
+    """Mark a deployer version REGISTERED, provided this owner still holds its registration lease."""
+    table.update_item(
+        Key={'Name_Version': name_version},
+        UpdateExpression='SET TaskDefinitionArn = :arn, Lock_Status = :status REMOVE LeaseExpiry, #owner',
+        ConditionExpression='#owner = :owner',
+        # Owner is a DynamoDB reserved word
+        ExpressionAttributeNames={'#owner': 'Owner'},
+        ExpressionAttributeValues={
+            ':arn': task_definition_arn,
+            ':status': 'REGISTERED',
+            ':owner': owner
+        }
+    )
+
+
+def wait_for_registration(table, name_version, owner, wait_seconds, lock_error):
+    """
+    Poll a locked deployer version with exponential backoff and jitter until it is registered or its lease expires.
+
+    Returns the registered TaskDefinitionArn, or None once the lease has been taken over by this owner.
+    """
+    started = monotonic()
+    waited = 0
+    attempt = 0
+    while True:
+        response = table.get_item(Key={'Name_Version': name_version}, ConsistentRead=True)
+        if response.get('Item', {}).get('Lock_Status') == 'REGISTERED':
+            return response['Item']['TaskDefinitionArn']
+        try:
+            acquire_lease(table, name_version, owner)
+            LOGGER.info(f"Took over the expired registration lease of deployer version: {name_version}")
+            return None
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise e
+            lock_error = e
+
+        delay = uniform(0.5, 1) * min(LOCK_POLL_MAX_DELAY, LOCK_POLL_BASE_DELAY * 2 ** attempt)
+        if waited + delay > wait_seconds or monotonic() - started + delay > wait_seconds:
+            LOGGER.info(f"Error: Deployer {name_version} LOCKED for more than {wait_seconds:.0f} seconds, exiting")
+            raise lock_error
+        sleep(delay)
+        waited += delay
+        attempt += 1
+
+
+def resolve_deployer(name, version, dynamodb_table_name, ecr_repository, region, ecs_client, owner, wait_seconds):
+    """Return the task definition ARN of a deployer version, registering it if it does not exist yet."""
+    # boto3 resources are not thread safe, each deployer gets its own table resource
+    table = __get_dynamodb_table(dynamodb_table_name, region)
+    task_family = name + "_baseline"
+
+    LOGGER.info(f"Finding/Creating task definition for task family {task_family}")
+
+    name_version = name + ":" + version
+    # Check if the version already has a task definition in DynamoDB
+    response = table.get_item(Key={'Name_Version': name_version})
+    if 'Item' in response and response['Item']['Lock_Status'] == 'REGISTERED':
+        task_definition_arn = response['Item']['TaskDefinitionArn']
+        if is_active(ecs_client, task_definition_arn):
+            LOGGER.info(f"Task definition {task_definition_arn} found for deployer version: {name_version}")
+            return task_definition_arn
+        LOGGER.info(f"Task definition {task_definition_arn} of deployer version {name_version} is INACTIVE, registering it again")
+        forget_registration(table, name_version, task_definition_arn)
+
+    # Read the base revision before taking the lease, so a missing family cannot leave the version LOCKED
+    task_definition, tags = get_task_definition_template(ecs_client, task_family)
+
+    LOGGER.info(f"Creating new task definition for deployer version: {name_version}")
+    # Attempt to acquire the registration lease by creating an item in DynamoDB
+    try:
+        acquire_lease(table, name_version, owner)
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise e
+        # Another process holds the lease, wait for it to register the task definition or for its lease to expire
+        LOGGER.info(f"Task definition LOCKED in DynamoDB for deployer version: {name_version}")
+        task_definition_arn = wait_for_registration(table, name_version, owner, wait_seconds, e)
+        if task_definition_arn:
+            LOGGER.info(f"Task definition {task_definition_arn} found for deployer version: {name_version}")
+            return task_definition_arn
+
+    # Use the latest revision of the family as a base, only the deployer image changes
+    template_fingerprint = payload_fingerprint(registration_payload(task_family, task_definition, tags))
+
+    container_definitions = task_definition['containerDefinitions']
+    for container in container_definitions:
+        if "falcon" not in container["image"]:
+            if name == "base_deployer":
+                container['image'] = f"{ecr_repository}/baseline_base_deployer:{version}"
+            else:
+                container['image'] = f"{ecr_repository}/{name_version}"
+
+    # Reuse an existing revision when the registration would be identical to it
+    payload = registration_payload(task_family, task_definition, tags)
+    fingerprint = payload_fingerprint(payload)
+    if fingerprint == template_fingerprint:
+        task_definition_arn = task_definition['taskDefinitionArn']
+    else:
+        task_definition_arn = table.get_item(
+            Key={'Name_Version': FINGERPRINT_PREFIX + fingerprint}
+        ).get('Item', {}).get('TaskDefinitionArn')
+    # The cached template or the fingerprinted revision may have been deregistered since
+    if task_definition_arn and not is_active(ecs_client, task_definition_arn):
+        task_definition_arn = None
+
+    if task_definition_arn:
+        LOGGER.info(f"Reusing identical task definition {task_definition_arn} for deployer version: {name_version}")
+    else:
+        # Register a new task definition with the updated image
+        new_task_definition = ecs_client.register_task_definition(**payload)
+        task_definition_arn = new_task_definition['taskDefinition']['taskDefinitionArn']
+        # The new revision is now the latest one of the family
+        cache_task_definition_template(task_family, new_task_definition['taskDefinition'], new_task_definition.get('tags', tags))
+        table.put_item(Item={
+            'Name_Version': FINGERPRINT_PREFIX + fingerprint,
+            'Lock_Status': 'FINGERPRINT',
+            'TaskDefinitionArn': task_definition_arn
+        })
+
+    # Update DynamoDB with the task definition Arn
+    try:
+        mark_registered(table, name_version, owner, task_definition_arn)
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise e
+        # The lease expired while registering and was taken over, the new holder's result wins
+        LOGGER.info(f"Registration lease of deployer version {name_version} was taken over, reading its result")
+        registered_arn = wait_for_registration(table, name_version, owner, wait_seconds, e)
+        if registered_arn:
+            LOGGER.info(f"Task definition {registered_arn} found for deployer version: {name_version}")
+            return registered_arn
+        # The new holder's lease expired too and this owner holds it again
+        mark_registered(table, name_version, owner, task_definition_arn)
+
+    LOGGER.info(f"Task definition {task_definition_arn} successfully created for deployer version: {name_version}")
+    return task_definition_arn
+
+
+def resolve_bom(bom, context):
+    """Replace the deployer versions of a BOM with their task definition ARNs, registering the missing ones."""
     dynamodb_table_name= str(os.getenv('DYNAMODB_TABLE_NAME'))
     ecr_repository= str(os.getenv('ECR_REPOSITORY'))
     region = str(os.getenv('REGION', 'us-east-2'))
-
-    ecs_client=__create_ecs_client(region)
-
-    table=__get_dynamodb_table(dynamodb_table_name, region)
+    max_workers = int(os.getenv('MAX_PARALLEL_DEPLOYERS', '6'))
+    owner = getattr(context, 'aws_request_id', None) or str(uuid4())
+    # Leave enough of the invocation to register the task definition after taking over an expired lease
+    if hasattr(context, 'get_remaining_time_in_millis'):
+        wait_seconds = max(0, context.get_remaining_time_in_millis() / 1000 - LOCK_WAIT_MARGIN_SECONDS)
+    else:
+        wait_seconds = LOCK_WAIT_SECONDS
 
     deployer_versions = {key: value for key, value in bom.items() if "deployer" in key}
 
+    resolved = {}
     for name, version in deployer_versions.items():
-        task_family = name + "_baseline"
+        task_definition_arn = get_cached_task_definition(dynamodb_table_name, name + ":" + version)
+        if task_definition_arn:
+            resolved[name] = task_definition_arn
+    LOGGER.info(f"Task definitions cached for deployers: {resolved}")
 
-        LOGGER.info(f"Finding/Creating task definition for task family {task_family}")
+    # In steady state every deployer version is already registered and a single BatchGetItem resolves the rest of the BOM
+    uncached = {name: version for name, version in deployer_versions.items() if name not in resolved}
+    if uncached:
+        registered = get_registered_task_definitions(
+            [name + ":" + version for name, version in uncached.items()], dynamodb_table_name, region
+        )
+        # task_definitions_gc deletes the item of a version before deregistering its revision
+        for name, version in uncached.items():
+            if name + ":" + version in registered:
+                resolved[name] = registered[name + ":" + version]
+                cache_task_definition(dynamodb_table_name, name + ":" + version, resolved[name])
+        LOGGER.info(f"Task definitions found for deployers: {resolved}")
+    unresolved = {name: version for name, version in deployer_versions.items() if name not in resolved}
+    ecs_client = __create_ecs_client(region) if unresolved else None
 
-        try:
-            name_version = name + ":" + version
-            # Check if the version already has a task definition in DynamoDB
-            response = table.get_item(Key={'Name_Version': name_version})
-            if 'Item' in response and response['Item']['Lock_Status'] == 'REGISTERED':
-                #Set the task_definition_arn here and continue to the next deployer
-                bom[name] = response['Item']['TaskDefinitionArn']
-                LOGGER.info(f"Task definition {bom[name]} found for deployer version: {name_version}")
-                continue
-
-            LOGGER.info(f"Creating new task definition for deployer version: {name_version}")
-            # Attempt to acquire the lock by creating an item in DynamoDB
-            table.put_item(
-                Item={'Name_Version': name_version, 'Lock_Status': 'LOCKED'},
-                ConditionExpression='attribute_not_exists(Name_Version)'
+    # Deployers are resolved concurrently; the BOM is updated in its original order once all of them are done
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(unresolved)))) as executor:
+        futures = {
+            name: executor.submit(
+                resolve_deployer, name, version, dynamodb_table_name, ecr_repository, region, ecs_client, owner, wait_seconds
             )
+            for name, version in unresolved.items()
+        }
+        wait(futures.values())
 
-            # Describe the current task definition to use as a base
-            task_definitions = ecs_client.list_task_definitions(
-                familyPrefix=task_family,
-                status='ACTIVE',
-                sort='DESC'
-            )
-            latest_task_definition_arn = task_definitions['taskDefinitionArns'][0]
-            LOGGER.info(f"Latest task definition ARN: {latest_task_definition_arn}")
-            response = ecs_client.describe_task_definition(
-                taskDefinition=latest_task_definition_arn,
-                include=[
-                    'TAGS',
-                ]
-            )
+    for name, version in deployer_versions.items():
+        if name not in resolved:
+            resolved[name] = futures[name].result()
+            cache_task_definition(dynamodb_table_name, name + ":" + version, resolved[name])
+        bom[name] = resolved[name]
 
-            container_definitions = response['taskDefinition']['containerDefinitions']
-            for container in container_definitions:
-                if "falcon" not in container["image"]:
-                    if name == "base_deployer":
-                        container['image'] = f"{ecr_repository}/baseline_base_deployer:{version}"
-                    else:
-                        container['image'] = f"{ecr_repository}/{name_version}"
-
-            # Register a new task definition with the updated image
-            new_task_definition = ecs_client.register_task_definition(
-                family=task_family,
-                containerDefinitions=container_definitions,
-                cpu=response['taskDefinition']['cpu'],
-                memory=response['taskDefinition']['memory'],
-                networkMode=response['taskDefinition']['networkMode'],
-                requiresCompatibilities=response['taskDefinition']['requiresCompatibilities'],
-                executionRoleArn=response['taskDefinition']['executionRoleArn'],
-                taskRoleArn=response['taskDefinition']['taskRoleArn'],
-                volumes=response['taskDefinition']['volumes'],
-                tags=response['tags']
-            )
+    return bom
 
-            # Update DynamoDB with the new task definition Arn
-            table.update_item(
-                Key={'Name_Version': name_version},
-                UpdateExpression='SET TaskDefinitionArn = :arn, Lock_Status = :status',
-                ExpressionAttributeValues={
-                    ':arn': new_task_definition['taskDefinition']['taskDefinitionArn'],
-                    ':status': 'REGISTERED'
-                }
-            )
 
-            bom[name] = new_task_definition['taskDefinition']['taskDefinitionArn']
+def handle_image_push(event, context):
+    """Register the task definition of a deployer image as soon as it is pushed to ECR."""
+    detail = event['detail']
+    repository_name = detail.get('repository-name', '')
+    image_tag = detail.get('image-tag')
+    if detail.get('action-type') != 'PUSH' or detail.get('result') != 'SUCCESS' or not image_tag or image_tag == 'latest':
+        LOGGER.info(f"Ignoring ECR event for {repository_name}:{image_tag}")
+        return {}
 
-            LOGGER.info(f"Task definition {bom[name]} successfully created for deployer version: {name_version}")
+    # Deployer images are pushed as <name>:<version>, except the base deployer which uses baseline_base_deployer
+    name = 'base_deployer' if repository_name.endswith('baseline_base_deployer') else repository_name.split('/')[-1]
+    if "deployer" not in name:
+        LOGGER.info(f"Ignoring ECR push of {repository_name}, it is not a deployer image")
+        return {}
+
+    # Only repositories with a <name>_baseline family are deployers, anything else merely has deployer in its name
+    try:
+        get_task_definition_template(__create_ecs_client(str(os.getenv('REGION', 'us-east-2'))), name + "_baseline")
+    except ValueError:
+        LOGGER.info(f"Ignoring ECR push of {repository_name}, there is no {name}_baseline task definition family")
+        return {}
+
+    LOGGER.info(f"Pre-registering task definition for pushed deployer image {name}:{image_tag}")
+    return resolve_bom({name: image_tag}, context)
 
-        except ClientError as e:
-            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
-                # If the item already exists, another process has already registered/locked the task definition
-                LOGGER.info(f"Task definition LOCKED in DynamoDB for deployer version: {name_version}")
-                response = table.get_item(Key={'Name_Version': name_version})
-                if response['Item']['Lock_Status'] == 'REGISTERED':
-                    bom[name] = response['Item']['TaskDefinitionArn']
-                    LOGGER.info(f"Task definition {bom[name]} found for deployer version: {name_version}")
-                else:
-                    LOGGER.info(f"Sleeping for 10 seconds, waiting for task definition for deployer_version {name_version} to be registered by another process")
-                    sleep(10)
-                    response = table.get_item(Key={'Name_Version': name_version})
-                    if response['Item']['Lock_Status'] == 'REGISTERED':
-                        bom[name] = response['Item']['TaskDefinitionArn']
-                        LOGGER.info(f"Task definition {bom[name]} found for deployer version: {name_version}")
-                    else:
-                        LOGGER.info(f"Error: Deployer {name_version} LOCKED for more than 10 seconds, exiting")
-                        raise e
-            else:
-                raise e
 
+def lambda_handler(event, context):
+    """Entrypoint for AWS Lambda. Main Function."""
+    if event.get('source') == 'aws.ecr':
+        return handle_image_push(event, context)
+
+    LOGGER.info(f"Input BOM received: {event}")
+    bom = resolve_bom(event["input"], context)
     LOGGER.info(f"New BOM after converting deployer versions to TaskDefinitionArns: {bom}")
     return bom
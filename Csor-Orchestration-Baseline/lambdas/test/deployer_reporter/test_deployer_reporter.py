@@ -0,0 +1,250 @@
+"""Unit tests for the 'deployer-reporter' lambda code."""
+import copy
+import json
+from unittest.mock import patch
+from pytest import fixture, raises
+import boto3
+import moto.dynamodb
+
+from lambdas.src.deployer_reporter import lambda_function
+
+EXECUTION_ARN: str = "arn:aws:states:us-east-2:123456789012:execution:baseline:execution-name"
+SAMPLE_EVENT: dict = {
+    "version": "0",
+    "id": "3317b2af-7005-947d-b652-f55e762e571a",
+    "detail-type": "ECS Task State Change",
+    "source": "aws.ecs",
+    "account": "123456789012",
+    "region": "us-east-2",
+    "detail": {
+        "taskArn": "arn:aws:ecs:us-east-2:123456789012:task/baseline/0123456789abcdef",
+        "taskDefinitionArn": "arn:aws:ecs:us-east-2:123456789012:task-definition/vpc_baseline:7",
+        "lastStatus": "RUNNING",
+        "version": 3,
+        "startedAt": "2024-01-01T10:00:00.000Z",
+        "overrides": {
+            "containerOverrides": [{
+                "name": "vpc",
+                "environment": [
+                    {"name": "EXECUTION_ID", "value": EXECUTION_ARN},
+                    {"name": "DEPLOYER_NAME", "value": "vpc"},
+                    {"name": "DEPLOYER_VERSION", "value": "1.0.0"},
+                ]
+            }]
+        },
+        "containers": [
+            {"name": "falcon", "image": "123456789012.dkr.ecr.us-east-2.amazonaws.com/falcon-sensor:7.1"},
+            {"name": "vpc", "image": "123456789012.dkr.ecr.us-east-2.amazonaws.com/vpc:1.2.0"},
+        ]
+    }
+}
+
+
+@fixture(autouse=True)
+def mock_env_vars(monkeypatch):
+    """Automatically mock environment variables for all tests."""
+    monkeypatch.setenv("REGION", "us-east-2")
+    monkeypatch.setenv("SOR_ENDPOINT", "https://sor.endpoint")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "test-access-key")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "test-secret-key")
+    monkeypatch.setenv("AWS_SESSION_TOKEN", "test-session-token")
+
+
+def task_event(last_status="RUNNING", version=3, exit_code=None, task_id="0123456789abcdef"):
+    """Build an ECS task state change event for the vpc deployer."""
+    event = copy.deepcopy(SAMPLE_EVENT)
+    event['detail']['lastStatus'] = last_status
+    event['detail']['version'] = version
+    event['detail']['updatedAt'] = f"2024-01-01T10:{version:02d}:00.000Z"
+    event['detail']['taskArn'] = f"arn:aws:ecs:us-east-2:123456789012:task/baseline/{task_id}"
+    if last_status == 'STOPPED':
+        event['detail']['stoppedAt'] = "2024-01-01T10:05:00.000Z"
+        event['detail']['stoppedReason'] = "Essential container in task exited"
+        event['detail']['containers'][1]['exitCode'] = exit_code
+    return event
+
+
+def sor(*responses, statuses=None):
+    """Answer deployer status queries from statuses and mutations with the next response, raising exceptions."""
+    responses = iter(responses)
+
+    def respond(api_url, raw_query):
+        if raw_query['query'].startswith('query DeployerStatuses'):
+            deployers = [{"name": name, "status": status} for name, status in (statuses or {}).items()]
+            return {"data": {"execution0": {"deployers": deployers}}}
+        response = next(responses)
+        if isinstance(response, Exception):
+            raise response
+        return response
+    return respond
+
+
+def mutations(mock_invoke):
+    """Return the variables of the mutations sent to the SoR."""
+    return [call.kwargs['raw_query']['variables'] for call in mock_invoke.call_args_list
+            if call.kwargs['raw_query']['query'].startswith('mutation')]
+
+
+def test_parse_running_task():
+    """A running deployer task is reported as in progress with the version from its image."""
+    update = lambda_function.parse_task_event(task_event())
+    assert update['executionArn'] == EXECUTION_ARN
+    assert update['name'] == 'vpc'
+    assert update['version'] == '1.2.0'
+    assert update['status'] == 'In_Progress'
+
+
+def test_parse_stopped_task():
+    """A failed deployer task is reported as failed, a successful one is left to the deployer."""
+    failed = lambda_function.parse_task_event(task_event('STOPPED', 5, exit_code=1))
+    assert failed['status'] == 'Failed'
+    assert failed['failureReason'] == "Essential container in task exited"
+    assert lambda_function.parse_task_event(task_event('STOPPED', 5, exit_code=0))['status'] is None
+
+
+def test_parse_ignores_other_tasks():
+    """Tasks outside of the baseline families or without an execution are ignored."""
+    event = task_event()
+    event['detail']['taskDefinitionArn'] = "arn:aws:ecs:us-east-2:123456789012:task-definition/other:1"
+    assert lambda_function.parse_task_event(event) is None
+    event = task_event()
+    event['detail']['overrides']['containerOverrides'][0]['environment'] = []
+    assert lambda_function.parse_task_event(event) is None
+
+
+def test_build_batch_mutation():
+    """The batch mutation aliases one updateStateMachineDeployer per deployer."""
+    updates = [lambda_function.parse_task_event(task_event()), lambda_function.parse_task_event(task_event('STOPPED', 5, 2))]
+    query, variables = lambda_function.build_batch_mutation(updates)
+    assert 'update0: updateStateMachineDeployer(' in query
+    assert 'update1: updateStateMachineDeployer(' in query
+    assert variables['status0'] == 'In_Progress'
+    assert variables['status1'] == 'Failed'
+
+
+@patch('lambdas.src.deployer_reporter.lambda_function.invoke_api_gateway')
+def test_lambda_handler_sqs_batch(mock_invoke):
+    """Only the latest state change of each task is sent and failed updates are retried."""
+    mock_invoke.side_effect = sor({"data": {"update0": {"arn": EXECUTION_ARN}, "update1": None}})
+    records = [
+        {"messageId": "1", "body": json.dumps(task_event('PENDING', 1))},
+        {"messageId": "2", "body": json.dumps(task_event('RUNNING', 3))},
+        {"messageId": "3", "body": json.dumps(task_event('STOPPED', 4, exit_code=1, task_id='other'))},
+        {"messageId": "4", "body": "not json"},
+    ]
+    response = lambda_function.lambda_handler({"Records": records}, None)
+
+    assert len(mutations(mock_invoke)) == 1
+    variables = mutations(mock_invoke)[0]
+    assert variables['status0'] == 'In_Progress'
+    assert variables['status1'] == 'Failed'
+    assert 'status2' not in variables
+    assert response == {'batchItemFailures': [{'itemIdentifier': '3'}, {'itemIdentifier': '4'}]}
+
+
+@patch('lambdas.src.deployer_reporter.lambda_function.invoke_api_gateway')
+def test_lambda_handler_single_event_failure(mock_invoke):
+    """A single event raises when the SoR update fails so EventBridge retries it."""
+    mock_invoke.side_effect = Exception("boom")
+    with raises(RuntimeError):
+        lambda_function.lambda_handler(task_event(), None)
+
+
+@patch('lambdas.src.deployer_reporter.lambda_function.invoke_api_gateway')
+def test_lambda_handler_sqs_null_data_falls_back(mock_invoke):
+    """A batch nulled by one failing update is re-sent one update at a time."""
+    mock_invoke.side_effect = sor(
+        {"data": None, "errors": [{"message": "Deployer not found", "path": ["update1"]}]},
+        {"data": {"update0": {"arn": EXECUTION_ARN}}},
+        {"data": None, "errors": [{"message": "Deployer not found", "path": ["update0"]}]},
+    )
+    records = [
+        {"messageId": "1", "body": json.dumps(task_event('RUNNING', 3))},
+        {"messageId": "2", "body": json.dumps(task_event('STOPPED', 4, exit_code=1, task_id='other'))},
+    ]
+    response = lambda_function.lambda_handler({"Records": records}, None)
+
+    assert len(mutations(mock_invoke)) == 3
+    assert response == {'batchItemFailures': [{'itemIdentifier': '2'}]}
+
+
+@fixture(name="timing_table")
+def create_timing_table():
+    """Create the timing table that also orders the task state changes."""
+    with moto.dynamodb.mock_dynamodb():
+        table = boto3.resource('dynamodb', region_name='us-east-2').create_table(
+            TableName='timings',
+            KeySchema=[{'AttributeName': 'ExecutionArn', 'KeyType': 'HASH'}, {'AttributeName': 'StateKey', 'KeyType': 'RANGE'}],
+            AttributeDefinitions=[{'AttributeName': 'ExecutionArn', 'AttributeType': 'S'}, {'AttributeName': 'StateKey', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        with patch.object(lambda_function, 'TIMING_TABLE', 'timings'):
+            yield table
+
+
+@patch('lambdas.src.deployer_reporter.lambda_function.invoke_api_gateway')
+def test_late_running_event_is_dropped(mock_invoke, timing_table):
+    """A RUNNING event arriving after the task stopped does not report the deployer In_Progress again."""
+    mock_invoke.side_effect = sor({"data": {"update0": {"arn": EXECUTION_ARN}}})
+    lambda_function.lambda_handler(task_event('STOPPED', 5, exit_code=0), None)
+    lambda_function.lambda_handler(task_event('RUNNING', 3), None)
+
+    mock_invoke.assert_not_called()
+    item = timing_table.get_item(Key={'ExecutionArn': EXECUTION_ARN, 'StateKey': 'TASK#vpc'})['Item']
+    assert item['TaskStatus'] == 'STOPPED'
+
+    lambda_function.lambda_handler(task_event('RUNNING', 7, task_id='retry'), None)
+    assert len(mutations(mock_invoke)) == 1
+
+
+@patch('lambdas.src.deployer_reporter.lambda_function.invoke_api_gateway')
+def test_redelivered_event_is_reported_again(mock_invoke, timing_table):
+    """An event whose SoR update failed is reported again when it is retried."""
+    mock_invoke.side_effect = sor(Exception("boom"), {"data": {"update0": {"arn": EXECUTION_ARN}}})
+    with raises(RuntimeError):
+        lambda_function.lambda_handler(task_event('RUNNING', 3), None)
+    lambda_function.lambda_handler(task_event('RUNNING', 3), None)
+
+    assert len(mutations(mock_invoke)) == 2
+
+
+@patch('lambdas.src.deployer_reporter.lambda_function.invoke_api_gateway')
+def test_records_task_times(mock_invoke, timing_table):
+    """Start and stop times of deployer tasks are stored in the timing table."""
+    table = timing_table
+    lambda_function.lambda_handler(task_event('STOPPED', 5, exit_code=0), None)
+
+    mock_invoke.assert_not_called()
+    item = table.get_item(Key={'ExecutionArn': EXECUTION_ARN, 'StateKey': 'TASK#vpc'})['Item']
+    assert item['StartedAt'] == "2024-01-01T10:00:00.000Z"
+    assert item['StoppedAt'] == "2024-01-01T10:05:00.000Z"
+
+
+@patch('lambdas.src.deployer_reporter.lambda_function.invoke_api_gateway')
+def test_running_event_after_deployer_finished_is_dropped(mock_invoke, timing_table):
+    """A RUNNING event handled after the deployer wrote its own final status does not move it back to In_Progress."""
+    mock_invoke.side_effect = sor({"data": {"update0": {"arn": EXECUTION_ARN}}}, statuses={"vpc": "Success"})
+    lambda_function.lambda_handler(task_event('RUNNING', 3), None)
+    assert not mutations(mock_invoke)
+
+    mock_invoke.side_effect = sor({"data": {"update0": {"arn": EXECUTION_ARN}}}, statuses={"vpc": "Not_Started"})
+    lambda_function.lambda_handler(task_event('RUNNING', 4), None)
+    assert mutations(mock_invoke)[0]['status0'] == 'In_Progress'
+
+
+@patch('lambdas.src.deployer_reporter.lambda_function.invoke_api_gateway')
+def test_failed_status_read_is_retried(mock_invoke):
+    """In_Progress updates are retried when the deployer statuses cannot be read, Failed ones are still sent."""
+    def respond(api_url, raw_query):
+        if raw_query['query'].startswith('query DeployerStatuses'):
+            raise Exception("boom")
+        return {"data": {"update0": {"arn": EXECUTION_ARN}}}
+    mock_invoke.side_effect = respond
+    records = [
+        {"messageId": "1", "body": json.dumps(task_event('RUNNING', 3))},
+        {"messageId": "2", "body": json.dumps(task_event('STOPPED', 4, exit_code=1, task_id='other'))},
+    ]
+    response = lambda_function.lambda_handler({"Records": records}, None)
+
+    assert [variables['status0'] for variables in mutations(mock_invoke)] == ['Failed']
+    assert response == {'batchItemFailures': [{'itemIdentifier': '1'}]}
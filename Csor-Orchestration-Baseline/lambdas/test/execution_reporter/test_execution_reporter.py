@@ -1,8 +1,12 @@
 """Unit tests for the 'execution-reporter' lambda code."""
+import copy
 import json
 import os
+from datetime import datetime, timedelta
 from unittest.mock import patch, MagicMock
 from pytest import fixture
+import boto3
+import moto.dynamodb
 import moto.sqs
 import moto.stepfunctions
 
@@ -59,6 +63,31 @@ def create_test_queue():
         yield queue
 
 
+@fixture(name="state_table")
+def create_state_table(monkeypatch):
+    """Create the execution state table used to drop stale events."""
+    with moto.mock_dynamodb():
+        client = boto3.client('dynamodb', region_name=REGION)
+        client.create_table(
+            TableName="execution-state",
+            AttributeDefinitions=[{"AttributeName": "ExecutionArn", "AttributeType": "S"}],
+            KeySchema=[{"AttributeName": "ExecutionArn", "KeyType": "HASH"}],
+            BillingMode="PAY_PER_REQUEST"
+        )
+        monkeypatch.setattr(lambda_function, "EXECUTION_STATE_TABLE", "execution-state")
+        monkeypatch.setattr(lambda_function, "REGION", REGION)
+        yield boto3.resource('dynamodb', region_name=REGION).Table("execution-state")
+
+
+def status_event(status, time, redrive_count=0):
+    """Build an execution status change event."""
+    event = copy.deepcopy(SAMPLE_EVENT)
+    event['time'] = time
+    event['detail']['status'] = status
+    event['detail']['redriveCount'] = redrive_count
+    return event
+
+
 def test_update_execution_status_sor():
     """Test the update_execution_status_sor function to update state machine execution status in SOR."""
     with patch('lambdas.src.execution_reporter.lambda_function.execute_sor_query') as mock_execute_sor_query:
@@ -92,6 +121,7 @@ def test_invoke_api_gateway(mock_post):
     response = lambda_function.invoke_api_gateway(api_url=api_url, raw_query=raw_query)
     assert response == {"data": {"result": "test"}}
     mock_post.assert_called_once()
+    assert mock_post.call_args.kwargs['timeout'] == lambda_function.SOR_TIMEOUT_SECONDS
     headers = mock_post.call_args[1]['headers']
 
 def test_sign_request():
@@ -118,3 +148,318 @@ def test_execute_sor_query():
         response = lambda_function.execute_sor_query(query, variables)
         assert response == {"data": {"result": "test"}}
         mock_invoke_api_gateway.assert_called_once()
+
+
+def sqs_record(message_id, execution_arn, status):
+    """Wrap an execution status change event the way SQS delivers it."""
+    event = copy.deepcopy(SAMPLE_EVENT)
+    event['detail']['executionArn'] = execution_arn
+    event['detail']['status'] = status
+    return {"messageId": message_id, "body": json.dumps(event)}
+
+
+def test_build_batch_mutation():
+    """Test that every update gets its own aliased operation and variables."""
+    query, variables = lambda_function.build_batch_mutation([("arn-1", "SUCCEEDED"), ("arn-2", "FAILED")])
+
+    assert "update0: updateStateMachineExecution(executionArn: $executionArn0, status: $executionStatus0)" in query
+    assert "update1: updateStateMachineExecution(executionArn: $executionArn1, status: $executionStatus1)" in query
+    assert variables == {
+        "executionArn0": "arn-1", "executionStatus0": "SUCCEEDED",
+        "executionArn1": "arn-2", "executionStatus1": "FAILED",
+    }
+
+
+@patch('lambdas.src.execution_reporter.lambda_function.invoke_api_gateway')
+def test_lambda_handler_sqs_partial_failure(mock_invoke_api_gateway):
+    """Test that a batch is sent as one request and only the failed events are retried."""
+    mock_invoke_api_gateway.return_value = {
+        "data": {
+            "update0": {"arn": "arn-1", "status": "SUCCEEDED"},
+            "update1": None,
+        },
+        "errors": [{"message": "Execution not found", "path": ["update1"]}],
+    }
+    event = {"Records": [
+        sqs_record("message-1", "arn-1", "SUCCEEDED"),
+        sqs_record("message-2", "arn-2", "FAILED"),
+        {"messageId": "message-3", "body": "not json"},
+    ]}
+
+    response = lambda_function.lambda_handler(event, {})
+
+    mock_invoke_api_gateway.assert_called_once()
+    assert response == {'batchItemFailures': [{'itemIdentifier': 'message-3'}, {'itemIdentifier': 'message-2'}]}
+
+
+@patch('lambdas.src.execution_reporter.lambda_function.invoke_api_gateway')
+def test_lambda_handler_sqs_null_data_falls_back(mock_invoke_api_gateway):
+    """Test that a batch nulled by one failing update is re-sent one update at a time."""
+    not_found = {"data": None, "errors": [{"message": "Execution not found", "path": ["updateStateMachineExecution"]}]}
+    mock_invoke_api_gateway.side_effect = [
+        {"data": None, "errors": [{"message": "Execution not found", "path": ["update1"]}]},
+        {"data": {"updateStateMachineExecution": {"arn": "arn-1", "status": "SUCCEEDED"}}},
+        not_found,
+    ]
+    event = {"Records": [sqs_record("message-1", "arn-1", "SUCCEEDED"), sqs_record("message-2", "arn-2", "FAILED")]}
+
+    response = lambda_function.lambda_handler(event, {})
+
+    assert response == {'batchItemFailures': [{'itemIdentifier': 'message-2'}]}
+    assert mock_invoke_api_gateway.call_args_list[1].kwargs['raw_query']['variables'] == {
+        "executionArn": "arn-1", "executionStatus": "SUCCEEDED"}
+
+
+@patch('lambdas.src.execution_reporter.lambda_function.invoke_api_gateway')
+def test_lambda_handler_sqs_request_failure(mock_invoke_api_gateway):
+    """Test that every event in the batch is retried when the SOR request fails."""
+    mock_invoke_api_gateway.side_effect = RuntimeError("SOR unavailable")
+    event = {"Records": [sqs_record("message-1", "arn-1", "SUCCEEDED"), sqs_record("message-2", "arn-2", "FAILED")]}
+
+    response = lambda_function.lambda_handler(event, {})
+
+    assert response == {'batchItemFailures': [{'itemIdentifier': 'message-1'}, {'itemIdentifier': 'message-2'}]}
+
+
+@patch('lambdas.src.execution_reporter.lambda_function.invoke_api_gateway')
+def test_lambda_handler_sqs_claim_failure(mock_invoke_api_gateway, state_table):
+    """Test that a record whose claim failed is retried and the rest of the batch is still reported."""
+    mock_invoke_api_gateway.return_value = {"data": {"update0": {"arn": "a1", "status": "SUCCEEDED"}}}
+    claim = lambda_function.claim_execution_status
+    throttled = lambda_function.ClientError(
+        {"Error": {"Code": "ProvisionedThroughputExceededException", "Message": "Throttled"}}, "PutItem")
+
+    def throttle_a2(event):
+        if event['detail']['executionArn'] == "a2":
+            raise throttled
+        return claim(event)
+
+    records = [sqs_record("message-1", "a1", "SUCCEEDED"), sqs_record("message-2", "a2", "SUCCEEDED")]
+    with patch.object(lambda_function, 'claim_execution_status', side_effect=throttle_a2):
+        response = lambda_function.lambda_handler({"Records": records}, {})
+
+    assert response == {'batchItemFailures': [{'itemIdentifier': 'message-2'}]}
+    assert mock_invoke_api_gateway.call_args.kwargs['raw_query']['variables']['executionArn0'] == "a1"
+
+    response = lambda_function.lambda_handler({"Records": records[1:]}, {})
+
+    assert response == {'batchItemFailures': []}
+    assert mock_invoke_api_gateway.call_args.kwargs['raw_query']['variables']['executionArn0'] == "a2"
+
+
+def test_claim_execution_status_drops_stale_running(state_table):
+    """Test that a late RUNNING event cannot overwrite a terminal status."""
+    assert lambda_function.claim_execution_status(status_event("SUCCEEDED", "2019-02-26T19:42:21Z"))[0]
+    assert not lambda_function.claim_execution_status(status_event("RUNNING", "2019-02-26T19:40:00Z"))[0]
+    assert not lambda_function.claim_execution_status(status_event("FAILED", "2019-02-26T19:45:00Z"))[0]
+    lambda_function.mark_execution_status_reported(status_event("SUCCEEDED", "2019-02-26T19:42:21Z"))
+    assert not lambda_function.claim_execution_status(status_event("SUCCEEDED", "2019-02-26T19:42:21Z"))[0]
+
+    item = state_table.get_item(Key={"ExecutionArn": SAMPLE_EVENT['detail']['executionArn']})['Item']
+    assert item['ExecutionStatus'] == "SUCCEEDED"
+
+
+def test_claim_execution_status_accepts_redrive(state_table):
+    """Test that a redriven execution can report RUNNING again after a terminal status."""
+    assert lambda_function.claim_execution_status(status_event("FAILED", "2019-02-26T19:42:21Z"))[0]
+    assert lambda_function.claim_execution_status(status_event("RUNNING", "2019-02-26T20:00:00Z", redrive_count=1))[0]
+
+
+@patch('lambdas.src.execution_reporter.lambda_function.execute_sor_query')
+def test_redelivery_after_crash_is_reported(mock_execute_sor_query, state_table):
+    """Test that an event claimed by an invocation that died before the SOR write is reported on redelivery."""
+    event = status_event("SUCCEEDED", "2019-02-26T19:42:21Z")
+    assert lambda_function.claim_execution_status(event)[0]
+
+    lambda_function.lambda_handler(event, {})
+    lambda_function.lambda_handler(event, {})
+
+    mock_execute_sor_query.assert_called_once()
+    item = state_table.get_item(Key={"ExecutionArn": SAMPLE_EVENT['detail']['executionArn']})['Item']
+    assert item['Reported'] is True
+
+
+@patch('lambdas.src.execution_reporter.lambda_function.execute_sor_query')
+def test_lambda_handler_skips_stale_event(mock_execute_sor_query, state_table):
+    """Test that stale events never reach the SOR."""
+    lambda_function.lambda_handler(status_event("SUCCEEDED", "2019-02-26T19:42:21Z"), {})
+    lambda_function.lambda_handler(status_event("RUNNING", "2019-02-26T19:40:00Z"), {})
+
+    mock_execute_sor_query.assert_called_once()
+
+
+@patch('lambdas.src.execution_reporter.lambda_function.execute_sor_query')
+def test_lambda_handler_releases_claim_on_failure(mock_execute_sor_query, state_table):
+    """Test that a status the SOR rejected is not treated as reported when it is retried."""
+    mock_execute_sor_query.side_effect = [RuntimeError("SOR unavailable"), {"data": {}}]
+    event = status_event("SUCCEEDED", "2019-02-26T19:42:21Z")
+
+    lambda_function.lambda_handler(event, {})
+    lambda_function.lambda_handler(event, {})
+
+    assert mock_execute_sor_query.call_count == 2
+
+
+@patch('lambdas.src.execution_reporter.lambda_function.sleep', return_value=None)
+@patch('lambdas.src.execution_reporter.lambda_function.invoke_api_gateway')
+def test_execute_sor_query_retries_transient_failures(mock_invoke_api_gateway, mock_sleep):
+    """Test that failed SOR requests are retried with an exponential backoff."""
+    mock_invoke_api_gateway.side_effect = [
+        lambda_function.requests.exceptions.RequestException("Bad gateway"),
+        lambda_function.requests.exceptions.RequestException("Bad gateway"),
+        {"data": {"result": "test"}},
+    ]
+
+    response = lambda_function.execute_sor_query("query { test }")
+
+    assert response == {"data": {"result": "test"}}
+    assert [call.args[0] for call in mock_sleep.call_args_list] == [0.5, 1.0]
+
+
+@patch('lambdas.src.execution_reporter.lambda_function.sleep', return_value=None)
+@patch('lambdas.src.execution_reporter.lambda_function.invoke_api_gateway')
+def test_lambda_handler_sends_failed_update_to_dlq(mock_invoke_api_gateway, mock_sleep, monkeypatch):
+    """Test that an update still failing after all retries is persisted to the DLQ."""
+    mock_invoke_api_gateway.side_effect = lambda_function.requests.exceptions.RequestException("SOR unavailable")
+    with moto.mock_sqs():
+        sqs = boto3.client('sqs', region_name=REGION)
+        queue_url = sqs.create_queue(QueueName="status-dlq")['QueueUrl']
+        monkeypatch.setattr(lambda_function, "STATUS_DLQ_URL", queue_url)
+        monkeypatch.setattr(lambda_function, "REGION", REGION)
+
+        lambda_function.lambda_handler(copy.deepcopy(SAMPLE_EVENT), {})
+
+        messages = sqs.receive_message(QueueUrl=queue_url, MessageAttributeNames=['All'])['Messages']
+        assert mock_invoke_api_gateway.call_count == lambda_function.SOR_MAX_ATTEMPTS
+        assert json.loads(messages[0]['Body']) == SAMPLE_EVENT
+        assert "SOR unavailable" in messages[0]['MessageAttributes']['error']['StringValue']
+
+
+def history_event(event_type, name, minute):
+    """Build an execution history event for a task state."""
+    details_key = 'stateEnteredEventDetails' if event_type == 'TaskStateEntered' else 'stateExitedEventDetails'
+    return {
+        'type': event_type,
+        'timestamp': datetime(2019, 2, 26, 19, 0) + timedelta(minutes=minute),
+        details_key: {'name': name},
+    }
+
+
+SAMPLE_HISTORY = [
+    {'type': 'ExecutionStarted', 'timestamp': datetime(2019, 2, 26, 19, 0)},
+    history_event('TaskStateEntered', 'Base Deployer', 1),
+    history_event('TaskStateEntered', 'Stackset Deployer', 1),
+    history_event('TaskStateExited', 'Stackset Deployer', 3),
+    history_event('TaskStateExited', 'Base Deployer', 4.5),
+]
+
+
+def test_compute_state_timings():
+    """Test that entered and exited events are paired per task state."""
+    timings = lambda_function.compute_state_timings(SAMPLE_HISTORY)
+
+    durations = {timing['StateName']: float(timing['DurationSeconds']) for timing in timings}
+    assert durations == {'Base Deployer': 210.0, 'Stackset Deployer': 120.0}
+
+
+@patch('lambdas.src.execution_reporter.lambda_function.get_execution_history', return_value=SAMPLE_HISTORY)
+@patch('lambdas.src.execution_reporter.lambda_function.execute_sor_query')
+def test_lambda_handler_records_state_timings(mock_execute_sor_query, mock_get_execution_history, monkeypatch):
+    """Test that a terminal status stores the task timings of the execution."""
+    with moto.mock_dynamodb():
+        boto3.client('dynamodb', region_name=REGION).create_table(
+            TableName="execution-timings",
+            AttributeDefinitions=[
+                {"AttributeName": "ExecutionArn", "AttributeType": "S"},
+                {"AttributeName": "StateKey", "AttributeType": "S"},
+            ],
+            KeySchema=[
+                {"AttributeName": "ExecutionArn", "KeyType": "HASH"},
+                {"AttributeName": "StateKey", "KeyType": "RANGE"},
+            ],
+            BillingMode="PAY_PER_REQUEST"
+        )
+        monkeypatch.setattr(lambda_function, "TIMING_TABLE", "execution-timings")
+        monkeypatch.setattr(lambda_function, "REGION", REGION)
+
+        lambda_function.lambda_handler(copy.deepcopy(SAMPLE_EVENT), {})
+
+        table = boto3.resource('dynamodb', region_name=REGION).Table("execution-timings")
+        item = table.get_item(Key={"ExecutionArn": SAMPLE_EVENT['detail']['executionArn'], "StateKey": "Base Deployer"})['Item']
+        assert item['DurationSeconds'] == 210
+        assert item['ExecutionStatus'] == "SUCCEEDED"
+
+
+@fixture(name="status_view")
+def create_status_view(monkeypatch):
+    """Create the latest status view table."""
+    with moto.mock_dynamodb():
+        boto3.client('dynamodb', region_name=REGION).create_table(
+            TableName="status-view",
+            AttributeDefinitions=[{"AttributeName": "Id", "AttributeType": "S"}],
+            KeySchema=[{"AttributeName": "Id", "KeyType": "HASH"}],
+            BillingMode="PAY_PER_REQUEST"
+        )
+        monkeypatch.setattr(lambda_function, "STATUS_VIEW_TABLE", "status-view")
+        monkeypatch.setattr(lambda_function, "REGION", REGION)
+        yield boto3.resource('dynamodb', region_name=REGION).Table("status-view")
+
+
+def view_event(execution_arn, status, time):
+    """Build a status change event whose input is the configuration document of the account."""
+    event = status_event(status, time)
+    event['detail']['executionArn'] = execution_arn
+    event['detail']['input'] = json.dumps({"account": "081297776604", "region": "us-east-2"})
+    return event
+
+
+@patch('lambdas.src.execution_reporter.lambda_function.execute_sor_query')
+def test_lambda_handler_updates_status_view(mock_execute_sor_query, status_view):
+    """Test that the latest status is readable per execution and per account, region and type."""
+    lambda_function.lambda_handler(view_event("arn-new", "SUCCEEDED", "2019-02-26T19:42:21Z"), {})
+
+    account_item = status_view.get_item(Key={"Id": "ACCOUNT#081297776604#us-east-2#BASELINE"})['Item']
+    assert account_item['ExecutionArn'] == "arn-new"
+    assert account_item['ExecutionStatus'] == "SUCCEEDED"
+    assert status_view.get_item(Key={"Id": "EXECUTION#arn-new"})['Item']['ExecutionStatus'] == "SUCCEEDED"
+
+
+@patch('lambdas.src.execution_reporter.lambda_function.execute_sor_query')
+def test_status_view_keeps_latest_execution(mock_execute_sor_query, status_view):
+    """Test that a late event of an older execution does not replace the latest execution of the account."""
+    status_view.put_item(Item={
+        "Id": "ACCOUNT#081297776604#us-east-2#BASELINE",
+        "ExecutionArn": "arn-new",
+        "ExecutionStatus": "IN_PROGRESS",
+        "EventTime": "2019-02-26T20:00:00Z",
+    })
+
+    lambda_function.lambda_handler(view_event("arn-old", "FAILED", "2019-02-26T19:42:21Z"), {})
+
+    account_item = status_view.get_item(Key={"Id": "ACCOUNT#081297776604#us-east-2#BASELINE"})['Item']
+    assert account_item['ExecutionArn'] == "arn-new"
+    assert status_view.get_item(Key={"Id": "EXECUTION#arn-old"})['Item']['ExecutionStatus'] == "FAILED"
+
+
+@patch('lambdas.src.execution_reporter.lambda_function.sleep', return_value=None)
+@patch('lambdas.src.execution_reporter.lambda_function.invoke_api_gateway')
+def test_status_view_updated_when_sor_write_fails(mock_invoke_api_gateway, mock_sleep, status_view):
+    """Test that a terminal status reaches the view even when the SOR write fails."""
+    mock_invoke_api_gateway.side_effect = lambda_function.requests.exceptions.RequestException("SOR unavailable")
+    status_view.put_item(Item={
+        "Id": "ACCOUNT#081297776604#us-east-2#BASELINE",
+        "ExecutionArn": "arn-new",
+        "ExecutionStatus": "IN_PROGRESS",
+        "EventTime": "2019-02-26T19:00:00Z",
+    })
+
+    lambda_function.lambda_handler(view_event("arn-new", "FAILED", "2019-02-26T19:42:21Z"), {})
+    response = lambda_function.lambda_handler({"Records": [
+        {"messageId": "message-1", "body": json.dumps(view_event("arn-other", "SUCCEEDED", "2019-02-26T19:43:00Z"))}
+    ]}, {})
+
+    assert response == {'batchItemFailures': [{'itemIdentifier': 'message-1'}]}
+    assert status_view.get_item(Key={"Id": "EXECUTION#arn-new"})['Item']['ExecutionStatus'] == "FAILED"
+    account_item = status_view.get_item(Key={"Id": "ACCOUNT#081297776604#us-east-2#BASELINE"})['Item']
+    assert account_item['ExecutionArn'] == "arn-other"
+    assert account_item['ExecutionStatus'] == "SUCCEEDED"
@@ -1,3 +1,256 @@
+"""Unit tests for the 'network-hydrate' lambda code."""
+import json
+from unittest.mock import MagicMock, patch
+from pytest import fixture, raises
+import boto3
+import moto.dynamodb
+import moto.s3
+import moto.sqs
+
+from lambdas.src.network_hydrate import lambda_function
+
+OUTPUT_NAMES = (
+    "vpc_id", "public_subnet_ids", "private_subnet_ids", "private_eks_subnet_ids", "vpc_cidr", "vpc_cidr_allocation",
+    "private_zone_id", "dimension_private_zone_id", "braintree_api_com_zone_id", "fdfg_sftp_whitelist_cidrs",
+    "vpc_dns_addr", "availability_zones_dsv", "asm_endpoint_ips", "autoscaling_endpoint_ips",
+    "cloudformation_endpoint_ips", "dynamodb_endpoint_cidr_blocks", "ec2_endpoint_ips",
+    "elasticloadbalancing_endpoint_ips", "s3_endpoint_cidr_blocks", "sts_endpoint_ips", "logs_endpoint_ips",
+    "efs_endpoint_ips", "sqs_endpoint_ips",
+)
+
+
+@fixture(autouse=True)
+def mock_env_vars(monkeypatch):
+    """Automatically mock environment variables for all tests."""
+    monkeypatch.setenv("REGION", "us-east-2")
+    monkeypatch.setenv("SOR_ENDPOINT", "https://sor.endpoint")
+    monkeypatch.setenv("KUBE_API_ADDITIONAL_WHITELIST_CIDRS", "10.1.0.0/16")
+
+
+def tfstate(vpc_id="vpc-123"):
+    """Build a minimal dimension-terraform tfstate document."""
+    outputs = {name: {"value": f"{name}-value"} for name in OUTPUT_NAMES}
+    outputs["vpc_id"]["value"] = vpc_id
+    outputs["bastion_whitelist_cidrs_dsv"] = {"value": "10.0.0.0/24,10.0.1.0/24"}
+    return {"version": 4, "outputs": outputs}
+
+
+def sns_event(*keys_per_message, sequencer="0055AED6DCD90281E5"):
+    """Build an SNS event wrapping one S3 notification per message."""
+    records = []
+    for keys in keys_per_message:
+        message = {"Records": [
+            {"awsRegion": "us-east-2", "s3": {"bucket": {"name": "tfstate"}, "object": {"key": key, "sequencer": sequencer}}}
+            for key in keys
+        ]}
+        records.append({"Sns": {"Message": json.dumps(message)}})
+    return {"Records": records}
+
+
 def test_nothing():
     # TODO: Complete this test item
     pass
+
+
+def test_build_network_payload():
+    """The account and region are derived from the tfstate key."""
+    payload = lambda_function.build_network_payload("env:/dev-us-east-2/network.tfstate", tfstate()["outputs"])
+    assert payload["accountId"] == "782759316251"
+    assert payload["region"] == "us-east-2"
+    assert payload["vpcId"] == "vpc-123"
+    assert payload["publicAccessCidrs"] == ["10.0.0.0/23", "10.1.0.0/16"]
+
+
+def test_compact_network_lists():
+    """CIDR lists are aggregated per IP version and endpoint IP lists are only deduped."""
+    payload = lambda_function.compact_network_lists({
+        "publicAccessCidrs": ["10.0.0.0/25", "10.0.0.128/25", "", "10.0.0.7/32", "2001:db8::/33", "2001:db8:8000::/33",
+                              "not-a-cidr", "192.168.1.5/24"],
+        "ec2EndpointIps": ["10.0.0.1", "", "10.0.0.2", "10.0.0.1"],
+        "vpcCidrAllocation": ["10.0.0.0/25", "10.0.0.128/25"],
+    })
+    assert payload["publicAccessCidrs"] == ["10.0.0.0/24", "192.168.1.0/24", "2001:db8::/32", "not-a-cidr"]
+    assert payload["ec2EndpointIps"] == ["10.0.0.1", "10.0.0.2"]
+    assert payload["vpcCidrAllocation"] == ["10.0.0.0/25", "10.0.0.128/25"]
+
+
+def test_read_top_level_member_stops_after_member():
+    """Outputs are decoded across chunk boundaries and the resources are never read."""
+    document = {"version": 4, "lineage": "outputs", "outputs": {"vpc_id": {"value": "vpc-é,}\\"}}}
+    raw = json.dumps(document, ensure_ascii=False).encode("utf-8")[:-1] + b', "resources": [{"type": "aws_vpc"'
+
+    def chunks():
+        for start in range(0, len(raw), 3):
+            chunk = raw[start:start + 3]
+            assert b"aws_vpc" not in chunk
+            yield chunk
+
+    assert lambda_function.read_top_level_member(chunks(), "outputs") == document["outputs"]
+    with raises(KeyError):
+        lambda_function.read_top_level_member([b'{"version": 4, "resources": []}'], "outputs")
+
+
+@moto.s3.mock_s3
+def test_get_object_outputs():
+    """Only the outputs of a tfstate object are returned."""
+    s3_client = boto3.client("s3", region_name="us-east-2")
+    s3_client.create_bucket(Bucket="tfstate", CreateBucketConfiguration={"LocationConstraint": "us-east-2"})
+    s3_client.put_object(Bucket="tfstate", Key="env:/dev-us-east-2/network.tfstate", Body=json.dumps(tfstate()))
+    outputs = lambda_function.get_object_outputs("tfstate", "env:/dev-us-east-2/network.tfstate", "us-east-2")
+    assert outputs == tfstate()["outputs"]
+
+
+@patch('lambdas.src.network_hydrate.lambda_function.mutate_networkfoundation_data')
+@patch('lambdas.src.network_hydrate.lambda_function.get_object_outputs')
+def test_lambda_handler_hydrates_every_record(mock_get_object, mock_mutate):
+    """Every S3 record of every SNS record is hydrated, keeping the order of each dimension-region."""
+    mock_get_object.side_effect = lambda bucket, key, region: tfstate(vpc_id=key)["outputs"]
+    event = sns_event(
+        ["env:/dev-us-east-2/network.tfstate", "env:/qa-us-west-2/network.tfstate"],
+        ["env:/dev-us-east-2/eks.tfstate"],
+    )
+    assert lambda_function.lambda_handler(event, None) == {"hydrated": 3}
+
+    vpc_ids = [call.kwargs["payload"]["vpcId"] for call in mock_mutate.call_args_list]
+    assert len(vpc_ids) == 3
+    dev_updates = [vpc_id for vpc_id in vpc_ids if vpc_id.startswith("env:/dev-")]
+    assert dev_updates == ["env:/dev-us-east-2/network.tfstate", "env:/dev-us-east-2/eks.tfstate"]
+
+
+@patch('lambdas.src.network_hydrate.lambda_function.mutate_networkfoundation_data')
+@patch('lambdas.src.network_hydrate.lambda_function.get_object_outputs')
+def test_lambda_handler_reports_failed_records(mock_get_object, mock_mutate):
+    """A failing record does not stop the others and is reported at the end."""
+    def get_object(bucket, key, region):
+        if key.startswith("env:/qa-"):
+            raise ValueError("broken tfstate")
+        return tfstate()["outputs"]
+    mock_get_object.side_effect = get_object
+    event = sns_event(["env:/dev-us-east-2/network.tfstate"], ["env:/qa-us-west-2/network.tfstate"])
+
+    with raises(RuntimeError, match="env:/qa-us-west-2/network.tfstate"):
+        lambda_function.lambda_handler(event, None)
+    mock_mutate.assert_called_once()
+
+
+@fixture(name="state_table")
+def create_state_table():
+    """Create the hydration state table with moto."""
+    with moto.dynamodb.mock_dynamodb():
+        table = boto3.resource('dynamodb', region_name='us-east-2').create_table(
+            TableName='hydration-state',
+            KeySchema=[{'AttributeName': 'Id', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'Id', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        with patch.object(lambda_function, 'HYDRATION_STATE_TABLE', 'hydration-state'):
+            yield table
+
+
+@patch('lambdas.src.network_hydrate.lambda_function.mutate_networkfoundation_data')
+@patch('lambdas.src.network_hydrate.lambda_function.get_object_outputs')
+def test_hydrate_object_skips_unchanged_payload(mock_get_object, mock_mutate, state_table):
+    """An unchanged payload is not mutated again and an already hydrated version is not even read."""
+    key = "env:/dev-us-east-2/network.tfstate"
+    mock_get_object.return_value = tfstate()["outputs"]
+    mock_mutate.return_value = {"data": {"setNetworkFoundation": {}}}
+
+    assert lambda_function.hydrate_object("tfstate", key, "us-east-2", "v1") is True
+    assert lambda_function.hydrate_object("tfstate", key, "us-east-2", "v2") is False
+    assert lambda_function.hydrate_object("tfstate", key, "us-east-2", "v2") is False
+    assert mock_get_object.call_count == 2
+    mock_mutate.assert_called_once()
+    assert state_table.get_item(Key={"Id": "782759316251#us-east-2"})["Item"]["VersionId"] == "v2"
+
+    mock_get_object.return_value = tfstate(vpc_id="vpc-456")["outputs"]
+    assert lambda_function.hydrate_object("tfstate", key, "us-east-2", "v3") is True
+    assert mock_mutate.call_count == 2
+
+
+@patch('lambdas.src.network_hydrate.lambda_function.mutate_networkfoundation_data')
+@patch('lambdas.src.network_hydrate.lambda_function.get_object_outputs')
+def test_hydrate_object_keeps_state_of_unapplied_mutation(mock_get_object, mock_mutate, state_table):
+    """A response without setNetworkFoundation does not record the fingerprint, so the payload is sent again."""
+    key = "env:/dev-us-east-2/network.tfstate"
+    mock_get_object.return_value = tfstate()["outputs"]
+    mock_mutate.side_effect = [{"message": "Forbidden"}, {"data": None}, {"data": {"setNetworkFoundation": {}}}]
+
+    for version_id in ("v1", "v2", "v3"):
+        assert lambda_function.hydrate_object("tfstate", key, "us-east-2", version_id) is True
+    assert mock_mutate.call_count == 3
+    assert state_table.get_item(Key={"Id": "782759316251#us-east-2"})["Item"]["VersionId"] == "v3"
+
+
+@patch('lambdas.src.network_hydrate.lambda_function.sign_request')
+@patch('lambdas.src.network_hydrate.lambda_function.requests.post')
+def test_invoke_api_gateway_raises_on_http_errors(mock_post, mock_sign_request):
+    """A 403 or 5xx from API Gateway is an error rather than a response body."""
+    mock_sign_request.return_value = MagicMock(body="{}", headers={})
+    mock_post.return_value = MagicMock(status_code=403, reason="Forbidden", text='{"message": "Forbidden"}')
+
+    with raises(lambda_function.requests.exceptions.RequestException, match="403"):
+        lambda_function.invoke_api_gateway("https://sor.endpoint", {"query": ""})
+
+
+@patch('lambdas.src.network_hydrate.lambda_function.hydrate_object')
+def test_lambda_handler_debounces_bursts(mock_hydrate):
+    """A burst of writes of the same key is hydrated once, from the delayed message of the last write."""
+    key = "env:/dev-us-east-2/network.tfstate"
+    with moto.sqs.mock_sqs(), moto.dynamodb.mock_dynamodb():
+        queue_url = boto3.client('sqs', region_name='us-east-2').create_queue(QueueName='debounce')['QueueUrl']
+        boto3.resource('dynamodb', region_name='us-east-2').create_table(
+            TableName='pending-hydration',
+            KeySchema=[{'AttributeName': 'Id', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'Id', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        with patch.object(lambda_function, 'DEBOUNCE_QUEUE_URL', queue_url), \
+                patch.object(lambda_function, 'PENDING_HYDRATION_TABLE', 'pending-hydration'), \
+                patch.object(lambda_function, 'DEBOUNCE_SECONDS', 0):
+            assert lambda_function.lambda_handler(sns_event([key], sequencer="01"), None) == {"deferred": 1}
+            assert lambda_function.lambda_handler(sns_event([key], sequencer="02"), None) == {"deferred": 1}
+            mock_hydrate.assert_not_called()
+
+            messages = boto3.client('sqs', region_name='us-east-2').receive_message(
+                QueueUrl=queue_url, MaxNumberOfMessages=10
+            )['Messages']
+            records = [
+                {"messageId": message['MessageId'], "eventSource": "aws:sqs", "body": message['Body']}
+                for message in messages
+            ]
+            assert lambda_function.lambda_handler({"Records": records}, None) == {"batchItemFailures": []}
+
+        mock_hydrate.assert_called_once_with("tfstate", key, "us-east-2", None)
+        table = boto3.resource('dynamodb', region_name='us-east-2').Table('pending-hydration')
+        assert "Item" not in table.get_item(Key={"Id": f"tfstate/{key}"})
+
+
+@patch('lambdas.src.network_hydrate.lambda_function.hydrate_object')
+def test_debounced_hydration_keeps_buckets_apart(mock_hydrate):
+    """The same key written to two buckets is hydrated from both, and only the failing bucket is retried."""
+    key = "env:/dev-us-east-2/network.tfstate"
+
+    def hydrate(bucket_name, *args):
+        if bucket_name == "replica":
+            raise Exception("boom")
+        return True
+    mock_hydrate.side_effect = hydrate
+    with moto.dynamodb.mock_dynamodb():
+        table = boto3.resource('dynamodb', region_name='us-east-2').create_table(
+            TableName='pending-hydration',
+            KeySchema=[{'AttributeName': 'Id', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'Id', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        records = []
+        for bucket in ("tfstate", "replica"):
+            table.put_item(Item={"Id": f"{bucket}/{key}", "Sequencer": "01"})
+            body = {"bucket": bucket, "key": key, "region": "us-east-2", "sequencer": "01"}
+            records.append({"messageId": bucket, "eventSource": "aws:sqs", "body": json.dumps(body)})
+        with patch.object(lambda_function, 'PENDING_HYDRATION_TABLE', 'pending-hydration'):
+            response = lambda_function.lambda_handler({"Records": records}, None)
+
+        assert response == {"batchItemFailures": [{"itemIdentifier": "replica"}]}
+        assert mock_hydrate.call_count == 2
+        assert "Item" not in table.get_item(Key={"Id": f"tfstate/{key}"})
+        assert "Item" in table.get_item(Key={"Id": f"replica/{key}"})
@@ -19,7 +19,8 @@ VARIABLES = '''
         "businessCriticality": "CRITICAL",
         "connectivity": "INTERNAL",
         "baselineChangeApprovalRequired": false,
-        "provisionChangeApprovalRequired": false
+        "provisionChangeApprovalRequired": false,
+        "regions": ["us-east-2"]
     }
 '''
 
@@ -52,7 +53,7 @@ SAMPLE_EVENT: dict = {
         "x-forwarded-port": "443",
         "x-forwarded-proto": "https"
     },
-    "body": json.dumps(VARIABLES),
+    "body": VARIABLES,
     "isBase64Encoded": False
 }
 
@@ -115,3 +116,77 @@ def test_request_id():
     """Test to retreieve the request_id from the events."""
     request_id = get_request_id(SAMPLE_EVENT)
     assert request_id == "f8a8b82c-dd1e-420a-a535-3bd102f22c01"
+
+def bulk_account(account_id):
+    """Build a complete account record for the bulk onboarding tests."""
+    account = json.loads(VARIABLES)
+    account["accountId"] = account_id
+    return account
+
+def bulk_event(body):
+    """Wrap a bulk onboarding body in a copy of the sample event."""
+    event = dict(SAMPLE_EVENT)
+    event['body'] = json.dumps(body)
+    return event
+
+@patch('lambdas.src.onboard.lambda_function.invoke_api_gateway')
+def test_lambda_handler_bulk_success(mock_invoke_api_gateway):
+    """Valid accounts are created with one request each and reported one by one."""
+    mock_invoke_api_gateway.side_effect = lambda endpoint, raw_query, region: {
+        "data": {"createAccount": {"id": raw_query["variables"]["accountId"]}}
+    }
+    accounts = [bulk_account(str(100000000000 + index)) for index in range(12)]
+
+    response = lambda_handler(bulk_event(accounts), {})
+    assert response['statusCode'] == 200
+    results = json.loads(response['body'])['results']
+    assert [result['status'] for result in results] == ['CREATED'] * 12
+    assert [result['accountId'] for result in results] == [account['accountId'] for account in accounts]
+    assert [result['account']['id'] for result in results] == [account['accountId'] for account in accounts]
+    assert mock_invoke_api_gateway.call_count == 12
+
+@patch('lambdas.src.onboard.lambda_function.invoke_api_gateway')
+def test_lambda_handler_bulk_partial_failure(mock_invoke_api_gateway):
+    """A rejected account does not fail the others and invalid accounts are never sent."""
+    def create(endpoint, raw_query, region):
+        if raw_query["variables"]["accountId"] == "100000000001":
+            return {"data": None, "errors": [{"path": ["createAccount"], "message": "Account already exists"}]}
+        return {"data": {"createAccount": {"id": raw_query["variables"]["accountId"]}}}
+    mock_invoke_api_gateway.side_effect = create
+    invalid = bulk_account("100000000002")
+    del invalid["regions"]
+    body = {"accounts": [bulk_account("100000000000"), bulk_account("100000000001"), invalid]}
+
+    response = lambda_handler(bulk_event(body), {})
+    assert response['statusCode'] == 207
+    results = json.loads(response['body'])['results']
+    assert results[0] == {"accountId": "100000000000", "status": "CREATED", "account": {"id": "100000000000"}}
+    assert results[1] == {"accountId": "100000000001", "status": "FAILED", "errors": ["Account already exists"]}
+    assert results[2] == {"accountId": "100000000002", "status": "INVALID", "errors": ["Missing required field: regions"]}
+    assert mock_invoke_api_gateway.call_count == 2
+
+@patch('lambdas.src.onboard.lambda_function.invoke_api_gateway')
+def test_lambda_handler_bulk_rejects_empty_list(mock_invoke_api_gateway):
+    """An empty bulk request is malformed input rather than a successful onboarding of nothing."""
+    for body in ([], {"accounts": []}):
+        response = lambda_handler(bulk_event(body), {})
+        assert response['statusCode'] == 400
+        assert 'Invalid account info: No accounts to onboard' in response['body']
+    mock_invoke_api_gateway.assert_not_called()
+
+@patch('lambdas.src.onboard.lambda_function.send_request_to_graphql')
+def test_lambda_handler_rejects_invalid_account(mock_send_request_to_graphql):
+    """Malformed accounts are rejected with a 400 naming every problem, without calling the SOR."""
+    account = json.loads(VARIABLES)
+    account["type"] = "SHARED"
+    account["regions"] = ["us-east-2", "mars-north-1"]
+    account["baselineChangeApprovalRequired"] = "false"
+    del account["owner"]
+
+    response = lambda_handler(bulk_event(account), {})
+    assert response['statusCode'] == 400
+    assert "Field 'type' must be one of FOUNDATION, TENANT, got 'SHARED'" in response['body']
+    assert "Missing required field: owner" in response['body']
+    assert "Field 'regions[1]' must be one of" in response['body']
+    assert "Field 'baselineChangeApprovalRequired' must be a Boolean, got 'false'" in response['body']
+    mock_send_request_to_graphql.assert_not_called()
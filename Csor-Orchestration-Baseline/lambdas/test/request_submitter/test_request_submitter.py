@@ -1,5 +1,6 @@
 import json
 import os
+from datetime import datetime, timezone
 from types import SimpleNamespace
 from unittest.mock import patch
 
@@ -418,3 +419,77 @@ def test_check_execution_status_in_progress(mock_execute_sor_query):
 
     assert is_in_progress is True
     assert execution_arn == 'arn:aws:states:us-east-2:123456789012:execution:test:test-execution'
+
+
+@pytest.fixture(name="status_view")
+def create_status_view(monkeypatch):
+    """Create the latest status view table maintained by the execution reporter."""
+    with mock_aws():
+        boto3.client('dynamodb', region_name='us-east-2').create_table(
+            TableName="status-view",
+            AttributeDefinitions=[{"AttributeName": "Id", "AttributeType": "S"}],
+            KeySchema=[{"AttributeName": "Id", "KeyType": "HASH"}],
+            BillingMode="PAY_PER_REQUEST"
+        )
+        monkeypatch.setattr(lambda_function, "STATUS_VIEW_TABLE", "status-view")
+        yield boto3.resource('dynamodb', region_name='us-east-2').Table("status-view")
+
+
+@patch('lambdas.src.request_submitter.lambda_function.execute_sor_query')
+def test_check_execution_status_reads_status_view(mock_execute_sor_query, status_view):
+    """Test that the status view answers the admission check without querying the SOR."""
+    status_view.put_item(Item={
+        "Id": "ACCOUNT#1234#us-east-2#BASELINE",
+        "ExecutionArn": "arn:aws:states:us-east-2:123456789012:execution:test:test-execution",
+        "ExecutionStatus": "IN_PROGRESS",
+        "EventTime": datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+    })
+
+    is_in_progress, execution_arn = lambda_function.check_execution_status("1234", "us-east-2")
+
+    assert is_in_progress is True
+    assert execution_arn == 'arn:aws:states:us-east-2:123456789012:execution:test:test-execution'
+    mock_execute_sor_query.assert_not_called()
+
+
+@patch('lambdas.src.request_submitter.lambda_function.execute_sor_query')
+def test_check_execution_status_confirms_stale_view(mock_execute_sor_query, status_view):
+    """Test that an old IN_PROGRESS view is confirmed in the SOR, whose terminal status wins."""
+    status_view.put_item(Item={
+        "Id": "ACCOUNT#1234#us-east-2#BASELINE",
+        "ExecutionArn": "arn:aws:states:us-east-2:123456789012:execution:test:test-execution",
+        "ExecutionStatus": "IN_PROGRESS",
+        "EventTime": "2024-01-01T12:00:00Z",
+    })
+    mock_execute_sor_query.return_value = {'data': {'accounts': [{'baseline': [
+        {'latest': {'arn': 'arn:aws:states:us-east-2:123456789012:execution:test:test-execution', 'status': 'FAILED'}}
+    ]}]}}
+
+    is_in_progress, execution_arn = lambda_function.check_execution_status("1234", "us-east-2")
+
+    assert is_in_progress is False
+    assert execution_arn is None
+    mock_execute_sor_query.assert_called_once()
+
+
+@patch('lambdas.src.request_submitter.lambda_function.execute_sor_query')
+def test_check_execution_status_falls_back_to_sor(mock_execute_sor_query, status_view):
+    """Test that accounts missing from the status view are checked in the SOR."""
+    mock_execute_sor_query.return_value = {'data': {'accounts': [{'baseline': []}]}}
+
+    is_in_progress, execution_arn = lambda_function.check_execution_status("1234", "us-east-2")
+
+    assert is_in_progress is False
+    mock_execute_sor_query.assert_called_once()
+
+
+def test_record_started_execution(status_view):
+    """Test that a started execution becomes the latest in progress execution of the account."""
+    start_date = datetime(2024, 1, 1, 12, 0, tzinfo=timezone.utc)
+    lambda_function.record_started_execution(SAMPLE_BOM, "arn:execution", start_date)
+
+    item = status_view.get_item(Key={"Id": "ACCOUNT#081297776604#us-east-2#BASELINE"})['Item']
+    assert item['ExecutionArn'] == "arn:execution"
+    assert item['ExecutionStatus'] == "IN_PROGRESS"
+    assert item['EventTime'] == "2024-01-01T12:00:00Z"
+    assert status_view.get_item(Key={"Id": "EXECUTION#arn:execution"})['Item']['ExecutionStatus'] == "IN_PROGRESS"
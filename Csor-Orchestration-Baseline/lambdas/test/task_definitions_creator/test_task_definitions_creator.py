@@ -38,6 +38,12 @@ def mock_env_vars(monkeypatch):
     monkeypatch.setenv("DYNAMODB_TABLE_NAME", DYNAMODB_TABLE_NAME)
     monkeypatch.setenv("ECR_REPOSITORY", ECR_REPOSITORY)
 
+@pytest.fixture(autouse=True)
+def clear_registered_cache():
+    """Start every test with an empty warm-container cache."""
+    lambda_function.REGISTERED_TASK_DEFINITIONS.clear()
+    lambda_function.TASK_DEFINITION_TEMPLATES.clear()
+
 def create_test_dynamodb():
     """Create a test dynamodb table."""
     client = boto3.client('dynamodb', region_name='us-east-2')
@@ -60,7 +66,7 @@ def setup_test_env(event):
     table = boto3.resource('dynamodb', region_name='us-east-2').Table(DYNAMODB_TABLE_NAME)
     for name, version in event['input'].items():
 
-        ecs_client.register_task_definition(
+        task_definition = ecs_client.register_task_definition(
             family = name + "_baseline",
             containerDefinitions=[{"image": f"{ECR_REPOSITORY}/{name}:{version}"}],
             cpu="1024",
@@ -71,12 +77,12 @@ def setup_test_env(event):
             taskRoleArn="task-role-arn-1234",
             tags=[{"key": "test", "value": "true"}],
             volumes=[{"name": "test-volume"}]
-        )
+        )['taskDefinition']
 
         test_item = {
             "Name_Version": f"{name}:{version}",
             "Lock_Status": "REGISTERED",
-            "TaskDefinitionArn": f"arn-{name}-{version}"
+            "TaskDefinitionArn": task_definition['taskDefinitionArn']
         }
         table.put_item(Item=test_item)
 
@@ -99,7 +105,7 @@ def test_arn_exists(sample_event):
     assert new_bom
 
     for deployer, version in sample_event['input'].items():
-        assert new_bom[deployer] == f"arn-{deployer}-{version}"
+        assert new_bom[deployer] == f"arn:aws:ecs:us-east-2:123456789012:task-definition/{deployer}_baseline:1"
 
 @mock_dynamodb
 @mock_ecs
@@ -133,13 +139,15 @@ def test_new_arns(sample_event, sample_new_event):
 @patch('lambdas.src.task_definitions_creator.lambda_function.sleep', return_value=None)
 @mock_dynamodb
 @mock_ecs
-def test_fails_when_locked(sample_event, sample_new_event):
+def test_fails_when_locked(mock_sleep, sample_event, sample_new_event):
     """Test that we successfully fail if a dynamodb item remains locked"""
     setup_test_env(sample_event)
     table = boto3.resource('dynamodb', region_name='us-east-2').Table(DYNAMODB_TABLE_NAME)
     item = {
         "Name_Version": f"test_deployer:{sample_new_event['input']['test_deployer']}",
-        "Lock_Status": "LOCKED"
+        "Lock_Status": "LOCKED",
+        "Owner": "another-invocation",
+        "LeaseExpiry": int(time.time()) + 600
     }
     table.put_item(Item=item)
 
@@ -154,7 +162,7 @@ async def release_lock(sample_new_event, table):
             UpdateExpression='SET TaskDefinitionArn = :arn, Lock_Status = :status',
             ExpressionAttributeValues={
                 ':status': 'REGISTERED',
-                ':arn': 'locked-status-arn'
+                ':arn': 'arn:aws:ecs:us-east-2:123456789012:task-definition/test_deployer_baseline:1'
             }
     )
 
@@ -174,4 +182,274 @@ def test_succeeds_when_lock_is_released(sample_event, sample_new_event):
     new_bom = lambda_function.lambda_handler(copy.deepcopy(sample_new_event), {})
     assert new_bom
 
-    assert new_bom['test_deployer'] == 'locked-status-arn'
+    assert new_bom['test_deployer'] == 'arn:aws:ecs:us-east-2:123456789012:task-definition/test_deployer_baseline:1'
+
+@mock_dynamodb
+@mock_ecs
+def test_bom_is_unchanged_apart_from_arns(sample_event, sample_new_event):
+    """Test that deployers resolved in parallel keep the BOM keys, order and non-deployer values."""
+    setup_test_env(sample_event)
+    event = copy.deepcopy(sample_new_event)
+    event['input'] = {"account_id": "123456789012", **event['input'], "region": "us-east-2"}
+    new_bom = lambda_function.lambda_handler(copy.deepcopy(event), {})
+
+    assert list(new_bom) == list(event['input'])
+    assert new_bom['account_id'] == "123456789012"
+    assert new_bom['region'] == "us-east-2"
+    for deployer in sample_new_event['input']:
+        assert new_bom[deployer] == f"arn:aws:ecs:us-east-2:123456789012:task-definition/{deployer}_baseline:2"
+
+@mock_dynamodb
+@mock_ecs
+def test_registered_bom_uses_one_batch_read(sample_event):
+    """Test that a fully registered BOM is resolved with BatchGetItem and no per-deployer reads."""
+    setup_test_env(sample_event)
+    with patch.object(lambda_function, 'resolve_deployer') as mock_resolve:
+        new_bom = lambda_function.lambda_handler(copy.deepcopy(sample_event), {})
+
+    mock_resolve.assert_not_called()
+    for deployer, version in sample_event['input'].items():
+        assert new_bom[deployer] == f"arn:aws:ecs:us-east-2:123456789012:task-definition/{deployer}_baseline:1"
+
+def test_unprocessed_keys_are_retried():
+    """Test that keys returned as unprocessed by BatchGetItem are requested again."""
+    table_keys = [{'Name_Version': 'test_deployer:1.0.0'}, {'Name_Version': 'network_deployer:1.0.0'}]
+    responses = [
+        {'Responses': {DYNAMODB_TABLE_NAME: [{'Name_Version': 'test_deployer:1.0.0', 'Lock_Status': 'REGISTERED',
+                                              'TaskDefinitionArn': 'arn-test'}]},
+         'UnprocessedKeys': {DYNAMODB_TABLE_NAME: {'Keys': table_keys[1:]}}},
+        {'Responses': {DYNAMODB_TABLE_NAME: [{'Name_Version': 'network_deployer:1.0.0', 'Lock_Status': 'LOCKED'}]},
+         'UnprocessedKeys': {}},
+    ]
+    with patch.object(lambda_function.boto3.session, 'Session') as mock_session, \
+            patch.object(lambda_function, 'sleep') as mock_sleep:
+        mock_session.return_value.resource.return_value.batch_get_item.side_effect = responses
+        registered = lambda_function.get_registered_task_definitions(
+            ['test_deployer:1.0.0', 'network_deployer:1.0.0'], DYNAMODB_TABLE_NAME, 'us-east-2'
+        )
+
+    assert registered == {'test_deployer:1.0.0': 'arn-test'}
+    mock_sleep.assert_called_once()
+
+@mock_dynamodb
+@mock_ecs
+def test_cached_bom_makes_no_calls(sample_event):
+    """Test that a BOM resolved once is resolved again by a warm container without any AWS call."""
+    setup_test_env(sample_event)
+    first_bom = lambda_function.lambda_handler(copy.deepcopy(sample_event), {})
+
+    with patch.object(lambda_function, 'boto3') as mock_boto3:
+        second_bom = lambda_function.lambda_handler(copy.deepcopy(sample_event), {})
+
+    assert mock_boto3.mock_calls == []
+    assert second_bom == first_bom
+
+def test_registered_cache_is_bounded():
+    """Test that the least recently used entries are evicted beyond the cache size."""
+    with patch.object(lambda_function, 'REGISTERED_CACHE_SIZE', 2):
+        lambda_function.cache_task_definition(DYNAMODB_TABLE_NAME, 'a:1', 'arn-a')
+        lambda_function.cache_task_definition(DYNAMODB_TABLE_NAME, 'b:1', 'arn-b')
+        assert lambda_function.get_cached_task_definition(DYNAMODB_TABLE_NAME, 'a:1') == 'arn-a'
+        lambda_function.cache_task_definition(DYNAMODB_TABLE_NAME, 'c:1', 'arn-c')
+
+    assert lambda_function.get_cached_task_definition(DYNAMODB_TABLE_NAME, 'b:1') is None
+    assert lambda_function.get_cached_task_definition(DYNAMODB_TABLE_NAME, 'a:1') == 'arn-a'
+
+@mock_dynamodb
+@mock_ecs
+def test_takes_over_expired_lease(sample_event, sample_new_event):
+    """Test that a lease left behind by a crashed holder is taken over and the version registered."""
+    setup_test_env(sample_event)
+    table = boto3.resource('dynamodb', region_name='us-east-2').Table(DYNAMODB_TABLE_NAME)
+    name_version = f"test_deployer:{sample_new_event['input']['test_deployer']}"
+    table.put_item(Item={
+        "Name_Version": name_version,
+        "Lock_Status": "LOCKED",
+        "Owner": "crashed-invocation",
+        "LeaseExpiry": int(time.time()) - 1
+    })
+
+    context = MagicMock(aws_request_id="this-invocation")
+    context.get_remaining_time_in_millis.return_value = 60000
+    new_bom = lambda_function.lambda_handler(copy.deepcopy(sample_new_event), context)
+
+    assert new_bom['test_deployer'] == "arn:aws:ecs:us-east-2:123456789012:task-definition/test_deployer_baseline:2"
+    item = table.get_item(Key={'Name_Version': name_version})['Item']
+    assert item['Lock_Status'] == 'REGISTERED'
+    assert 'Owner' not in item
+    assert 'LeaseExpiry' not in item
+
+@mock_dynamodb
+@mock_ecs
+def test_taken_over_lease_keeps_new_owner_result(sample_event):
+    """Test that a holder whose lease was taken over while registering returns the new owner's result."""
+    setup_test_env(sample_event)
+    table = boto3.resource('dynamodb', region_name='us-east-2').Table(DYNAMODB_TABLE_NAME)
+    get_template = lambda_function.get_task_definition_template
+
+    def slow_template(ecs_client, task_family):
+        # The lease expires while this holder reads the template and another owner registers the version
+        table.put_item(Item={
+            "Name_Version": "test_deployer:1.0.1",
+            "Lock_Status": "REGISTERED",
+            "TaskDefinitionArn": "arn-registered-by-new-owner"
+        })
+        return get_template(ecs_client, task_family)
+
+    with patch.object(lambda_function, 'get_task_definition_template', side_effect=slow_template):
+        task_definition_arn = lambda_function.resolve_deployer(
+            "test_deployer", "1.0.1", DYNAMODB_TABLE_NAME, ECR_REPOSITORY, 'us-east-2',
+            boto3.client('ecs', region_name='us-east-2'), "this-invocation", 10
+        )
+
+    assert task_definition_arn == "arn-registered-by-new-owner"
+    item = table.get_item(Key={'Name_Version': "test_deployer:1.0.1"})['Item']
+    assert item['TaskDefinitionArn'] == "arn-registered-by-new-owner"
+
+@patch('lambdas.src.task_definitions_creator.lambda_function.sleep', return_value=None)
+@mock_dynamodb
+def test_wait_stops_at_deadline(mock_sleep):
+    """Test that polling backs off exponentially and gives up within the wait budget."""
+    create_test_dynamodb()
+    table = boto3.resource('dynamodb', region_name='us-east-2').Table(DYNAMODB_TABLE_NAME)
+    table.put_item(Item={"Name_Version": "test_deployer:2.0.0", "Lock_Status": "LOCKED", "LeaseExpiry": int(time.time()) + 600})
+    lock_error = botocore.exceptions.ClientError({'Error': {'Code': 'ConditionalCheckFailedException'}}, 'PutItem')
+
+    with pytest.raises(botocore.exceptions.ClientError):
+        lambda_function.wait_for_registration(table, "test_deployer:2.0.0", "owner", 3, lock_error)
+
+    delays = [call.args[0] for call in mock_sleep.call_args_list]
+    assert sum(delays) <= 3
+    assert all(delay <= lambda_function.LOCK_POLL_MAX_DELAY for delay in delays)
+    assert delays[0] <= lambda_function.LOCK_POLL_BASE_DELAY
+
+@mock_dynamodb
+@mock_ecs
+def test_template_is_cached_per_family(sample_event):
+    """Test that successive versions of a family reuse the cached template and patch only the image."""
+    setup_test_env(sample_event)
+    ecs_client = MagicMock(wraps=boto3.client('ecs', region_name='us-east-2'))
+    with patch.object(lambda_function, '__create_ecs_client', return_value=ecs_client):
+        for version in ("1.0.1", "1.0.2"):
+            lambda_function.lambda_handler({"input": {"test_deployer": version}}, {})
+
+    assert ecs_client.list_task_definitions.call_count == 1
+    assert ecs_client.describe_task_definition.call_count == 1
+    task_def = boto3.client('ecs', region_name='us-east-2').describe_task_definition(
+        taskDefinition="test_deployer_baseline:3", include=['TAGS']
+    )
+    assert task_def['taskDefinition']['containerDefinitions'][0]['image'] == f"{ECR_REPOSITORY}/test_deployer:1.0.2"
+    assert task_def['taskDefinition']['cpu'] == "1024"
+    assert task_def['tags'] == [{"key": "test", "value": "true"}]
+
+def ecr_push_event(repository_name, image_tag, result="SUCCESS"):
+    """Build an EventBridge ECR image push event."""
+    return {
+        "source": "aws.ecr",
+        "detail-type": "ECR Image Action",
+        "detail": {
+            "action-type": "PUSH",
+            "result": result,
+            "repository-name": repository_name,
+            "image-tag": image_tag,
+            "image-digest": "sha256:7f5b2640fe6fb4f46592dfd3410c4a79dac4f89e4782432e0378abcd1234"
+        }
+    }
+
+@mock_dynamodb
+@mock_ecs
+def test_image_push_pre_registers_task_definition(sample_event, sample_new_event):
+    """Test that pushing a deployer image registers its task definition before any execution needs it."""
+    setup_test_env(sample_event)
+    assert lambda_function.lambda_handler(ecr_push_event("test_deployer", "1.0.1"), {}) == {
+        "test_deployer": "arn:aws:ecs:us-east-2:123456789012:task-definition/test_deployer_baseline:2"
+    }
+    assert lambda_function.lambda_handler(ecr_push_event("falcon-sensor", "7.1"), {}) == {}
+    assert lambda_function.lambda_handler(ecr_push_event("network_deployer", "1.0.1", "FAILURE"), {}) == {}
+    assert lambda_function.lambda_handler(ecr_push_event("deployer-tools", "1.0.1"), {}) == {}
+
+    lambda_function.REGISTERED_TASK_DEFINITIONS.clear()
+    with patch.object(lambda_function, 'resolve_deployer') as mock_resolve:
+        new_bom = lambda_function.lambda_handler({"input": {"test_deployer": "1.0.1"}}, {})
+    mock_resolve.assert_not_called()
+    assert new_bom["test_deployer"] == "arn:aws:ecs:us-east-2:123456789012:task-definition/test_deployer_baseline:2"
+
+@mock_dynamodb
+@mock_ecs
+def test_inactive_registration_is_replaced(sample_event):
+    """Test that a version whose revision was deregistered by the GC gets a new ACTIVE revision."""
+    setup_test_env(sample_event)
+    table = boto3.resource('dynamodb', region_name='us-east-2').Table(DYNAMODB_TABLE_NAME)
+    ecs_client = boto3.client('ecs', region_name='us-east-2')
+    ecs_client.register_task_definition(
+        family="test_deployer_baseline", containerDefinitions=[{"image": f"{ECR_REPOSITORY}/test_deployer:1.0.1"}],
+        cpu="1024", memory="3072", networkMode="awsvpc", requiresCompatibilities=["FARGATE"],
+        executionRoleArn="role-arn-1234", taskRoleArn="task-role-arn-1234", volumes=[{"name": "test-volume"}]
+    )
+    # task_definitions_gc deletes the item of the version before deregistering its revision
+    table.delete_item(Key={'Name_Version': 'test_deployer:1.0.0'})
+    ecs_client.deregister_task_definition(taskDefinition="test_deployer_baseline:1")
+
+    new_bom = lambda_function.lambda_handler({"input": {"test_deployer": "1.0.0"}}, {})
+
+    task_definition_arn = new_bom["test_deployer"]
+    assert task_definition_arn == "arn:aws:ecs:us-east-2:123456789012:task-definition/test_deployer_baseline:3"
+    assert ecs_client.describe_task_definition(taskDefinition=task_definition_arn)['taskDefinition']['status'] == 'ACTIVE'
+    item = table.get_item(Key={'Name_Version': 'test_deployer:1.0.0'})['Item']
+    assert item['Lock_Status'] == 'REGISTERED'
+    assert item['TaskDefinitionArn'] == task_definition_arn
+
+def test_registered_cache_expires():
+    """Test that cached ARNs are looked up again once task_definitions_gc may have deregistered them."""
+    with patch.object(lambda_function, 'REGISTERED_CACHE_TTL_SECONDS', 0):
+        lambda_function.cache_task_definition(DYNAMODB_TABLE_NAME, 'a:1', 'arn-a')
+
+    assert lambda_function.get_cached_task_definition(DYNAMODB_TABLE_NAME, 'a:1') is None
+    assert not lambda_function.REGISTERED_TASK_DEFINITIONS
+
+def test_is_active_only_fails_for_unknown_revisions():
+    """Test that only an unknown revision counts as deregistered and other describe errors are raised."""
+    ecs_client = MagicMock()
+    ecs_client.describe_task_definition.side_effect = botocore.exceptions.ClientError(
+        {"Error": {"Code": "ClientException", "Message": "Unable to describe task definition."}}, "DescribeTaskDefinition")
+    assert not lambda_function.is_active(ecs_client, "arn-a")
+
+    for code in ("ThrottlingException", "AccessDeniedException"):
+        ecs_client.describe_task_definition.side_effect = botocore.exceptions.ClientError(
+            {"Error": {"Code": code, "Message": "Rate exceeded"}}, "DescribeTaskDefinition")
+        with pytest.raises(botocore.exceptions.ClientError):
+            lambda_function.is_active(ecs_client, "arn-a")
+
+@mock_dynamodb
+@mock_ecs
+def test_missing_family_does_not_lock_version(sample_event):
+    """Test that a deployer without a task definition family fails before taking the registration lease."""
+    setup_test_env(sample_event)
+    table = boto3.resource('dynamodb', region_name='us-east-2').Table(DYNAMODB_TABLE_NAME)
+
+    with pytest.raises(ValueError):
+        lambda_function.lambda_handler({"input": {"unknown_deployer": "1.0.0"}}, {})
+    assert 'Item' not in table.get_item(Key={'Name_Version': 'unknown_deployer:1.0.0'})
+
+@mock_dynamodb
+@mock_ecs
+def test_identical_revisions_are_reused(sample_event):
+    """Test that a registration identical to an existing revision reuses its ARN instead of registering again."""
+    setup_test_env(sample_event)
+    table = boto3.resource('dynamodb', region_name='us-east-2').Table(DYNAMODB_TABLE_NAME)
+    ecs_client = boto3.client('ecs', region_name='us-east-2')
+
+    # The latest revision already runs this image although the table lost its item
+    table.delete_item(Key={'Name_Version': 'test_deployer:1.0.0'})
+    new_bom = lambda_function.lambda_handler({"input": {"test_deployer": "1.0.0"}}, {})
+    assert new_bom["test_deployer"] == "arn:aws:ecs:us-east-2:123456789012:task-definition/test_deployer_baseline:1"
+
+    # An older revision is found through the fingerprint of its registration
+    lambda_function.lambda_handler({"input": {"test_deployer": "1.0.1"}}, {})
+    lambda_function.lambda_handler({"input": {"test_deployer": "1.0.2"}}, {})
+    table.delete_item(Key={'Name_Version': 'test_deployer:1.0.1'})
+    lambda_function.REGISTERED_TASK_DEFINITIONS.clear()
+    new_bom = lambda_function.lambda_handler({"input": {"test_deployer": "1.0.1"}}, {})
+
+    assert new_bom["test_deployer"] == "arn:aws:ecs:us-east-2:123456789012:task-definition/test_deployer_baseline:2"
+    assert len(ecs_client.list_task_definitions(familyPrefix="test_deployer_baseline")['taskDefinitionArns']) == 3
@@ -0,0 +1,161 @@
+"""Unit tests for the 'task-definitions-gc' lambda code."""
+import json
+from unittest.mock import patch
+from pytest import fixture
+import boto3
+from moto import mock_dynamodb, mock_ecs
+
+from lambdas.src.task_definitions_gc import lambda_function
+
+REGION: str = 'us-east-2'
+TABLE_NAME: str = 'task-definitions'
+VERSIONS: list = ["1.2.0", "1.9.0", "1.10.0", "1.10.1"]
+
+
+@fixture(autouse=True)
+def gc_settings():
+    """Configure the lambda for a small retention."""
+    with patch.object(lambda_function, 'DYNAMODB_TABLE_NAME', TABLE_NAME), \
+            patch.object(lambda_function, 'KEEP_VERSIONS', 2), \
+            patch.object(lambda_function, 'STATE_MACHINE_ARNS', []):
+        yield
+
+
+@fixture(name="registered")
+def create_registered_versions():
+    """Register one revision per version of the vpc deployer and record them in the table."""
+    with mock_dynamodb(), mock_ecs():
+        table = boto3.resource('dynamodb', region_name=REGION).create_table(
+            TableName=TABLE_NAME,
+            KeySchema=[{'AttributeName': 'Name_Version', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'Name_Version', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        ecs_client = boto3.client('ecs', region_name=REGION)
+        arns = {}
+        for version in VERSIONS:
+            arn = ecs_client.register_task_definition(
+                family="vpc_deployer_baseline",
+                containerDefinitions=[{"name": "vpc", "image": f"1234.ecr.repo/vpc_deployer:{version}"}]
+            )['taskDefinition']['taskDefinitionArn']
+            arns[version] = arn
+            table.put_item(Item={"Name_Version": f"vpc_deployer:{version}", "Lock_Status": "REGISTERED", "TaskDefinitionArn": arn})
+        table.put_item(Item={"Name_Version": "FINGERPRINT#abc", "Lock_Status": "FINGERPRINT", "TaskDefinitionArn": arns["1.2.0"]})
+        table.put_item(Item={"Name_Version": "vpc_deployer:2.0.0", "Lock_Status": "LOCKED"})
+        yield table, arns
+
+
+def test_version_sort_key():
+    """Versions are ordered numerically."""
+    assert sorted(VERSIONS, key=lambda_function.version_sort_key) == VERSIONS
+
+
+def test_dry_run_reports_without_changes(registered):
+    """A dry run only reports what would be collected."""
+    table, arns = registered
+    with patch.object(lambda_function, 'latest_revisions', return_value={arns["1.10.1"]}):
+        report = lambda_function.lambda_handler({"dryRun": True}, None)
+
+    assert report['dryRun'] is True
+    assert report['kept'] == ["vpc_deployer:1.10.0", "vpc_deployer:1.10.1"]
+    assert report['deregister'] == sorted([arns["1.2.0"], arns["1.9.0"]])
+    assert report['deleteItems'] == ["FINGERPRINT#abc", "vpc_deployer:1.2.0", "vpc_deployer:1.9.0"]
+    assert table.get_item(Key={"Name_Version": "vpc_deployer:1.2.0"}).get('Item')
+
+
+def test_dry_run_override_is_parsed(registered):
+    """The dryRun override is parsed like the DRY_RUN variable, so "false" is not truthy."""
+    _, arns = registered
+    with patch.object(lambda_function, 'latest_revisions', return_value={arns["1.10.1"]}), \
+            patch.object(lambda_function, 'apply_collection', return_value=[]) as apply:
+        assert lambda_function.lambda_handler({"dryRun": "False"}, None)['dryRun'] is False
+        assert lambda_function.lambda_handler({"dryRun": "TRUE"}, None)['dryRun'] is True
+        with patch.object(lambda_function, 'DRY_RUN', True):
+            assert lambda_function.lambda_handler({}, None)['dryRun'] is True
+
+    assert apply.call_count == 1
+
+
+def test_collects_unreferenced_versions(registered):
+    """Old versions are collected unless a running or recent execution still references them."""
+    table, arns = registered
+    with patch.object(lambda_function, 'latest_revisions', return_value={arns["1.10.1"]}), \
+            patch.object(lambda_function, 'get_recent_references', return_value=({"vpc_deployer:1.9.0"}, set())):
+        report = lambda_function.lambda_handler({"dryRun": False}, None)
+
+    assert report['deregister'] == [arns["1.2.0"]]
+    assert report['failed'] == []
+    assert table.get_item(Key={"Name_Version": "vpc_deployer:1.2.0"}).get('Item') is None
+    assert table.get_item(Key={"Name_Version": "FINGERPRINT#abc"}).get('Item') is None
+    assert table.get_item(Key={"Name_Version": "vpc_deployer:1.9.0"}).get('Item')
+    assert table.get_item(Key={"Name_Version": "vpc_deployer:2.0.0"})['Item']['Lock_Status'] == 'LOCKED'
+    ecs_client = boto3.client('ecs', region_name=REGION)
+    assert ecs_client.describe_task_definition(taskDefinition=arns["1.2.0"])['taskDefinition']['status'] == 'INACTIVE'
+    assert ecs_client.describe_task_definition(taskDefinition=arns["1.9.0"])['taskDefinition']['status'] == 'ACTIVE'
+
+
+def test_items_are_deleted_before_deregistering(registered):
+    """Items go before their revision is deregistered and are restored when deregistering fails."""
+    table, arns = registered
+    ecs_client = boto3.client('ecs', region_name=REGION)
+    deregistered = []
+
+    def deregister(taskDefinition):
+        assert table.get_item(Key={"Name_Version": "vpc_deployer:1.2.0"}).get('Item') is None
+        deregistered.append(taskDefinition)
+        if taskDefinition == arns["1.9.0"]:
+            raise lambda_function.ClientError({"Error": {"Code": "ThrottlingException"}}, "DeregisterTaskDefinition")
+        return {}
+
+    with patch.object(lambda_function, 'latest_revisions', return_value={arns["1.10.1"]}), \
+            patch.object(lambda_function.boto3, 'client', return_value=ecs_client), \
+            patch.object(ecs_client, 'deregister_task_definition', side_effect=deregister):
+        report = lambda_function.lambda_handler({"dryRun": False}, None)
+
+    assert deregistered == sorted([arns["1.2.0"], arns["1.9.0"]])
+    assert report['failed'] == [arns["1.9.0"]]
+    assert table.get_item(Key={"Name_Version": "vpc_deployer:1.2.0"}).get('Item') is None
+    assert table.get_item(Key={"Name_Version": "vpc_deployer:1.9.0"})['Item']['TaskDefinitionArn'] == arns["1.9.0"]
+
+
+def test_get_recent_references():
+    """Deployer versions and task definition ARNs are collected from execution inputs and outputs."""
+    arn = "arn:aws:ecs:us-east-2:123456789012:task-definition/vpc_deployer_baseline:7"
+    with patch.object(lambda_function, 'STATE_MACHINE_ARNS', ["state-machine"]), \
+            patch.object(lambda_function.boto3, 'client') as mock_client:
+        sfn_client = mock_client.return_value
+        sfn_client.get_paginator.return_value.paginate.return_value = [{"executions": []}]
+        sfn_client.list_executions.return_value = {"executions": [{"executionArn": "execution"}]}
+        sfn_client.describe_execution.return_value = {
+            "input": json.dumps({"input": {"base_deployer": "3.1.0", "region": "us-east-2"}}),
+            "output": json.dumps([{"vpc_deployer": arn}])
+        }
+        name_versions, arns = lambda_function.get_recent_references()
+
+    sfn_client.list_executions.assert_any_call(stateMachineArn="state-machine", statusFilter='SUCCEEDED', maxResults=50)
+    assert name_versions == {"base_deployer:3.1.0"}
+    assert arns == {arn}
+
+
+def test_running_and_failed_executions_are_referenced():
+    """Running executions and failed ones that may be retried keep their task definitions."""
+    running = "arn:aws:ecs:us-east-2:123456789012:task-definition/vpc_deployer_baseline:8"
+    with patch.object(lambda_function, 'STATE_MACHINE_ARNS', ["state-machine"]), \
+            patch.object(lambda_function.boto3, 'client') as mock_client:
+        sfn_client = mock_client.return_value
+        sfn_client.get_paginator.return_value.paginate.return_value = [
+            {"executions": [{"executionArn": "running-1"}]}, {"executions": [{"executionArn": "running-2"}]}
+        ]
+        sfn_client.list_executions.side_effect = lambda statusFilter, **kwargs: {
+            "executions": [{"executionArn": "failed"}] if statusFilter == 'FAILED' else []
+        }
+        sfn_client.describe_execution.side_effect = lambda executionArn: {
+            "running-1": {"input": json.dumps({"vpc_deployer": running})},
+            "running-2": {"input": json.dumps({"base_deployer": "3.2.0"})},
+            "failed": {"input": json.dumps({"base_deployer": "3.1.0"}), "output": None},
+        }[executionArn]
+        name_versions, arns = lambda_function.get_recent_references()
+
+    sfn_client.get_paginator.return_value.paginate.assert_called_once_with(stateMachineArn="state-machine", statusFilter='RUNNING')
+    assert name_versions == {"base_deployer:3.1.0", "base_deployer:3.2.0"}
+    assert arns == {running}